@@ -0,0 +1,254 @@
+import logging
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from . import shared_arrays
+from .embedding_index import INDEX_DIR, _normalise
+
+logger = logging.getLogger(__name__)
+
+# 案例数达到该值后场景预筛选改用近似索引，否则仍是精确扫描
+ANN_MIN_CASES = int(os.environ.get('ANN_MIN_CASES', 50000))
+# 每次查询探测的簇数：越大召回越高、越慢
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 8))
+ANN_NLIST = int(os.environ.get('ANN_NLIST', 0))  # 0: sqrt(n)
+ANN_TRAIN_SAMPLE = int(os.environ.get('ANN_TRAIN_SAMPLE', 64))  # training vectors per cluster
+# 增量插入使规模超过训练时的该倍数后重新聚类
+ANN_RETRAIN_FACTOR = float(os.environ.get('ANN_RETRAIN_FACTOR', 4))
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (cosine) on L2-normalised ``vectors``; returns k unit centroids"""
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=k)
+        # 空簇重新取一个随机样本
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+        centroids = _normalise(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file approximate index over L2-normalised scenario embeddings.
+
+    Vectors are bucketed by their nearest k-means centroid; a query scans only the
+    ``nprobe`` buckets whose centroids are closest to it, so cost grows with
+    nlist + nprobe * n / nlist instead of n. Rows are keyed by case id and text
+    hash like ScenarioIndex, and ``sync`` applies only the differences. The
+    state is swapped as one tuple, so searches never see a half-applied update.
+    Like ScenarioIndex it is published through shared_arrays and mapped by
+    every worker; the inverted lists are views into the mapped arrays.
+    """
+
+    def __init__(self, model_name: str, directory: str = INDEX_DIR, nprobe: int = ANN_NPROBE,
+                 nlist: int = ANN_NLIST):
+        self.model_name = model_name
+        self.directory = directory
+        self.nprobe = nprobe
+        self.nlist = nlist
+        # (centroids, lists, corpus_version, trained_size)；lists 为每簇的 (ids, hashes, vectors)
+        self._state: Tuple[Optional[np.ndarray], tuple, Optional[int], int] = (None, (), None, 0)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        safe_name = self.model_name.replace('/', '__')
+        return f"scenarios-{safe_name}-ivf"
+
+    @property
+    def corpus_version(self) -> Optional[int]:
+        return self._state[2]
+
+    def __len__(self):
+        return sum(len(ids) for ids, _, _ in self._state[1])
+
+    def list_sizes(self) -> np.ndarray:
+        return np.array([len(ids) for ids, _, _ in self._state[1]], dtype=np.int64)
+
+    def train(self, ids: np.ndarray, hashes: np.ndarray, vectors: np.ndarray, corpus_version: Optional[int] = None):
+        """Cluster ``vectors`` and rebuild every inverted list from scratch"""
+        vectors = _normalise(np.asarray(vectors, dtype=np.float32))
+        n = len(vectors)
+        if n == 0:
+            with self._lock:
+                self._state = (None, (), corpus_version, 0)
+            return
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        sample = vectors
+        if n > nlist * ANN_TRAIN_SAMPLE:
+            sample = vectors[np.random.default_rng(0).choice(n, size=nlist * ANN_TRAIN_SAMPLE, replace=False)]
+        centroids = kmeans(sample, nlist)
+        lists = _bucket(centroids, np.asarray(ids, dtype=np.int64), np.asarray(hashes, dtype='U40'), vectors)
+        with self._lock:
+            self._state = (centroids, lists, corpus_version, n)
+
+    def add(self, ids: np.ndarray, hashes: np.ndarray, vectors: np.ndarray):
+        """Insert rows into the lists of their nearest centroids (ids must not be present yet)"""
+        with self._lock:
+            centroids, lists, version, trained = self._state
+            if centroids is None:
+                raise ValueError("IVF index is not trained")
+            self._state = (centroids, _append(centroids, lists, ids, hashes, vectors), version, trained)
+
+    def remove(self, ids: np.ndarray) -> int:
+        """Drop rows by case id; returns the number removed"""
+        with self._lock:
+            centroids, lists, version, trained = self._state
+            lists, removed = _drop(lists, np.asarray(ids, dtype=np.int64))
+            self._state = (centroids, lists, version, trained)
+            return removed
+
+    def sync(self, ids: np.ndarray, hashes: np.ndarray, vectors: np.ndarray, corpus_version: int) -> int:
+        """Bring the index in line with a full (ids, hashes, vectors) table.
+
+        Rows whose id or text hash changed are re-inserted; rows no longer present
+        are removed. Retrains when the table has outgrown the clustering by
+        ANN_RETRAIN_FACTOR. Returns the number of rows inserted.
+        """
+        with shared_arrays.leader_lock(self.directory, self.name):
+            # 其他 worker 已发布该版本时直接映射
+            meta = shared_arrays.current_meta(self.directory, self.name)
+            if meta is not None and meta.get('corpus_version') == corpus_version and self.load():
+                return 0
+            inserted = self._sync(ids, hashes, vectors, corpus_version)
+            self.save()
+            self.load()
+            return inserted
+
+    def _sync(self, ids: np.ndarray, hashes: np.ndarray, vectors: np.ndarray, corpus_version: int) -> int:
+        ids = np.asarray(ids, dtype=np.int64)
+        hashes = np.asarray(hashes, dtype='U40')
+        centroids, lists, _, trained = self._state
+        if centroids is None or len(ids) > trained * ANN_RETRAIN_FACTOR:
+            self.train(ids, hashes, vectors, corpus_version)
+            return len(ids)
+
+        old_ids = np.concatenate([l[0] for l in lists]) if lists else np.empty(0, dtype=np.int64)
+        old_hashes = np.concatenate([l[1] for l in lists]) if lists else np.empty(0, dtype='U40')
+        keep = _matches(old_ids, old_hashes, ids, hashes)
+        fresh = ~_matches(ids, hashes, old_ids, old_hashes)
+        with self._lock:
+            centroids, lists, _, trained = self._state
+            lists, _ = _drop(lists, old_ids[~keep])
+            if fresh.any():
+                lists = _append(centroids, lists, ids[fresh], hashes[fresh], vectors[fresh])
+            self._state = (centroids, lists, corpus_version, trained)
+        return int(fresh.sum())
+
+    def search(self, query: np.ndarray, threshold: Optional[float] = None, k: Optional[int] = None,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate (case ids, cosine scores) of rows scoring >= ``threshold`` and/or the top ``k``.
+
+        Results are sorted by descending score.
+        """
+        centroids, lists, _, _ = self._state
+        if centroids is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = _normalise(np.asarray(query, dtype=np.float32))
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        closeness = centroids @ query
+        probe = np.argpartition(-closeness, nprobe - 1)[:nprobe] if nprobe < len(centroids) else range(len(centroids))
+
+        probed = [lists[c] for c in probe if len(lists[c][0])]
+        if not probed:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate([p[0] for p in probed])
+        scores = np.concatenate([p[2] @ query for p in probed])
+        if threshold is not None:
+            hit = scores >= threshold
+            ids, scores = ids[hit], scores[hit]
+        if k is not None and len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((ids, -scores))
+        return ids[order], scores[order]
+
+    def load(self) -> bool:
+        """Map the published index; returns False when missing or built by another model"""
+        try:
+            published = shared_arrays.load(self.directory, self.name)
+        except Exception as e:
+            logger.error(f"Error loading ANN index {self.name}: {str(e)}")
+            return False
+        if published is None:
+            return False
+        arrays, meta = published
+        if meta.get('model_name') != self.model_name:
+            return False
+        offsets, ids, hashes, vectors = arrays['offsets'], arrays['ids'], arrays['hashes'], arrays['vectors']
+        lists = tuple((ids[a:b], hashes[a:b], vectors[a:b]) for a, b in zip(offsets[:-1], offsets[1:]))
+        with self._lock:
+            self._state = (arrays['centroids'], lists, meta.get('corpus_version'), meta['trained_size'])
+        return True
+
+    def save(self):
+        centroids, lists, version, trained = self._state
+        if centroids is None:
+            return
+        offsets = np.concatenate([[0], np.cumsum([len(l[0]) for l in lists])]).astype(np.int64)
+        shared_arrays.publish(self.directory, self.name, {
+            'centroids': centroids, 'offsets': offsets,
+            'ids': np.concatenate([l[0] for l in lists]),
+            'hashes': np.concatenate([l[1] for l in lists]),
+            'vectors': np.concatenate([l[2] for l in lists]),
+        }, {'model_name': self.model_name, 'corpus_version': version, 'trained_size': trained})
+
+
+def _bucket(centroids: np.ndarray, ids: np.ndarray, hashes: np.ndarray, vectors: np.ndarray) -> tuple:
+    assign = _assign(centroids, vectors)
+    order = np.argsort(assign, kind='stable')
+    bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+    return tuple((ids[order[a:b]], hashes[order[a:b]], vectors[order[a:b]])
+                 for a, b in zip(bounds[:-1], bounds[1:]))
+
+
+def _assign(centroids: np.ndarray, vectors: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    # 分块计算，避免 n x nlist 的大矩阵
+    return np.concatenate([np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1)
+                           for i in range(0, len(vectors), chunk)]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+
+def _append(centroids: np.ndarray, lists: tuple, ids, hashes, vectors) -> tuple:
+    ids = np.asarray(ids, dtype=np.int64)
+    hashes = np.asarray(hashes, dtype='U40')
+    vectors = _normalise(np.asarray(vectors, dtype=np.float32))
+    added = _bucket(centroids, ids, hashes, vectors)
+    # 只复制有新增的簇，其余簇沿用原数组
+    return tuple(old if not len(new[0]) else
+                 (np.concatenate([old[0], new[0]]), np.concatenate([old[1], new[1]]),
+                  np.concatenate([old[2], new[2]]))
+                 for old, new in zip(lists, added))
+
+
+def _drop(lists: tuple, ids: np.ndarray) -> Tuple[tuple, int]:
+    if not len(ids):
+        return lists, 0
+    out: List[tuple] = []
+    removed = 0
+    for l in lists:
+        hit = np.isin(l[0], ids)
+        if hit.any():
+            removed += int(hit.sum())
+            l = (l[0][~hit], l[1][~hit], l[2][~hit])
+        out.append(l)
+    return tuple(out), removed
+
+
+def _matches(ids: np.ndarray, hashes: np.ndarray, other_ids: np.ndarray, other_hashes: np.ndarray) -> np.ndarray:
+    """Mask of rows whose (id, hash) pair also appears in the other table"""
+    if not len(other_ids):
+        return np.zeros(len(ids), dtype=bool)
+    order = np.argsort(other_ids)
+    pos = np.clip(np.searchsorted(other_ids[order], ids), 0, len(other_ids) - 1)
+    found = other_ids[order][pos] == ids
+    return found & (other_hashes[order][pos] == hashes)
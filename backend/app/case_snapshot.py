@@ -0,0 +1,319 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import shared_arrays
+from .scoring import CaseColumns
+from .tech_vocab import TECH_VOCAB_PATH, TechVocabulary
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_POLL_SECONDS = float(os.environ.get('SNAPSHOT_POLL_SECONDS', 2))
+# 有 LISTEN/NOTIFY 时仍偶尔核对一次版本，防止漏掉通知
+SNAPSHOT_SAFETY_POLL_SECONDS = float(os.environ.get('SNAPSHOT_SAFETY_POLL_SECONDS', 60))
+CORPUS_CHANNEL = 'blockchain_cases_changed'
+SNAPSHOT_DIR = os.environ.get(
+    'SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'case_snapshot')
+)
+SNAPSHOT_NAME = 'cases'
+# 发布格式变化时递增，旧格式的发布会被重建
+SNAPSHOT_FORMAT = 2
+# 每个进程保留的已解码案例数（按位置），超出时先淘汰最早解码的
+CASE_RECORD_MEMO = int(os.environ.get('CASE_RECORD_MEMO', 4096))
+
+
+class ParsedCase:
+    __slots__ = ('id', 'case_name', 'application_scenarios', 'technical_requirements',
+                 'technology_stack', 'city_size', 'budget_range')
+
+    def __init__(self, case_id: int, case_name: str, parsed: dict):
+        self.id = case_id
+        self.case_name = case_name
+        self.application_scenarios = parsed['application_scenarios']
+        self.technical_requirements = parsed['technical_requirements']
+        self.technology_stack = parsed['technology_stack']
+        self.city_size = parsed['city_size']
+        self.budget_range = parsed['budget_range']
+
+    def as_dict(self) -> dict:
+        """Same shape as CaseMatcher.parse_case"""
+        return {
+            'application_scenarios': self.application_scenarios,
+            'technical_requirements': self.technical_requirements,
+            'technology_stack': self.technology_stack,
+            'city_size': self.city_size,
+            'budget_range': self.budget_range,
+        }
+
+
+class CaseRecords:
+    """Read-only sequence of ParsedCase decoded on access from one UTF-8 JSON blob.
+
+    The blob and its offsets are plain byte/int arrays, so a published snapshot
+    keeps its case details in shared memory; only the few cases a request
+    formats are decoded into Python objects. Those are kept per position (up
+    to ``memo`` of them), since the top-ranked cases repeat across requests.
+    A full iteration decodes every record without keeping it.
+    """
+
+    __slots__ = ('ids', 'offsets', 'blob', 'memo', '_decoded', '_lock')
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, blob: np.ndarray, memo: int = CASE_RECORD_MEMO):
+        self.ids = ids
+        self.offsets = offsets
+        self.blob = blob
+        self.memo = memo
+        self._decoded: Dict[int, ParsedCase] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def encode(cls, cases: Sequence[ParsedCase]) -> 'CaseRecords':
+        records = [json.dumps({'case_name': c.case_name, **c.as_dict()}).encode('utf-8') for c in cases]
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in records], out=offsets[1:])
+        return cls(np.array([c.id for c in cases], dtype=np.int64), offsets,
+                   np.frombuffer(b''.join(records), dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _decode(self, pos: int) -> ParsedCase:
+        record = json.loads(self.blob[self.offsets[pos]:self.offsets[pos + 1]].tobytes())
+        return ParsedCase(int(self.ids[pos]), record.pop('case_name'), record)
+
+    def __getitem__(self, pos) -> ParsedCase:
+        pos = int(pos)
+        if pos < 0:
+            pos += len(self.ids)
+        case = self._decoded.get(pos)
+        if case is None:
+            if not 0 <= pos < len(self.ids):
+                raise IndexError(pos)
+            # 解码在锁外进行，并发请求偶尔重复解码同一条
+            case = self._decode(pos)
+            if self.memo > 0:
+                with self._lock:
+                    case = self._decoded.setdefault(pos, case)
+                    while len(self._decoded) > self.memo:
+                        del self._decoded[next(iter(self._decoded))]
+        return case
+
+    def __iter__(self) -> Iterator[ParsedCase]:
+        return (self._decode(pos) for pos in range(len(self.ids)))
+
+
+class CaseSnapshot:
+    """Immutable, pre-parsed view of blockchain_cases at one corpus version.
+
+    ``cases``, ``ids`` and ``columns`` are row-aligned and sorted by case id.
+    ``cases`` is a tuple of ParsedCase when built in-process, or CaseRecords
+    when mapped from a published snapshot.
+    """
+
+    __slots__ = ('version', 'cases', 'ids', 'columns', 'built_at')
+
+    def __init__(self, version: int, cases: Sequence[ParsedCase], ids: Optional[np.ndarray] = None,
+                 columns: Optional[CaseColumns] = None, built_at: Optional[float] = None,
+                 vocab: Optional[TechVocabulary] = None):
+        self.version = version
+        self.cases = cases
+        self.ids = ids if ids is not None else np.array([c.id for c in cases], dtype=np.int64)
+        self.columns = columns if columns is not None else \
+            CaseColumns.from_parsed([c.as_dict() for c in cases], vocab)
+        self.built_at = built_at if built_at is not None else time.time()
+
+    def __len__(self):
+        return len(self.cases)
+
+    @classmethod
+    def build(cls, version: int, rows: Iterable, parse: Callable[[object], dict],
+              vocab_path: Optional[str] = TECH_VOCAB_PATH) -> 'CaseSnapshot':
+        """``rows`` are objects with id/case_name (e.g. BlockchainCase); ``parse`` gives parse_case dicts.
+
+        New technology names are added to the persisted vocabulary at ``vocab_path``
+        (None: a private vocabulary).
+        """
+        cases = sorted((ParsedCase(row.id, row.case_name, parse(row)) for row in rows), key=lambda c: c.id)
+        names = (t for c in cases for t in c.technology_stack)
+        vocab = TechVocabulary.grow(names, vocab_path) if vocab_path else TechVocabulary(names)
+        return cls(version, tuple(cases), vocab=vocab)
+
+    def publish(self, directory: str = SNAPSHOT_DIR, source: str = ''):
+        """Write the snapshot as shared arrays; ``source`` identifies the database it was read from"""
+        records = self.cases if isinstance(self.cases, CaseRecords) else CaseRecords.encode(self.cases)
+        cols = self.columns
+        shared_arrays.publish(directory, SNAPSHOT_NAME, {
+            'ids': self.ids, 'offsets': records.offsets, 'records': records.blob,
+            'tps': cols.tps, 'latency': cols.latency, 'security': cols.security,
+            'budget_min': cols.budget_min, 'budget_max': cols.budget_max,
+            'city_size': cols.city_size.astype(str), 'valid': cols.valid,
+            'tech_bits': cols.tech_bits, 'tech_counts': cols.tech_counts,
+        }, {'corpus_version': self.version, 'built_at': self.built_at, 'source': source,
+            'format': SNAPSHOT_FORMAT, 'tech_vocab': cols.vocab.to_dict()})
+
+    @classmethod
+    def load_published(cls, directory: str = SNAPSHOT_DIR) -> Optional['CaseSnapshot']:
+        """Map the current published snapshot; None if there is none"""
+        published = shared_arrays.load(directory, SNAPSHOT_NAME)
+        if published is None:
+            return None
+        a, meta = published
+        cases = CaseRecords(a['ids'], a['offsets'], a['records'])
+        # 技术栈位图按快照自带的词表编号，各 worker 解码一致
+        columns = CaseColumns(a['tps'], a['latency'], a['security'], a['budget_min'], a['budget_max'],
+                              a['city_size'], a['tech_bits'], a['tech_counts'],
+                              TechVocabulary.from_dict(meta['tech_vocab']), a['valid'])
+        return cls(meta['corpus_version'], cases, a['ids'], columns, meta['built_at'])
+
+    def positions_of(self, ids: Iterable[int]) -> np.ndarray:
+        """Sorted snapshot positions of the given case ids; unknown ids are dropped"""
+        ids = np.fromiter(ids, dtype=np.int64)
+        if not len(self.ids) or not len(ids):
+            return np.empty(0, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.ids, ids), 0, len(self.ids) - 1)
+        return np.unique(pos[self.ids[pos] == ids])
+
+    def locate(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Snapshot position of each of ``ids`` (in the given order) and a mask of the ids found"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        pos = np.clip(np.searchsorted(self.ids, ids), 0, len(self.ids) - 1)
+        return pos, self.ids[pos] == ids
+
+    def align(self, ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Reorder ``values`` (rows keyed by ``ids``) to snapshot order; NaN where an id is missing"""
+        values = np.asarray(values, dtype=np.float64)
+        if len(ids) == len(self.ids) and np.array_equal(ids, self.ids):
+            return values
+        out = np.full((len(self.ids),) + values.shape[1:], np.nan)
+        if len(ids):
+            order = np.argsort(ids)
+            sorted_ids = ids[order]
+            pos = np.clip(np.searchsorted(sorted_ids, self.ids), 0, len(ids) - 1)
+            found = sorted_ids[pos] == self.ids
+            out[found] = values[order[pos[found]]]
+        return out
+
+
+def shared_snapshot(read_version: Callable[[], int], build: Callable[[int], CaseSnapshot],
+                    directory: str = SNAPSHOT_DIR, source: str = '') -> CaseSnapshot:
+    """The snapshot published by any worker for the current corpus version, building it if none has.
+
+    Only the worker holding the leader lock builds; the others wait and map
+    its publication. With SHARED_ARRAYS off every worker builds privately.
+    """
+    if not shared_arrays.SHARED_ARRAYS:
+        return build(read_version())
+    with shared_arrays.leader_lock(directory, SNAPSHOT_NAME):
+        version = read_version()
+        meta = shared_arrays.current_meta(directory, SNAPSHOT_NAME)
+        # 版本号单调递增：已发布的更新版本直接使用
+        if meta is None or meta.get('source') != source or meta.get('format') != SNAPSHOT_FORMAT \
+                or meta['corpus_version'] < version:
+            build(version).publish(directory, source)
+            shared_arrays.release_memory()
+        return CaseSnapshot.load_published(directory)
+
+
+class SnapshotManager:
+    """Keeps the current CaseSnapshot and swaps in a rebuilt one when the corpus changes.
+
+    Changes are detected through ``notify()`` (wired to Postgres LISTEN/NOTIFY by
+    ``start_listener``) or, failing that, by comparing ``read_version()`` at most
+    every SNAPSHOT_POLL_SECONDS. Readers never block on a rebuild once a first
+    snapshot exists; they keep using the previous one until the swap.
+    """
+
+    def __init__(self, read_version: Callable[[], int], load: Callable[[], CaseSnapshot],
+                 poll_seconds: float = SNAPSHOT_POLL_SECONDS):
+        self.read_version = read_version
+        self.load = load
+        self.poll_seconds = poll_seconds
+        self.listening = False
+        self._snapshot: Optional[CaseSnapshot] = None
+        self._stale = True
+        self._last_check = 0.0
+        self._rebuild_lock = threading.Lock()
+
+    @property
+    def version(self) -> Optional[int]:
+        """Corpus version of the snapshot in use, without checking for changes"""
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def notify(self):
+        self._stale = True
+
+    def current(self) -> CaseSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._rebuild_lock:
+                if self._snapshot is None:
+                    self._rebuild()
+            return self._snapshot
+
+        interval = SNAPSHOT_SAFETY_POLL_SECONDS if self.listening else self.poll_seconds
+        if not self._stale and time.monotonic() - self._last_check < interval:
+            return snapshot
+        # 只有一个线程负责重建，其余线程继续使用旧快照
+        if self._rebuild_lock.acquire(blocking=False):
+            try:
+                self._last_check = time.monotonic()
+                stale, self._stale = self._stale, False
+                if stale or self.read_version() != self._snapshot.version:
+                    self._rebuild()
+            except Exception as e:
+                self._stale = True
+                logger.error(f"Error refreshing case snapshot: {str(e)}")
+            finally:
+                self._rebuild_lock.release()
+        return self._snapshot
+
+    def _rebuild(self):
+        self._stale = False
+        self._last_check = time.monotonic()
+        snapshot = self.load()
+        if self._snapshot is None or snapshot.version != self._snapshot.version:
+            self._snapshot = snapshot
+            logger.info(f"Case snapshot rebuilt at corpus version {snapshot.version}: {len(snapshot)} cases")
+
+    def start_listener(self, connect: Callable[[], object], channel: str = CORPUS_CHANNEL):
+        """LISTEN on ``channel`` in a daemon thread; ``connect`` returns a psycopg2 connection"""
+        threading.Thread(target=self._listen, args=(connect, channel),
+                         name='case-snapshot-listener', daemon=True).start()
+
+    def _listen(self, connect: Callable[[], object], channel: str):
+        while True:
+            conn = None
+            try:
+                conn = connect()
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {channel}")
+                self.listening = True
+                # 重连期间可能漏掉通知
+                self.notify()
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.notify()
+            except Exception as e:
+                logger.warning(f"Corpus change listener disconnected, falling back to polling: {str(e)}")
+            finally:
+                self.listening = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(5)
@@ -0,0 +1,12 @@
+import os
+
+# 这些值（不区分大小写）表示关闭，其余任何值都表示开启
+_OFF = ('0', 'false', 'no', 'off')
+
+
+def env_flag(name: str, default: bool = True) -> bool:
+    """On/off setting from the environment; ``default`` when the variable is unset"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in _OFF
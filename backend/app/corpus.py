@@ -0,0 +1,91 @@
+import json
+import re
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# corpus_meta.version 在 blockchain_cases 每次变更时 +1，所有派生数据（向量索引等）以它判断是否过期
+_POSTGRES_DDL = [
+    # 多个 worker 同时启动时串行执行
+    "SELECT pg_advisory_xact_lock(4242001)",
+    """
+    CREATE TABLE IF NOT EXISTS corpus_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT INTO corpus_meta (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING",
+    """
+    CREATE OR REPLACE FUNCTION bump_corpus_version() RETURNS trigger AS $$
+    DECLARE
+        new_version BIGINT;
+    BEGIN
+        UPDATE corpus_meta SET version = version + 1 WHERE id = 1 RETURNING version INTO new_version;
+        -- 提交后通知各进程刷新案例快照
+        PERFORM pg_notify('blockchain_cases_changed', new_version::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS blockchain_cases_version ON blockchain_cases",
+    """
+    CREATE TRIGGER blockchain_cases_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON blockchain_cases
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_corpus_version()
+    """,
+]
+
+_SQLITE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS corpus_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT INTO corpus_meta (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING",
+] + [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS blockchain_cases_version_{op.lower()}
+    AFTER {op} ON blockchain_cases
+    BEGIN
+        UPDATE corpus_meta SET version = version + 1 WHERE id = 1;
+    END
+    """
+    for op in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+
+def install_corpus_versioning(engine: Engine):
+    """Create corpus_meta and the blockchain_cases change triggers (idempotent)"""
+    statements = _POSTGRES_DDL if engine.dialect.name == 'postgresql' else _SQLITE_DDL
+    with engine.begin() as conn:
+        for stmt in statements:
+            conn.execute(text(stmt))
+
+
+def get_corpus_version(db: Session) -> int:
+    version = db.execute(text("SELECT version FROM corpus_meta WHERE id = 1")).scalar()
+    return int(version or 0)
+
+
+_SEED_ROW_RE = re.compile(r"\(\s*" + r",\s*".join([r"'((?:[^']|'')*)'"] * 6) + r"\s*\)")
+
+
+def read_seed_cases(sql_path: str) -> List[dict]:
+    """Parse the blockchain_cases INSERT rows of database/init.sql into case dicts"""
+    with open(sql_path, encoding='utf-8') as f:
+        sql = f.read()
+    cases = []
+    for row in _SEED_ROW_RE.findall(sql):
+        name, scenario, tech_req, stack, city, budget = (v.replace("''", "'") for v in row)
+        cases.append({
+            'case_name': name,
+            'application_scenarios': scenario,
+            'technical_requirements': json.loads(tech_req),
+            'technology_stack': json.loads(stack),
+            'city_size': city,
+            'budget_range': json.loads(budget),
+        })
+    return cases
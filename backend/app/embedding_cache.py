@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 0 关闭缓存
+EMBED_CACHE_MAX_ENTRIES = int(os.environ.get('EMBED_CACHE_MAX_ENTRIES', 4096))
+# 为空则不落盘；否则启动时读入、关闭时写回，重启后缓存是热的
+EMBED_CACHE_PATH = os.environ.get(
+    'EMBED_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'embedding_cache.npz')
+)
+
+
+def normalize_text(text: str) -> str:
+    """Text as it is encoded and keyed: surrounding and repeated whitespace removed"""
+    return ' '.join(str(text or '').split())
+
+
+class EmbeddingCache:
+    """Bounded LRU of text embeddings, keyed by sha1 of the model id and the normalised text.
+
+    Submissions mostly repeat a few scenario strings from the frontend, so their
+    embeddings are computed once per process instead of once per request.
+    Cached vectors are read-only. ``load``/``save`` keep the entries in a local
+    .npz file across restarts; entries of another model are ignored.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+                 path: Optional[str] = EMBED_CACHE_PATH):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.path = path or None
+        self._entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.inserts = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: Iterable[str]) -> List[Optional[np.ndarray]]:
+        """Cached vector of each text, None where missing"""
+        keys = [self.key(t) for t in texts]
+        out = []
+        with self._lock:
+            for k in keys:
+                vector = self._entries.get(k)
+                if vector is not None:
+                    self._entries.move_to_end(k)
+                out.append(vector)
+            hits = sum(v is not None for v in out)
+            self.hits += hits
+            self.misses += len(out) - hits
+        return out
+
+    def put_many(self, texts: Iterable[str], vectors: np.ndarray):
+        if not self.enabled:
+            return
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.array(vector, dtype=np.float32)
+                vector.flags.writeable = False
+                k = self.key(text)
+                if k not in self._entries:
+                    self.inserts += 1
+                self._entries[k] = vector
+                self._entries.move_to_end(k)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'inserts': self.inserts, 'evictions': self.evictions,
+                'bytes': sum(v.nbytes for v in list(self._entries.values()))}
+
+    def load(self) -> int:
+        """Read persisted entries (oldest first); returns how many were loaded"""
+        if self.path is None or not self.enabled or not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data['model_name']) != self.model_name:
+                    return 0
+                keys, vectors = data['keys'], data['vectors']
+        except Exception as e:
+            logger.error(f"Error loading embedding cache {self.path}: {str(e)}")
+            return 0
+        with self._lock:
+            for k, vector in zip(keys[-self.max_entries:], vectors[-self.max_entries:]):
+                vector = np.array(vector, dtype=np.float32)
+                vector.flags.writeable = False
+                self._entries.setdefault(str(k), vector)
+        return len(self._entries)
+
+    def save(self):
+        """Write the entries in LRU order, replacing the file atomically"""
+        if self.path is None or not self.enabled:
+            return
+        with self._lock:
+            keys = list(self._entries)
+            vectors = list(self._entries.values())
+        if not keys:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, keys=np.array(keys, dtype='U40'), vectors=np.stack(vectors),
+                 model_name=np.array(self.model_name))
+        os.replace(tmp_path, self.path)
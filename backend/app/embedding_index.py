@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Callable, Iterable, Optional, Tuple
+
+import numpy as np
+
+from . import shared_arrays
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = os.environ.get(
+    'EMBEDDING_INDEX_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'embedding_index')
+)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+
+
+class ScenarioIndex:
+    """Persisted matrix of L2-normalised scenario embeddings, one row per case.
+
+    Rows are keyed by case id and the sha1 of the scenario text, so a refresh only
+    re-encodes cases that were added or whose text changed. The whole state is
+    swapped as one tuple, so readers never see a half-updated index.
+
+    The index is published with shared_arrays and used memory-mapped, so all
+    workers share one copy; only the worker holding the leader lock re-encodes,
+    the others map its result.
+    """
+
+    def __init__(self, model_name: str, directory: str = INDEX_DIR):
+        self.model_name = model_name
+        self.directory = directory
+        # (ids, hashes, matrix, corpus_version)
+        self._state = (np.empty(0, dtype=np.int64), np.empty(0, dtype='U40'),
+                       np.empty((0, 0), dtype=np.float32), None)
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        safe_name = self.model_name.replace('/', '__')
+        return f"scenarios-{safe_name}"
+
+    @property
+    def corpus_version(self) -> Optional[int]:
+        return self._state[3]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._state[0]
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self._state[1]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._state[2]
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def load(self) -> bool:
+        """Map the published index; returns False when missing or built by another model"""
+        try:
+            published = shared_arrays.load(self.directory, self.name)
+        except Exception as e:
+            logger.error(f"Error loading embedding index {self.name}: {str(e)}")
+            return False
+        if published is None:
+            return False
+        arrays, meta = published
+        if meta.get('model_name') != self.model_name:
+            return False
+        self._state = (arrays['ids'], arrays['hashes'], arrays['matrix'], meta.get('corpus_version'))
+        return True
+
+    def save(self):
+        ids, hashes, matrix, version = self._state
+        shared_arrays.publish(self.directory, self.name, {'ids': ids, 'hashes': hashes, 'matrix': matrix},
+                              {'model_name': self.model_name, 'corpus_version': version})
+
+    def refresh(self, rows: Iterable[Tuple[int, str]],
+                encode: Callable[[list], np.ndarray], corpus_version: int) -> int:
+        """Bring the index in line with ``rows`` (case id, scenario text).
+
+        Only new or changed scenarios are passed to ``encode`` (in one batch);
+        deleted cases are dropped. Returns the number of texts encoded.
+        """
+        with self._refresh_lock, shared_arrays.leader_lock(self.directory, self.name):
+            # 其他 worker 已发布该版本时直接映射，不再编码
+            meta = shared_arrays.current_meta(self.directory, self.name)
+            if meta is not None and meta.get('corpus_version') != self.corpus_version and self.load() \
+                    and self.corpus_version == corpus_version:
+                return 0
+
+            ids, hashes, matrix, _ = self._state
+            known = {int(case_id): (pos, h) for pos, (case_id, h) in enumerate(zip(ids, hashes))}
+
+            new_ids, new_hashes, reuse_pos, pending = [], [], [], []
+            for case_id, scenario in rows:
+                h = text_hash(scenario)
+                new_ids.append(case_id)
+                new_hashes.append(h)
+                hit = known.get(case_id)
+                if hit is not None and hit[1] == h:
+                    reuse_pos.append(hit[0])
+                else:
+                    reuse_pos.append(-1)
+                    pending.append((len(new_ids) - 1, scenario or ''))
+
+            encoded = None
+            if pending:
+                encoded = np.asarray(encode([t for _, t in pending]), dtype=np.float32)
+            dim = encoded.shape[1] if encoded is not None else (matrix.shape[1] if matrix.size else 0)
+
+            new_matrix = np.zeros((len(new_ids), dim), dtype=np.float32)
+            reuse_pos = np.asarray(reuse_pos, dtype=np.int64)
+            reused = reuse_pos >= 0
+            if reused.any():
+                new_matrix[reused] = matrix[reuse_pos[reused]]
+            if encoded is not None:
+                new_matrix[[row for row, _ in pending]] = _normalise(encoded)
+
+            self._state = (np.asarray(new_ids, dtype=np.int64), np.asarray(new_hashes, dtype='U40'),
+                           new_matrix, corpus_version)
+            self.save()
+            # 换成映射的发布版本，私有副本随之释放
+            del new_matrix, encoded, matrix
+            self.load()
+            shared_arrays.release_memory()
+            return len(pending)
+
+    def extend(self, ids: np.ndarray, hashes: np.ndarray, vectors: np.ndarray,
+               from_version: Optional[int], to_version: Optional[int]):
+        """Add rows encoded elsewhere (bulk ingestion) and publish the result.
+
+        Starts from the latest publication. Rows with the same case id are
+        replaced. The index moves to ``to_version`` only if it was at
+        ``from_version`` (or already at ``to_version``). Otherwise it is marked
+        stale (None), and the next refresh encodes only what is still missing.
+        """
+        with self._refresh_lock, shared_arrays.leader_lock(self.directory, self.name):
+            self.load()
+            old_ids, old_hashes, matrix, version = self._state
+            keep = ~np.isin(old_ids, ids)
+            vectors = _normalise(np.asarray(vectors, dtype=np.float32))
+            if not matrix.size:
+                matrix = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            self._state = (np.concatenate([old_ids[keep], np.asarray(ids, dtype=np.int64)]),
+                           np.concatenate([old_hashes[keep], np.asarray(hashes, dtype='U40')]),
+                           np.concatenate([matrix[keep], vectors]),
+                           to_version if version is not None and version in (from_version, to_version) else None)
+            self.save()
+            del matrix
+            self.load()
+
+    def scores(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Cosine similarity of ``query`` against every indexed case, as (case ids, scores).
+
+        ``query`` may also be a (B, dim) stack of queries; scores are then (cases, B).
+        """
+        ids, _, matrix, _ = self._state
+        query = np.asarray(query, dtype=np.float32)
+        if not matrix.size:
+            return ids, np.empty((0,) + query.shape[:-1], dtype=np.float32)
+        return ids, matrix @ _normalise(query).T
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
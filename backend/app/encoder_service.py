@@ -0,0 +1,183 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .embedding_cache import EmbeddingCache, normalize_text
+from .metrics import REGISTRY, SIZE_BUCKETS, cache_result, stage
+
+ENCODER_MAX_BATCH = int(os.environ.get('ENCODER_MAX_BATCH', 64))
+ENCODER_MAX_WAIT_MS = float(os.environ.get('ENCODER_MAX_WAIT_MS', 5))
+ENCODER_WORKERS = int(os.environ.get('ENCODER_WORKERS', 1))
+ENCODER_MAX_PENDING = int(os.environ.get('ENCODER_MAX_PENDING', 1024))
+
+
+ENCODER_BATCH_TEXTS = REGISTRY.histogram('smartcity_encoder_batch_texts', 'Texts per encoder forward pass',
+                                         buckets=SIZE_BUCKETS)
+ENCODER_BATCH_REQUESTS = REGISTRY.histogram('smartcity_encoder_batch_requests', 'Requests coalesced per forward pass',
+                                            buckets=SIZE_BUCKETS)
+
+
+class EncoderBusy(Exception):
+    pass
+
+
+class BatchingEncoder:
+    """Coalesces encode calls from concurrent requests into batched forward passes.
+
+    Callers enqueue their texts and get a Future. A dispatcher thread collects
+    requests until ``max_batch`` texts are pending or ``max_wait_ms`` has passed
+    since the first one, then hands the batch to a dedicated encoder pool. The
+    dispatcher does not form a new batch until a pool worker is free, so texts
+    keep accumulating while the model is busy. At most ``max_pending`` requests
+    may wait; beyond that submit() raises EncoderBusy.
+
+    With a ``cache``, texts already encoded are answered from it without
+    queueing (so never EncoderBusy), and only the misses reach the model.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray],
+                 max_batch: int = ENCODER_MAX_BATCH, max_wait_ms: float = ENCODER_MAX_WAIT_MS,
+                 workers: int = ENCODER_WORKERS, max_pending: int = ENCODER_MAX_PENDING,
+                 cache: Optional[EmbeddingCache] = None):
+        self.encode_batch = encode_batch
+        self.cache = cache
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='encoder')
+        self._free_workers = threading.Semaphore(workers)
+        self._dispatcher: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def submit(self, texts: List[str], timeout: Optional[float] = None, cached: bool = True) -> Future:
+        """Queue ``texts``; the Future resolves to their (len(texts), dim) embeddings.
+
+        ``cached=False`` bypasses the cache, for bulk corpus text that would only evict user texts.
+        Texts are normalised (see normalize_text) on every path, so a text gets the same
+        embedding whether or not it is served from the cache.
+        """
+        texts = [normalize_text(t) for t in texts]
+        if self.cache is None or not self.cache.enabled or not cached or not texts:
+            return self._submit(texts, timeout)
+        vectors = self.cache.get_many(texts)
+        for v in vectors:
+            cache_result('embedding', v is not None)
+        # 同一批里重复的文本只编码一次
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        future: Future = Future()
+        if not missing:
+            future.set_result(np.stack(vectors))
+            return future
+
+        def fill(inner: Future):
+            if inner.cancelled():
+                future.cancel()
+                return
+            if inner.exception() is not None:
+                future.set_exception(inner.exception())
+                return
+            encoded = inner.result()
+            self.cache.put_many(missing, encoded)
+            by_text = dict(zip(missing, encoded))
+            if not future.cancelled():
+                future.set_result(np.stack([v if v is not None else by_text[t] for t, v in zip(texts, vectors)]))
+
+        self._submit(missing, timeout).add_done_callback(fill)
+        return future
+
+    def _submit(self, texts: List[str], timeout: Optional[float] = None) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        try:
+            if timeout == 0:
+                self._queue.put_nowait((list(texts), future))
+            else:
+                self._queue.put((list(texts), future), timeout=timeout)
+        except queue.Full:
+            raise EncoderBusy(f"{self._queue.qsize()} encode requests pending")
+        return future
+
+    def encode(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(texts, timeout).result()
+
+    async def encode_async(self, texts: List[str]) -> np.ndarray:
+        # 不在事件循环里阻塞等待队列空位
+        return await asyncio.wrap_future(self.submit(texts, timeout=0))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def shutdown(self):
+        if self._dispatcher is not None:
+            self._queue.put((None, None))
+            self._dispatcher.join(timeout=1)
+        self._executor.shutdown(wait=False)
+
+    def _ensure_started(self):
+        if self._dispatcher is not None:
+            return
+        with self._start_lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='encoder-dispatch', daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        carry: Optional[Tuple[List[str], Future]] = None
+        while True:
+            item = carry if carry is not None else self._queue.get()
+            carry = None
+            if item[1] is None:
+                return
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item[1] is None or size + len(item[0]) > self.max_batch:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            self._free_workers.acquire()
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch: List[Tuple[List[str], Future]]):
+        try:
+            live = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+            texts = [t for item_texts, _ in live for t in item_texts]
+            if not texts:
+                for _, future in live:
+                    future.set_result(np.empty((0, 0), dtype=np.float32))
+                return
+            ENCODER_BATCH_TEXTS.observe(len(texts))
+            ENCODER_BATCH_REQUESTS.observe(len(live))
+            try:
+                with stage('encoder_forward'):
+                    vectors = np.asarray(self.encode_batch(texts))
+            except Exception as e:
+                for _, future in live:
+                    future.set_exception(e)
+                return
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for item_texts, future in live:
+                future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+        finally:
+            self._free_workers.release()
@@ -0,0 +1,319 @@
+"""Text encoder backends behind CaseMatcher.
+
+The backend is chosen with TEXT_ENCODER:
+
+* ``minilm`` (default) - sentence-transformers all-MiniLM-L6-v2, needs torch
+* ``hashed`` - pure-NumPy TF-IDF over hashed word and character n-grams
+* ``onnx``   - MiniLM exported to ONNX (optionally int8-quantized), run with
+  onnxruntime; see ``python -m app.encoders export-onnx``
+
+Heavy dependencies are imported in ``load()``, so importing this module (and
+the app) never pulls in torch unless the MiniLM backend is selected.
+
+``python -m app.encoders compare`` reports startup time, resident memory and
+ranking agreement with MiniLM for each backend.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+TEXT_ENCODER = os.environ.get('TEXT_ENCODER', 'minilm')
+HASHED_DIM = int(os.environ.get('HASHED_DIM', 4096))
+HASHED_IDF_PATH = os.environ.get('HASHED_IDF_PATH')
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', '')
+ONNX_TOKENIZER_PATH = os.environ.get('ONNX_TOKENIZER_PATH')
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class TextEncoder:
+    """Maps texts to L2-normalised float32 embeddings, one row per text"""
+
+    name = 'base'
+
+    def load(self):
+        """Load weights; called once by the model registry before the first encode"""
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        raise NotImplementedError
+
+
+class MiniLMEncoder(TextEncoder):
+    def __init__(self, model_name: str = DEFAULT_MODEL):
+        self.name = model_name
+        self._model = None
+
+    def load(self):
+        # torch 只在选用该后端时导入
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(self.name)
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        vectors = self._model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class HashedNgramEncoder(TextEncoder):
+    """TF-IDF over word unigrams and character n-grams, hashed into ``dim`` buckets.
+
+    Uses signed hashing and sublinear term frequency. Without a fitted IDF every
+    bucket weighs 1; ``fit`` computes one from a corpus.
+    """
+
+    def __init__(self, dim: int = HASHED_DIM, ngram_range=(3, 5), idf: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.idf = idf
+        self.name = self._make_name()
+
+    def _make_name(self) -> str:
+        name = f"hashed-ngram-{self.dim}"
+        if self.idf is not None:
+            name += f"-idf{hashlib.sha1(self.idf.tobytes()).hexdigest()[:8]}"
+        return name
+
+    @classmethod
+    def from_idf_file(cls, path: str, **kwargs) -> 'HashedNgramEncoder':
+        idf = np.load(path)
+        return cls(dim=len(idf), idf=idf, **kwargs)
+
+    def _features(self, text: str) -> List[str]:
+        words = _TOKEN_RE.findall((text or '').lower())
+        features = ['w:' + w for w in words]
+        padded = f" {' '.join(words)} "
+        lo, hi = self.ngram_range
+        for n in range(lo, hi + 1):
+            features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def _buckets(self, text: str):
+        hashes = np.array([zlib.crc32(f.encode('utf-8')) for f in self._features(text)], dtype=np.int64)
+        return hashes % self.dim, np.where((hashes // self.dim) & 1, -1.0, 1.0)
+
+    def fit(self, texts: List[str]) -> 'HashedNgramEncoder':
+        df = np.zeros(self.dim)
+        for text in texts:
+            buckets, _ = self._buckets(text)
+            df[np.unique(buckets)] += 1
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        self.name = self._make_name()
+        return self
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets, signs = self._buckets(text)
+            np.add.at(out[row], buckets, signs)
+        # sublinear tf
+        nonzero = out != 0
+        out[nonzero] = np.sign(out[nonzero]) * (1 + np.log(np.abs(out[nonzero])))
+        if self.idf is not None:
+            out *= self.idf
+        return _normalise(out)
+
+
+class OnnxEncoder(TextEncoder):
+    """Mean-pooled MiniLM run by onnxruntime; pair with an int8-quantized export"""
+
+    def __init__(self, model_path: str = ONNX_MODEL_PATH, tokenizer_path: Optional[str] = ONNX_TOKENIZER_PATH,
+                 max_length: int = 256):
+        self.model_path = model_path
+        self.tokenizer_path = tokenizer_path or os.path.join(os.path.dirname(model_path), 'tokenizer.json')
+        self.max_length = max_length
+        self.name = f"onnx-{os.path.splitext(os.path.basename(model_path))[0]}"
+        self._session = None
+        self._tokenizer = None
+        self._input_names = set()
+
+    def load(self):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("TEXT_ENCODER=onnx needs the onnxruntime and tokenizers packages") from e
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_file(self.tokenizer_path)
+        self._tokenizer.enable_truncation(self.max_length)
+        self._tokenizer.enable_padding()
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        chunks = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self._tokenizer.encode_batch(list(texts[start:start + batch_size]))
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feed = {'input_ids': input_ids, 'attention_mask': mask}
+            if 'token_type_ids' in self._input_names:
+                feed['token_type_ids'] = np.zeros_like(input_ids)
+            hidden = self._session.run(None, feed)[0]
+            weights = mask[..., None].astype(np.float32)
+            chunks.append((hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None))
+        if not chunks:
+            return np.empty((0, 0), dtype=np.float32)
+        return _normalise(np.concatenate(chunks).astype(np.float32))
+
+
+def create_encoder(kind: str = TEXT_ENCODER) -> TextEncoder:
+    if kind == 'minilm':
+        return MiniLMEncoder()
+    if kind == 'hashed':
+        if HASHED_IDF_PATH and os.path.exists(HASHED_IDF_PATH):
+            return HashedNgramEncoder.from_idf_file(HASHED_IDF_PATH)
+        return HashedNgramEncoder()
+    if kind == 'onnx':
+        return OnnxEncoder()
+    raise ValueError(f"Unknown TEXT_ENCODER: {kind}")
+
+
+def export_minilm_onnx(out_dir: str, model_name: str = DEFAULT_MODEL, quantize: bool = True) -> str:
+    """Export MiniLM to ONNX (plus tokenizer.json); returns the path to serve with TEXT_ENCODER=onnx"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    st_model = SentenceTransformer(model_name)
+    transformer = st_model[0].auto_model.eval()
+    transformer.config.return_dict = False
+    tokenizer = st_model.tokenizer
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer.save_pretrained(out_dir)
+
+    sample = tokenizer(["warm up"], return_tensors='pt')
+    names = ['input_ids', 'attention_mask', 'token_type_ids']
+    path = os.path.join(out_dir, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer, tuple(sample[n] for n in names), path,
+            input_names=names, output_names=['last_hidden_state'],
+            dynamic_axes={n: {0: 'batch', 1: 'seq'} for n in names + ['last_hidden_state']},
+            opset_version=14,
+        )
+    if not quantize:
+        return path
+    quantized = os.path.join(out_dir, 'model-int8.onnx')
+    quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+    return quantized
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# ------------ Backend comparison ------------
+def _probe(kind: str, sql_path: str) -> dict:
+    """Load one backend in a fresh process and score every seed scenario against the corpus"""
+    from .corpus import read_seed_cases
+    from .model_registry import ModelRegistry, resident_memory_bytes
+
+    corpus = [c['application_scenarios'] for c in read_seed_cases(sql_path)]
+    queries = sorted(set(corpus))
+
+    baseline_rss = resident_memory_bytes()
+    registry = ModelRegistry(create_encoder(kind))
+    start = time.perf_counter()
+    encoder = registry.get()
+    encoder.encode(["warm up"])
+    startup_seconds = time.perf_counter() - start
+
+    corpus_vecs = encoder.encode(corpus)
+    encode_start = time.perf_counter()
+    query_vecs = encoder.encode(queries)
+    encode_seconds = time.perf_counter() - encode_start
+    return {
+        'backend': kind,
+        'encoder': encoder.name,
+        'startup_seconds': startup_seconds,
+        'resident_memory_bytes': resident_memory_bytes(),
+        'resident_memory_delta_bytes': resident_memory_bytes() - baseline_rss,
+        'encode_ms_per_text': 1000 * encode_seconds / max(len(queries), 1),
+        'scores': (query_vecs @ corpus_vecs.T).tolist(),
+    }
+
+
+def _ranks(scores: np.ndarray) -> np.ndarray:
+    ranks = np.empty(len(scores))
+    ranks[np.argsort(-scores, kind='stable')] = np.arange(len(scores))
+    return ranks
+
+
+def ranking_agreement(reference: np.ndarray, candidate: np.ndarray, k: int = 5) -> dict:
+    """Mean Spearman correlation and top-k overlap of per-query case rankings"""
+    rhos, overlaps = [], []
+    for ref_row, cand_row in zip(reference, candidate):
+        rhos.append(np.corrcoef(_ranks(ref_row), _ranks(cand_row))[0, 1])
+        ref_top = set(np.argsort(-ref_row, kind='stable')[:k])
+        cand_top = set(np.argsort(-cand_row, kind='stable')[:k])
+        overlaps.append(len(ref_top & cand_top) / k)
+    return {'spearman': float(np.mean(rhos)), f'top{k}_overlap': float(np.mean(overlaps))}
+
+
+def compare(backends: List[str], sql_path: str) -> List[dict]:
+    results = []
+    for kind in backends:
+        proc = subprocess.run([sys.executable, '-m', 'app.encoders', 'probe', kind, '--sql', sql_path],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            results.append({'backend': kind, 'error': proc.stderr.strip().splitlines()[-1:]})
+            continue
+        results.append(json.loads(proc.stdout))
+
+    reference = next((np.array(r['scores']) for r in results
+                      if r.get('backend') == 'minilm' and 'scores' in r), None)
+    for r in results:
+        scores = r.pop('scores', None)
+        if reference is not None and scores is not None:
+            r['agreement_with_minilm'] = ranking_agreement(reference, np.array(scores))
+    return results
+
+
+def main(argv=None):
+    default_sql = os.path.join(os.path.dirname(__file__), '..', '..', 'database', 'init.sql')
+    parser = argparse.ArgumentParser(prog='python -m app.encoders')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('compare', help='startup time, memory and ranking agreement per backend')
+    p.add_argument('--backends', default='minilm,hashed,onnx')
+    p.add_argument('--sql', default=default_sql, help='init.sql with the seed cases')
+
+    p = sub.add_parser('probe')
+    p.add_argument('kind')
+    p.add_argument('--sql', default=default_sql)
+
+    p = sub.add_parser('export-onnx', help='export MiniLM to ONNX and quantize it to int8')
+    p.add_argument('out_dir')
+    p.add_argument('--no-quantize', action='store_true')
+
+    p = sub.add_parser('fit-idf', help='fit the hashed backend IDF on the seed scenarios')
+    p.add_argument('out_path')
+    p.add_argument('--sql', default=default_sql)
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        print(json.dumps(compare(args.backends.split(','), args.sql), indent=2))
+    elif args.command == 'probe':
+        print(json.dumps(_probe(args.kind, args.sql)))
+    elif args.command == 'export-onnx':
+        print(export_minilm_onnx(args.out_dir, quantize=not args.no_quantize))
+    elif args.command == 'fit-idf':
+        from .corpus import read_seed_cases
+        encoder = HashedNgramEncoder().fit([c['application_scenarios'] for c in read_seed_cases(args.sql)])
+        np.save(args.out_path, encoder.idf)
+        print(f"{args.out_path}: {encoder.name}")
+
+
+if __name__ == '__main__':
+    main()
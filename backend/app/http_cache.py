@@ -0,0 +1,195 @@
+"""HTTP validators and pre-compressed variants for report responses.
+
+A report only changes with its submission (immutable), the case corpus and
+the template, so ``etag`` derives a strong validator from those alone and
+a matching If-None-Match is answered with 304 before any database access
+or rendering. Each content coding is a different representation and gets
+its own tag (``-gzip``/``-br`` suffix); ``etag_matches`` ignores the suffix,
+so a client revalidating a gzip copy is still told the report is unchanged. Rendered HTML is compressed once per encoding while it is
+streamed out, and the identity, gzip and (when the brotli package is
+installed) br variants are kept in a byte-bounded LRU, so repeat views are
+served as stored bytes.
+"""
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, Iterator, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 报告可由浏览器和反向代理保存，但每次使用前须用 ETag 重新验证
+REPORT_CACHE_CONTROL = os.environ.get('REPORT_CACHE_CONTROL', 'public, no-cache')
+# 预压缩 HTML 缓存的总字节数上限（所有编码合计），0 关闭
+REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# 超过此大小的报告照常流式返回，但不缓存
+REPORT_CACHE_ENTRY_MAX_BYTES = int(os.environ.get('REPORT_CACHE_ENTRY_MAX_BYTES', 4 * 1024 * 1024))
+GZIP_LEVEL = int(os.environ.get('REPORT_GZIP_LEVEL', 9))
+BROTLI_QUALITY = int(os.environ.get('REPORT_BROTLI_QUALITY', 9))
+
+# 按优先顺序
+ENCODINGS = (('br',) if brotli is not None else ()) + ('gzip', 'identity')
+
+
+def etag(kind: str, submission_id: int, corpus_version: int, revision: Optional[str] = None,
+         encoding: str = 'identity') -> str:
+    tag = f"{kind}-{submission_id}-{corpus_version}"
+    if revision:
+        tag = f"{tag}-{revision}"
+    # 强 ETag 要求字节相同，压缩后的正文须用不同的标签
+    if encoding != 'identity':
+        tag = f"{tag}-{encoding}"
+    return f'"{tag}"'
+
+
+def _strip_coding(tag: str) -> str:
+    # brotli 未安装时也要认得客户端之前拿到的 -br 标签
+    for coding in ('gzip', 'br'):
+        suffix = f'-{coding}"'
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """Whether an If-None-Match header names ``tag`` in any content coding.
+
+    Weak comparison, as RFC 9110 requires for If-None-Match; the coding
+    suffix is ignored because every coding of a report has the same content.
+    """
+    if not if_none_match:
+        return False
+    tag = _strip_coding(tag)
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if _strip_coding(candidate) == tag:
+            return True
+    return False
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+    """Best of ENCODINGS acceptable under an Accept-Encoding header; identity as the fallback"""
+    weights: Dict[str, float] = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding.strip().lower()] = q
+    best, best_q = 'identity', 0.0
+    for coding in ENCODINGS[:-1]:
+        q = weights.get(coding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == 'br':
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = None
+
+    def feed(self, data: bytes) -> bytes:
+        if self._obj is None:
+            return data
+        if self.encoding == 'br':
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        if self._obj is None:
+            return b''
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compress_stream(chunks: Iterable[str], encoding: str,
+                    on_complete: Optional[Callable[[Dict[str, bytes]], None]] = None) -> Iterator[bytes]:
+    """Encode ``chunks`` for the response and, alongside, every variant for the cache.
+
+    ``on_complete`` receives {encoding: body} once the stream has finished,
+    unless the report grew past REPORT_CACHE_ENTRY_MAX_BYTES.
+    """
+    caching = on_complete is not None
+    encoders = {coding: _Compressor(coding) for coding in (ENCODINGS if caching else (encoding,))}
+    parts: Dict[str, list] = {coding: [] for coding in encoders}
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        size += len(data)
+        if caching and size > REPORT_CACHE_ENTRY_MAX_BYTES:
+            # 太大的报告不缓存，只继续压缩发给客户端的编码
+            caching = False
+            encoders, parts = {encoding: encoders[encoding]}, {}
+        for coding, compressor in encoders.items():
+            piece = compressor.feed(data)
+            if caching:
+                parts[coding].append(piece)
+            if coding == encoding and piece:
+                yield piece
+    for coding, compressor in encoders.items():
+        piece = compressor.finish()
+        if caching:
+            parts[coding].append(piece)
+        if coding == encoding and piece:
+            yield piece
+    if caching:
+        on_complete({coding: b''.join(p) for coding, p in parts.items()})
+
+
+class ReportVariants:
+    """Byte-bounded LRU of pre-compressed report bodies: key -> {encoding: bytes}"""
+
+    def __init__(self, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Hashable, Dict[str, bytes]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: Hashable) -> Optional[Dict[str, bytes]]:
+        with self._lock:
+            variants = self._entries.get(key)
+            if variants is not None:
+                self._entries.move_to_end(key)
+            return variants
+
+    def put(self, key: Hashable, variants: Dict[str, bytes]):
+        size = sum(map(len, variants.values()))
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= sum(map(len, old.values()))
+            self._entries[key] = variants
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= sum(map(len, evicted.values()))
@@ -0,0 +1,476 @@
+"""Streaming bulk ingestion of blockchain_cases from CSV or JSONL files.
+
+Run from backend/:
+    python -m app.ingest cases.jsonl
+    python -m app.ingest cases.csv --rejects rejects.jsonl
+
+Records are read one at a time, validated and normalised, and loaded in
+batches of INGEST_BATCH: the scenarios of a batch are embedded in one call,
+then the rows go in with COPY (psycopg2/psycopg) or executemany (other
+drivers), in the same transaction as the checkpoint row and the corpus
+version bump. Memory stays bounded by the batch, not by the file. An
+interrupted run resumes from the byte offset of its last committed batch.
+
+The scenario embeddings are added to the shared ScenarioIndex every
+INGEST_PUBLISH_ROWS rows. The index is keyed by case id and text hash, so
+batches committed but not published yet (a crash, or a worker refreshing
+in between) are simply encoded by the next refresh.
+
+CSV files need a header. technical_requirements and budget_range may be
+JSON columns or flat tps/latency/security_level and budget_min/budget_max
+columns; technology_stack may be a JSON list or comma-separated.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import (BigInteger, Column, MetaData, String, Table, Text, TIMESTAMP, func, insert, select,
+                        text, update)
+from sqlalchemy.engine import Connection, Engine
+
+from .embedding_index import ScenarioIndex, text_hash
+from .metrics import REGISTRY, stage
+from .scoring import SECURITY_LEVELS
+from .tech_vocab import TechVocabulary, canonical_key
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH = int(os.environ.get('INGEST_BATCH', 2000))
+# 每累计这么多行向量发布一次索引（发布要重写整个索引文件）
+INGEST_PUBLISH_ROWS = int(os.environ.get('INGEST_PUBLISH_ROWS', 50000))
+INGEST_ENCODE_BATCH = int(os.environ.get('INGEST_ENCODE_BATCH', 256))
+# 管理接口上传的文件和可导入文件所在目录
+INGEST_DIR = os.environ.get(
+    'INGEST_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'ingest')
+)
+
+CITY_SIZES = ('small', 'medium', 'large')
+CASE_COLUMNS = ('id', 'case_name', 'application_scenarios', 'technical_requirements',
+                'technology_stack', 'city_size', 'budget_range')
+
+INGESTED_ROWS = REGISTRY.counter('smartcity_ingested_rows_total', 'Case rows processed by bulk ingestion',
+                                 ('result',))
+
+metadata = MetaData()
+# 每个导入源一行：已提交到的字节偏移和累计计数，与案例行在同一事务中更新
+ingest_checkpoints = Table(
+    'ingest_checkpoints', metadata,
+    Column('source', Text, primary_key=True),
+    Column('fingerprint', String(40), nullable=False),  # sha1 of the first 64 KiB
+    Column('byte_offset', BigInteger, nullable=False, default=0),
+    Column('records', BigInteger, nullable=False, default=0),
+    Column('loaded', BigInteger, nullable=False, default=0),
+    Column('rejected', BigInteger, nullable=False, default=0),
+    Column('corpus_version', BigInteger),
+    Column('updated_at', TIMESTAMP, server_default=func.now()),
+)
+
+
+class IngestError(Exception):
+    pass
+
+
+class InvalidCase(ValueError):
+    pass
+
+
+def install_ingest_schema(engine: Engine):
+    metadata.create_all(engine, checkfirst=True)
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise IngestError(f"Cannot tell the format of {path}: use .csv or .jsonl, or pass the format")
+
+
+def fingerprint(path: str) -> str:
+    """Identifies the file a checkpoint belongs to; appending to the file keeps it"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(65536)).hexdigest()
+
+
+class CaseReader:
+    """Iterates (record, error, offset) over a CSV or JSONL file, starting at byte ``offset``.
+
+    ``offset`` is the position right after the record, i.e. where a resumed
+    run starts. Records that cannot be decoded come back as (None, error, offset).
+    """
+
+    def __init__(self, path: str, fmt: Optional[str] = None, offset: int = 0):
+        self.path = path
+        self.format = fmt or detect_format(path)
+        self.offset = offset
+
+    def __iter__(self) -> Iterator[Tuple[Optional[dict], Optional[str], int]]:
+        with open(self.path, 'rb') as f:
+            if self.format == 'csv':
+                yield from self._csv(f)
+            else:
+                yield from self._jsonl(f)
+
+    def _lines(self, f) -> Iterator[str]:
+        # csv.reader 按需取行，因此每条记录返回时偏移正好在其末尾
+        for line in iter(f.readline, b''):
+            self.offset = f.tell()
+            yield line.decode('utf-8', errors='replace')
+
+    def _jsonl(self, f):
+        f.seek(self.offset)
+        for line in self._lines(f):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield None, f"invalid JSON: {str(e)}", self.offset
+                continue
+            if not isinstance(record, dict):
+                yield None, "not a JSON object", self.offset
+                continue
+            yield record, None, self.offset
+
+    def _csv(self, f):
+        header = next(csv.reader([f.readline().decode('utf-8-sig')]), None)
+        if not header:
+            return
+        header = [h.strip() for h in header]
+        f.seek(max(self.offset, f.tell()))
+        for values in csv.reader(self._lines(f)):
+            if not values:
+                continue
+            if len(values) > len(header):
+                yield None, f"{len(values)} fields for {len(header)} columns", self.offset
+                continue
+            yield dict(zip(header, values)), None, self.offset
+
+
+def _number(value, field: str, minimum: float = 0) -> float:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise InvalidCase(f"{field} must be a number, got {value!r}")
+    if not math.isfinite(value) or value < minimum:
+        raise InvalidCase(f"{field} must be a finite number >= {minimum:g}, got {value!r}")
+    return int(value) if value.is_integer() else value
+
+
+def _json_field(value, field: str):
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise InvalidCase(f"{field} is not valid JSON")
+    return value
+
+
+def normalize_case(record: dict, vocab: Optional[TechVocabulary] = None) -> dict:
+    """Validated blockchain_cases values of one input record; raises InvalidCase.
+
+    Technology names are written in their ``vocab`` spelling when known.
+    """
+    record = {k.strip(): v for k, v in record.items() if isinstance(k, str)}
+
+    name = ' '.join(str(record.get('case_name') or '').split())
+    scenario = ' '.join(str(record.get('application_scenarios') or '').split())
+    if not name:
+        raise InvalidCase("case_name is empty")
+    if not scenario:
+        raise InvalidCase("application_scenarios is empty")
+
+    req = record.get('technical_requirements')
+    req = _json_field(req, 'technical_requirements') if req not in (None, '') else record
+    if not isinstance(req, dict):
+        raise InvalidCase("technical_requirements must be an object")
+    security = str(req.get('security_level') or '').strip().lower()
+    if security not in SECURITY_LEVELS:
+        raise InvalidCase(f"security_level must be one of {', '.join(SECURITY_LEVELS)}, got {security!r}")
+    tech_req = {'tps': _number(req.get('tps'), 'tps', 1), 'latency': _number(req.get('latency'), 'latency'),
+                'security_level': security}
+
+    stack = record.get('technology_stack')
+    if isinstance(stack, str):
+        stack = _json_field(stack, 'technology_stack') if stack.lstrip().startswith('[') else stack.split(',')
+    if not isinstance(stack, list):
+        raise InvalidCase("technology_stack must be a list or a comma-separated string")
+    # 按规范名称去掉空项和重复项，保留原顺序
+    vocab = vocab if vocab is not None else TechVocabulary()
+    names = {}
+    for t in map(str, stack):
+        if t.strip():
+            names.setdefault(canonical_key(t), vocab.canonical(t))
+    stack = list(names.values())
+    if not stack:
+        raise InvalidCase("technology_stack is empty")
+
+    city = str(record.get('city_size') or '').strip().lower()
+    if city not in CITY_SIZES:
+        raise InvalidCase(f"city_size must be one of {', '.join(CITY_SIZES)}, got {city!r}")
+
+    budget = record.get('budget_range')
+    if budget in (None, ''):
+        budget = [record.get('budget_min'), record.get('budget_max')]
+    budget = _json_field(budget, 'budget_range')
+    if not isinstance(budget, list) or len(budget) != 2:
+        raise InvalidCase("budget_range must be [min, max]")
+    budget = [_number(budget[0], 'budget min'), _number(budget[1], 'budget max')]
+    if budget[0] > budget[1]:
+        raise InvalidCase(f"budget min {budget[0]} exceeds max {budget[1]}")
+
+    return {'case_name': name, 'application_scenarios': scenario, 'technical_requirements': tech_req,
+            'technology_stack': stack, 'city_size': city, 'budget_range': budget}
+
+
+def _as_row(case_id: int, case: dict) -> dict:
+    return {**case, 'id': case_id,
+            'technical_requirements': json.dumps(case['technical_requirements']),
+            'technology_stack': json.dumps(case['technology_stack']),
+            'budget_range': json.dumps(case['budget_range'])}
+
+
+def _reserve_ids(conn: Connection, table: Table, n: int) -> List[int]:
+    if conn.dialect.name == 'postgresql':
+        result = conn.execute(text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+                              {'table': table.name, 'n': n})
+        return sorted(result.scalars())
+    # SQLite 写事务串行执行，最大 id 之后的号段不会被并发占用
+    start = (conn.scalar(select(func.max(table.c.id))) or 0) + 1
+    return list(range(start, start + n))
+
+
+def _insert_rows(conn: Connection, table: Table, rows: List[dict]):
+    driver = conn.dialect.driver
+    if driver not in ('psycopg2', 'psycopg'):
+        conn.execute(insert(table), rows)
+        return
+    sql = f"COPY {table.name} ({', '.join(CASE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    cursor = conn.connection.cursor()
+    try:
+        if driver == 'psycopg2':
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for row in rows:
+                writer.writerow([row[c] for c in CASE_COLUMNS])
+            buf.seek(0)
+            cursor.copy_expert(sql, buf)
+        else:
+            with cursor.copy(sql.replace('WITH (FORMAT csv)', '')) as copy:
+                for row in rows:
+                    copy.write_row([row[c] for c in CASE_COLUMNS])
+    finally:
+        cursor.close()
+
+
+def _lock_corpus_version(conn: Connection) -> int:
+    # 锁住版本行：批次前后的版本号之间不会混入其他写入
+    lock = " FOR UPDATE" if conn.dialect.name == 'postgresql' else ""
+    return int(conn.execute(text(f"SELECT version FROM corpus_meta WHERE id = 1{lock}")).scalar() or 0)
+
+
+class Ingestion:
+    """One ingestion run of a file into ``cases``; counters can be read while it runs"""
+
+    def __init__(self, engine: Engine, cases: Table, index: ScenarioIndex, encode: Callable[[List[str]], np.ndarray],
+                 path: str, source: Optional[str] = None, fmt: Optional[str] = None, restart: bool = False,
+                 rejects: Optional[str] = None, batch_size: int = INGEST_BATCH,
+                 publish_rows: int = INGEST_PUBLISH_ROWS):
+        self.engine = engine
+        self.cases = cases
+        self.index = index
+        self.encode = encode
+        self.path = path
+        self.source = source or os.path.abspath(path)
+        self.format = fmt or detect_format(path)
+        self.restart = restart
+        self.rejects = rejects
+        self.batch_size = batch_size
+        self.publish_rows = publish_rows
+        self.vocab = TechVocabulary()
+        self.state = 'pending'
+        self.error: Optional[str] = None
+        self.offset = 0
+        self.records = self.loaded = self.rejected = 0
+        self.corpus_version: Optional[int] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._session_loaded = 0
+        # 已提交、尚未发布到索引的 (ids, hashes, vectors)
+        self._staged: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._staged_rows = 0
+        self._chain: Tuple[Optional[int], Optional[int]] = (None, None)
+
+    def status(self) -> dict:
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = None
+        return {'source': self.source, 'state': self.state, 'error': self.error, 'format': self.format,
+                'byte_offset': self.offset, 'size_bytes': size, 'records': self.records, 'loaded': self.loaded,
+                'rejected': self.rejected, 'corpus_version': self.corpus_version, 'seconds': round(elapsed, 2),
+                'rows_per_second': round(self._session_loaded / elapsed, 1) if elapsed else None}
+
+    def run(self) -> 'Ingestion':
+        self.state, self.started = 'running', time.time()
+        try:
+            self._run()
+            self.state = 'done'
+        except Exception as e:
+            self.state, self.error = 'failed', str(e)
+            raise
+        finally:
+            self.finished = time.time()
+        return self
+
+    def _run(self):
+        install_ingest_schema(self.engine)
+        self.vocab = TechVocabulary.load()
+        self._start_checkpoint()
+        self.index.load()
+        self._chain = (self.index.corpus_version, self.index.corpus_version)
+
+        reader = CaseReader(self.path, self.format, self.offset)
+        batch: List[dict] = []
+        uncommitted = 0
+        rejects = open(self.rejects, 'a', encoding='utf-8') if self.rejects else None
+        try:
+            for record, error, offset in reader:
+                uncommitted += 1
+                if error is None:
+                    try:
+                        batch.append(normalize_case(record, self.vocab))
+                    except InvalidCase as e:
+                        error = str(e)
+                if error is not None:
+                    self._reject(rejects, self.records + uncommitted, error, record)
+                if uncommitted >= self.batch_size:
+                    self._commit(batch, uncommitted, offset)
+                    batch, uncommitted = [], 0
+            if uncommitted:
+                self._commit(batch, uncommitted, reader.offset)
+        finally:
+            if rejects is not None:
+                rejects.close()
+            if self._staged:
+                self._publish()
+        logger.info(f"Ingested {self.source}: {self.loaded} loaded, {self.rejected} rejected "
+                    f"of {self.records} records, corpus version {self.corpus_version}")
+
+    def _start_checkpoint(self):
+        fp = fingerprint(self.path)
+        with self.engine.begin() as conn:
+            row = conn.execute(select(ingest_checkpoints).where(ingest_checkpoints.c.source == self.source)).first()
+            if row is None:
+                conn.execute(insert(ingest_checkpoints).values(source=self.source, fingerprint=fp))
+                return
+            if row.fingerprint != fp and not self.restart:
+                raise IngestError(f"The checkpoint of {self.source} belongs to different file contents; "
+                                  f"restart to load it from the beginning")
+            if self.restart:
+                conn.execute(update(ingest_checkpoints).where(ingest_checkpoints.c.source == self.source).values(
+                    fingerprint=fp, byte_offset=0, records=0, loaded=0, rejected=0, updated_at=func.now()))
+                return
+        self.offset, self.records, self.loaded, self.rejected = \
+            row.byte_offset, row.records, row.loaded, row.rejected
+        self.corpus_version = row.corpus_version
+        if self.offset:
+            logger.info(f"Resuming {self.source} at byte {self.offset} after {self.records} records")
+
+    def _reject(self, rejects, record_no: int, error: str, record: Optional[dict]):
+        self.rejected += 1
+        INGESTED_ROWS.inc(result='rejected')
+        logger.warning(f"Rejected record {record_no} of {self.source}: {error}")
+        if rejects is not None:
+            rejects.write(json.dumps({'record': record_no, 'error': error, 'data': record}, default=str) + '\n')
+
+    def _commit(self, batch: List[dict], records: int, offset: int):
+        vectors = None
+        if batch:
+            with stage('ingest_encode'):
+                vectors = np.asarray(self.encode([c['application_scenarios'] for c in batch]), dtype=np.float32)
+
+        checkpoint = ingest_checkpoints.c
+        with stage('ingest_load'), self.engine.begin() as conn:
+            # 偏移与本次运行的预期不符说明另一个进程在导入同一来源
+            stored = conn.execute(select(checkpoint.byte_offset).where(checkpoint.source == self.source)
+                                  .with_for_update()).scalar()
+            if stored != self.offset:
+                raise IngestError(f"{self.source} is being ingested by another run (checkpoint at byte {stored})")
+            before = _lock_corpus_version(conn)
+            ids = _reserve_ids(conn, self.cases, len(batch)) if batch else []
+            if batch:
+                _insert_rows(conn, self.cases, [_as_row(i, c) for i, c in zip(ids, batch)])
+            after = _lock_corpus_version(conn)
+            conn.execute(update(ingest_checkpoints).where(checkpoint.source == self.source).values(
+                byte_offset=offset, records=self.records + records, loaded=self.loaded + len(batch),
+                rejected=self.rejected, corpus_version=after, updated_at=func.now()))
+
+        self.offset, self.records, self.corpus_version = offset, self.records + records, after
+        self.loaded += len(batch)
+        self._session_loaded += len(batch)
+        # 新出现的技术名称并入持久化词表
+        self.vocab = TechVocabulary.grow(t for c in batch for t in c['technology_stack'])
+        INGESTED_ROWS.inc(len(batch), result='loaded')
+        # 中间有其他写入时版本链断开，发布的索引标记为待刷新
+        start, end = self._chain
+        self._chain = (start, after if end is not None and end == before else None)
+        if batch:
+            self._staged.append((np.asarray(ids, dtype=np.int64),
+                                 np.asarray([text_hash(c['application_scenarios']) for c in batch], dtype='U40'),
+                                 vectors))
+            self._staged_rows += len(batch)
+            if self._staged_rows >= self.publish_rows:
+                self._publish()
+
+    def _publish(self):
+        ids, hashes, vectors = (np.concatenate(parts) for parts in zip(*self._staged))
+        self._staged, self._staged_rows = [], 0
+        with stage('ingest_publish'):
+            self.index.extend(ids, hashes, vectors, *self._chain)
+        self._chain = (self.index.corpus_version, self.index.corpus_version)
+        logger.info(f"Ingestion of {self.source}: {self.loaded} rows loaded, "
+                    f"embedding index at corpus version {self.index.corpus_version}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='CSV (with header) or JSONL file of cases')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='default: from the file extension')
+    parser.add_argument('--source', help='checkpoint name (default: absolute path of the file)')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the beginning')
+    parser.add_argument('--rejects', help='append rejected records with their errors to this JSONL file')
+    parser.add_argument('--batch', type=int, default=INGEST_BATCH, help='records per transaction')
+    parser.add_argument('--publish-rows', type=int, default=INGEST_PUBLISH_ROWS,
+                        help='publish the embedding index every this many loaded rows')
+    args = parser.parse_args()
+
+    from .main import engine, BlockchainCase
+    from .model_registry import registry
+
+    def encode(texts: List[str]) -> np.ndarray:
+        return registry.get().encode(texts, batch_size=INGEST_ENCODE_BATCH)
+
+    job = Ingestion(engine, BlockchainCase.__table__, ScenarioIndex(registry.name), encode, args.path,
+                    source=args.source, fmt=args.format, restart=args.restart, rejects=args.rejects,
+                    batch_size=args.batch, publish_rows=args.publish_rows)
+    try:
+        job.run()
+    except IngestError as e:
+        raise SystemExit(str(e))
+    print(json.dumps(job.status(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
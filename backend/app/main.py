@@ -1,19 +1,48 @@
-from fastapi import FastAPI, Depends
-from pydantic import BaseModel, field_validator
+from fastapi import FastAPI, Depends, Header, Request
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+from contextlib import asynccontextmanager
+import threading
+import logging
+from pydantic import BaseModel, ValidationError, field_validator
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, Text, TIMESTAMP, func
+from sqlalchemy import create_engine, text, select, Column, Integer, BigInteger, String, Text, TIMESTAMP, ForeignKey, func
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 import os
+import time
+import hmac
+import zipfile
+from functools import partial
 import json
 from typing import List, Dict
 from .recommender import recommend_solution
-from typing import Optional, Dict
-from fastapi.responses import HTMLResponse, FileResponse
-from .report_generator import generate_report_html, save_html_report
-import tempfile
-import pdfkit
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import Optional, Dict, Tuple
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse, PlainTextResponse, Response
+from .report_generator import ZipSink, generate_report_html, stream_report_html, template_revision, write_zip_entry
+from .http_cache import (REPORT_CACHE_CONTROL, ReportVariants, compress_stream, etag, etag_matches,
+                         negotiate_encoding)
+from .pdf_worker import PdfCache, PdfRenderPool, PdfQueueFull
+from .encoder_service import BatchingEncoder, EncoderBusy, ENCODER_MAX_BATCH
+from .embedding_cache import EmbeddingCache, normalize_text
+from concurrent.futures import Future
+from .model_registry import registry, memory_usage
+from .corpus import install_corpus_versioning, get_corpus_version
+from .case_snapshot import CaseSnapshot, SnapshotManager, shared_snapshot
+from .embedding_index import ScenarioIndex
+from .ann_index import IVFIndex, ANN_MIN_CASES
+from .scoring import COMPONENTS, CaseColumns, score_cases, weighted_totals, top_k, component_breakdown
+from .rerank_cache import RerankCache, RerankEntry
+from .result_cache import ResultCache, submission_key
+from .tech_vocab import common_technologies, jaccard
+from .submission_writer import (SubmissionWriter, SubmissionsDropped, WriteBacklogFull, WRITE_BEHIND,
+                                WRITE_FLUSH_TIMEOUT)
+from .preselect import PRESELECT_FILTERS, install_preselect_schema, preselect_clause
+from .ingest import INGEST_DIR, Ingestion, IngestError, ingest_checkpoints, install_ingest_schema
+from .metrics import (METRICS_ENABLED, REGISTRY, SIZE_BUCKETS, ERRORS, ServerTimingMiddleware,
+                      cache_result, stage)
+from .profiler import PROFILER, ProfilingMiddleware, attach
 import numpy as np
 import math
 
@@ -43,14 +72,180 @@ class BlockchainCase(Base):
     budget_range = Column(Text, nullable=False)
 
 
+class AnalysisResult(Base):
+    __tablename__ = 'analysis_results'
+    submission_id = Column(Integer, ForeignKey('case_submissions.id', ondelete='CASCADE'), primary_key=True)
+    corpus_version = Column(BigInteger, nullable=False)
+    weights = Column(Text)  # JSON, NULL = default weights
+    recommendations = Column(Text, nullable=False)  # JSON
+    system_recommendation = Column(Text, nullable=False)  # JSON
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def async_database_url(url: str) -> URL:
+    """The same database behind an asyncio driver: asyncpg for Postgres, aiosqlite for SQLite"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == 'postgresql':
+        url = url.set(drivername='postgresql+asyncpg')
+        # asyncpg 不认识 libpq 的 sslmode 参数
+        if 'sslmode' in url.query:
+            url = url.update_query_dict({'ssl': url.query['sslmode']}).difference_update_query(['sslmode'])
+    elif backend == 'sqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+    return url
+
+
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# 同步引擎用于建表、快照加载和 LISTEN；请求路径使用异步引擎
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(async_database_url(DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 Base.metadata.create_all(bind=engine)
+install_corpus_versioning(engine)
+if PRESELECT_FILTERS:
+    install_preselect_schema(engine)
+install_ingest_schema(engine)
+
+
+
+def _encode_batch(texts: List[str]) -> np.ndarray:
+    return registry.get().encode(texts, batch_size=ENCODER_MAX_BATCH)
+
+
+# 用户文本的向量缓存：提交的场景大多来自前端的固定选项
+embedding_cache = EmbeddingCache(registry.name)
+# 所有请求共享的批量编码服务，模型只在专用线程上运行
+encoder = BatchingEncoder(_encode_batch, cache=embedding_cache)
+scenario_index = ScenarioIndex(registry.name)
+# 大语料时场景预筛选使用的近似索引（IVF）
+ann_index = IVFIndex(registry.name)
+
+
+def _read_corpus_version() -> int:
+    with SessionLocal() as db:
+        return get_corpus_version(db)
+
+
+def _build_snapshot(version: int) -> CaseSnapshot:
+    # 版本号先于案例读取：若案例在两次查询之间变化，下一次版本检查会再重建一次
+    with SessionLocal() as db:
+        return CaseSnapshot.build(version, db.query(BlockchainCase).yield_per(1000), CaseMatcher().parse_case)
+
+
+def _load_snapshot() -> CaseSnapshot:
+    # 多个 worker 共享同一份内存映射的快照，只有一个 worker 读库解析
+    snapshot = shared_snapshot(_read_corpus_version, _build_snapshot,
+                               source=engine.url.render_as_string(hide_password=True))
+    for pos in np.flatnonzero(~snapshot.columns.valid):
+        logger.warning(f"Error processing case {snapshot.cases[pos].id}: invalid technical requirements or budget")
+    return snapshot
+
+
+def _listen_connection():
+    # LISTEN 需要独占一条连接，从连接池中分离出来
+    conn = engine.raw_connection()
+    conn.detach()
+    return conn.driver_connection
+
+
+# 预解析的案例快照，请求路径不再查询和解析案例表
+snapshots = SnapshotManager(_read_corpus_version, _load_snapshot)
+pdf_pool = PdfRenderPool(PdfCache())
+# 调整权重时复用已算好的分维度得分矩阵
+rerank_cache = RerankCache()
+# 近似相同的提交直接复用分析结果
+result_cache = ResultCache()
+# 已渲染报告的各压缩版本，重复查看直接返回
+report_variants = ReportVariants()
+# 提交记录和分析结果的写缓冲，/analyze 不等待插入
+writer = SubmissionWriter(async_engine, CaseSubmission.__table__, AnalysisResult.__table__)
+
+CANDIDATE_CASES = REGISTRY.histogram('smartcity_candidate_cases', 'Cases passing the scenario prefilter per analysis',
+                                     buckets=SIZE_BUCKETS)
+# 采集时才计算的指标，不占用请求路径
+REGISTRY.gauge('smartcity_pdf_queue_depth', 'PDF jobs queued or rendering', pdf_pool.queue_depth)
+REGISTRY.gauge('smartcity_encoder_pending', 'Encode requests waiting for a batch', encoder.pending)
+REGISTRY.gauge('smartcity_encoder_batches', 'Encoder forward passes so far', lambda: encoder.batches)
+REGISTRY.gauge('smartcity_corpus_version', 'Corpus version of the case snapshot in use', lambda: snapshots.version)
+REGISTRY.gauge('smartcity_scenario_index_size', 'Cases in the scenario embedding index', lambda: len(scenario_index))
+REGISTRY.gauge('smartcity_rerank_cache_entries', 'Submissions in the rerank cache', lambda: len(rerank_cache))
+REGISTRY.gauge('smartcity_result_cache_entries', 'Rankings in the submission result cache', lambda: len(result_cache))
+REGISTRY.gauge('smartcity_result_cache_saved_seconds', 'Analysis time saved by result cache hits so far',
+               lambda: result_cache.saved_seconds)
+REGISTRY.gauge('smartcity_report_cache_bytes', 'Bytes of pre-compressed report HTML held', lambda: report_variants.bytes)
+REGISTRY.gauge('smartcity_embedding_cache_entries', 'Texts in the embedding cache', lambda: len(embedding_cache))
+REGISTRY.gauge('smartcity_embedding_cache_evictions', 'Embedding cache entries evicted so far',
+               lambda: embedding_cache.evictions)
+REGISTRY.gauge('smartcity_process_pss_bytes', 'Proportional set size of this worker',
+               lambda: memory_usage().get('pss_bytes'))
+REGISTRY.gauge('smartcity_process_private_bytes', 'Memory private to this worker',
+               lambda: memory_usage().get('private_bytes'))
+REGISTRY.gauge('smartcity_write_behind_pending', 'Submissions accepted but not written yet', lambda: len(writer))
+REGISTRY.gauge('smartcity_profiles_kept', 'Request profiles kept so far', lambda: PROFILER.stats['kept'])
+REGISTRY.gauge('smartcity_profiles_rate_limited', 'Profiles skipped by the rate limit',
+               lambda: PROFILER.stats['rate_limited'])
+PDF_WAIT_SECONDS = float(os.environ.get('PDF_WAIT_SECONDS', 30))
+# 批量导出：同时加载和渲染的报告数，单次导出的报告上限
+EXPORT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', 4))
+EXPORT_MAX_REPORTS = int(os.environ.get('EXPORT_MAX_REPORTS', 500))
+
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+
+def _check_admin(token: Optional[str]) -> Optional[JSONResponse]:
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=404, content={"error": "Admin endpoints are disabled"})
+    # compare_digest 只接受 ASCII 的 str；头部按 latin-1 解码，可能带任意字符，按字节比较
+    if token is None or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return JSONResponse(status_code=401, content={"error": "Invalid admin token"})
+    return None
+
 
 # ------------ FastAPI App Setup ------------
-app = FastAPI()
+def warm_up():
+    registry.warm_up()
+    try:
+        scenario_index.load()
+        ann_index.load()
+        sync_scenario_index(snapshots.current())
+    except Exception as e:
+        logger.error(f"Embedding index warm-up failed: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loaded = embedding_cache.load()
+    if loaded:
+        logger.info(f"Embedding cache warm: {loaded} texts loaded from {embedding_cache.path}")
+    # 后台加载模型和向量索引，完成前 /ready 返回 503
+    threading.Thread(target=warm_up, name="model-warm-up", daemon=True).start()
+    if engine.dialect.name == 'postgresql':
+        snapshots.start_listener(_listen_connection)
+    writer.start()
+    yield
+    await writer.close()
+    PROFILER.close()
+    pdf_pool.shutdown()
+    encoder.shutdown()
+    try:
+        embedding_cache.save()
+    except OSError as e:
+        logger.error(f"Error saving embedding cache: {str(e)}")
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ServerTimingMiddleware)
+# 按请求头剖析需要管理令牌
+app.add_middleware(ProfilingMiddleware, authorize=lambda token: _check_admin(token) is None)
 
 app.add_middleware(
     CORSMiddleware,
@@ -61,6 +256,27 @@ app.add_middleware(
 )
 
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of the counters, gauges and stage histograms"""
+    if not METRICS_ENABLED:
+        return PlainTextResponse("Metrics are disabled", status_code=404)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the encoder model and scenario index are resident"""
+    status = {**registry.status(), "index_size": len(scenario_index),
+              "index_corpus_version": scenario_index.corpus_version,
+              "snapshot_corpus_version": snapshots.version, "corpus_listener": snapshots.listening,
+              "ann_active": ann_active(), "ann_corpus_version": ann_index.corpus_version,
+              "embedding_cache": embedding_cache.stats(), "result_cache": result_cache.stats()}
+    if not registry.is_ready() or scenario_index.corpus_version is None:
+        return JSONResponse(status_code=503, content={"status": "loading", **status})
+    return {"status": "ready", **status}
+
+
 # ------------ Pydantic Models ------------
 class Submission(BaseModel):
     applicationScenarios: str
@@ -70,32 +286,99 @@ class Submission(BaseModel):
     budgetRange: str  # JSON array string
     weights: Optional[Dict[str, float]] = None
 
+    @field_validator('technicalRequirements')
+    @classmethod
+    def normalize_security_level(cls, v):
+        # 安全等级按小写精确匹配；在这里统一大小写，打分、结果缓存和落库用的是同一个值
+        try:
+            tech_req = json.loads(v)
+        except ValueError:
+            # 格式错误由 parse_input 报告
+            return v
+        if isinstance(tech_req, dict) and isinstance(tech_req.get('security_level'), str):
+            level = tech_req['security_level'].strip().lower()
+            if level != tech_req['security_level']:
+                return json.dumps({**tech_req, 'security_level': level})
+        return v
+
     @field_validator('weights')
     @classmethod
-    def check_weight_sum(cls, v):
+    def check_weights(cls, v):
+        # 打分按 COMPONENTS 逐项取权重，缺一项就无法计算
         if v is not None:
+            if set(v) != set(COMPONENTS):
+                raise ValueError(f"Weights must be given for exactly: {', '.join(COMPONENTS)}")
             total = sum(v.values())
             if total > 1:
                 raise ValueError(f"Sum of weights cannot exceed 1. Currently: {total}")
         return v
-def get_db():
-    db = SessionLocal()
-    try:
+
+
+class ExportRequest(BaseModel):
+    submission_ids: List[int]
+
+    @field_validator('submission_ids')
+    @classmethod
+    def check_ids(cls, v):
+        if not v:
+            raise ValueError("At least one submission id is required")
+        if len(v) > EXPORT_MAX_REPORTS:
+            raise ValueError(f"At most {EXPORT_MAX_REPORTS} reports can be exported at once")
+        return list(dict.fromkeys(v))
+
+
+class RerankRequest(BaseModel):
+    weights: Dict[str, float]
+    k: int = 3
+
+    @field_validator('weights')
+    @classmethod
+    def check_weights(cls, v):
+        return Submission.check_weights(v)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def sync_scenario_index(snapshot: CaseSnapshot) -> ScenarioIndex:
+    """Re-encode scenarios of cases added or changed since the index was last built"""
+    if scenario_index.corpus_version != snapshot.version:
+        rows = ((c.id, c.application_scenarios) for c in snapshot.cases)
+        # 案例文本不进缓存，以免挤掉用户文本
+        encoded = scenario_index.refresh(rows, partial(CaseMatcher().encode, cached=False), snapshot.version)
+        logger.info(f"Embedding index refreshed to corpus version {snapshot.version}: {encoded} scenarios encoded")
+    if len(scenario_index) >= ANN_MIN_CASES and ann_index.corpus_version != scenario_index.corpus_version:
+        inserted = ann_index.sync(scenario_index.ids, scenario_index.hashes, scenario_index.matrix,
+                                  scenario_index.corpus_version)
+        logger.info(f"ANN index synced to corpus version {ann_index.corpus_version}: {inserted} rows inserted")
+    return scenario_index
+
+
+def ann_active() -> bool:
+    return len(scenario_index) >= ANN_MIN_CASES
 
 # ------------ Matching Logic ------------
 class CaseMatcher:
-    def __init__(self):
-        self.weights = {
-            'scenario': 0.3,
-            'tech_req': 0.25,
-            'tech_stack': 0.2,
-            'city_size': 0.15,
-            'budget': 0.1
-        }
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    DEFAULT_WEIGHTS = {
+        'scenario': 0.3,
+        'tech_req': 0.25,
+        'tech_stack': 0.2,
+        'city_size': 0.15,
+        'budget': 0.1
+    }
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, model=None):
+        # 模型由进程级 registry 持有，每个请求只创建轻量的 matcher
+        self.weights = weights if weights else dict(self.DEFAULT_WEIGHTS)
+        self._model = model
+
+    @property
+    def model(self):
+        # 只读取已存分析结果的请求不需要模型
+        return self._model if self._model is not None else registry.get()
+
     def parse_input(self, data: Submission) -> dict:
         try:
             tech_req = data.technicalRequirements
@@ -120,6 +403,20 @@ class CaseMatcher:
         except Exception as e:
             raise ValueError(f"Invalid input format: {str(e)}")
 
+    def submit_encode(self, texts: List[str], timeout: Optional[float] = None, cached: bool = True) -> Future:
+        """Queue texts on the shared batching encoder; resolves to L2-normalised embeddings"""
+        if self._model is None:
+            return encoder.submit(texts, timeout, cached)
+        # 显式传入的模型直接编码，文本同编码服务一样先规范化
+        future = Future()
+        future.set_result(self._model.encode([normalize_text(t) for t in texts]))
+        return future
+
+    def encode(self, texts: List[str], cached: bool = True) -> np.ndarray:
+        """L2-normalised embeddings, so cosine similarity is a plain dot product"""
+        with stage('encode'):
+            return self.submit_encode(texts, cached=cached).result()
+
     def calculate_similarity(self, user: dict, case: BlockchainCase) -> float:
         """Calculate similarity score between user input and case"""
         case_data = self.parse_case(case)
@@ -150,8 +447,11 @@ class CaseMatcher:
             tech_req = (case.technical_requirements if isinstance(case.technical_requirements, dict)
                         else json.loads(case.technical_requirements))
 
-            tech_stack = (case.technology_stack if isinstance(case.technology_stack, list)
-                          else [t.strip() for t in case.technology_stack.split(',')])
+            tech_stack = case.technology_stack
+            if isinstance(tech_stack, str):
+                # SQLite 上 JSON 列读出来是文本
+                tech_stack = (json.loads(tech_stack) if tech_stack.lstrip().startswith('[')
+                              else [t.strip() for t in tech_stack.split(',')])
 
             budget = (case.budget_range if isinstance(case.budget_range, list)
                       else json.loads(case.budget_range))
@@ -164,7 +464,8 @@ class CaseMatcher:
                 'budget_range': budget
             }
         except Exception as e:
-            print(f"Error parsing case {case.id}: {str(e)}")
+            ERRORS.inc(where='parse_case')
+            logger.warning(f"Error parsing case {case.id}: {str(e)}")
             return {
                 'application_scenarios': case.application_scenarios,
                 'technical_requirements': {},
@@ -173,14 +474,18 @@ class CaseMatcher:
                 'budget_range': [0, 0]
             }
 
+    def score_columns(self, user: dict, cols: CaseColumns, scenario_scores: np.ndarray):
+        """Vectorised calculate_similarity over a whole column store"""
+        return score_cases(user, cols, scenario_scores, self.weights)
+
     def _text_match(self, text1: str, text2: str) -> float:
         """text similarity"""
         try:
-            embeddings = self.model.encode([text1, text2])
-            sim = cosine_similarity([embeddings[0]], [embeddings[1]])[0][0]
-            return float(sim)
+            embeddings = self.encode([text1, text2])
+            return float(np.dot(embeddings[0], embeddings[1]))
         except Exception as e:
-            print(f"Text match error: {str(e)}")
+            ERRORS.inc(where='text_match')
+            logger.error(f"Text match error: {str(e)}")
             return 0.0
 
     @staticmethod
@@ -199,12 +504,8 @@ class CaseMatcher:
         return 0.4 * tps_score + 0.3 * latency_score + 0.3 * sec_score
 
     def _tech_stack_match(self, user_stack: list, case_stack: list) -> float:
-        """Jaccard similarity for technology stack"""
-        set_user = set(user_stack)
-        set_case = set(case_stack)
-        intersection = set_user & set_case
-        union = set_user | set_case
-        return len(intersection) / len(union) if union else 0
+        """Jaccard similarity for technology stack (canonical names, see tech_vocab)"""
+        return jaccard(user_stack, case_stack)
 
     def _budget_match(self, user_budget: list, case_budget: list) -> float:
         """Budget range matching"""
@@ -240,7 +541,7 @@ class CaseMatcher:
             reasons.append("Budget range compatible")
 
         # Technology stack overlap
-        common_tech = set(user['technology_stack']) & set(case['technology_stack'])
+        common_tech = common_technologies(user['technology_stack'], case['technology_stack'])
         if common_tech:
             reasons.append(f"Common technologies: {', '.join(common_tech)}")
 
@@ -250,6 +551,97 @@ class CaseMatcher:
 
         return reasons[:3]  # Return top 3 reasons
 
+
+def scenario_scores(matcher: CaseMatcher, snapshot: CaseSnapshot, text: str,
+                    query: Optional[Future] = None) -> np.ndarray:
+    """Scenario similarity of ``text`` to every snapshot case, read from the precomputed index.
+
+    ``query`` is the already-submitted encoding of ``text``, if the caller started it early.
+    """
+    with stage('encode'):
+        query_vecs = (query or matcher.submit_encode([text])).result()
+    return scenario_score_matrix(matcher, snapshot, [text], query_vecs)[:, 0]
+
+
+def scenario_score_matrix(matcher: CaseMatcher, snapshot: CaseSnapshot, texts: List[str],
+                          query_vecs: np.ndarray) -> np.ndarray:
+    """(cases x texts) scenario similarities, one matrix product against the index"""
+    index = sync_scenario_index(snapshot)
+    with stage('scenario_scan'):
+        scores = snapshot.align(*index.scores(query_vecs))
+    # 索引已被更新版本的快照刷新时，缺失的案例退回逐条编码
+    for pos in np.flatnonzero(np.isnan(scores).any(axis=1)):
+        for j, text in enumerate(texts):
+            scores[pos, j] = matcher._text_match(text, snapshot.cases[pos].application_scenarios)
+    return scores
+
+
+def ann_candidates(matcher: CaseMatcher, snapshot: CaseSnapshot, text: str, threshold: float,
+                   query: Optional[Future] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Snapshot positions (ascending) and scenario scores of cases the ANN index puts at or above ``threshold``"""
+    sync_scenario_index(snapshot)
+    with stage('encode'):
+        query_vec = (query or matcher.submit_encode([text])).result()[0]
+    with stage('scenario_ann'):
+        ids, scores = ann_index.search(query_vec, threshold=threshold)
+    positions, found = snapshot.locate(ids)
+    positions, scores = positions[found], scores[found].astype(np.float64)
+    order = np.argsort(positions)
+    return positions[order], scores[order]
+
+
+def score_candidates(matcher: CaseMatcher, user_data: dict, snapshot: CaseSnapshot,
+                     positions: np.ndarray, scenario: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Score the snapshot cases at ``positions`` on all dimensions in one vectorised pass.
+
+    ``scenario`` are the scenario scores at ``positions``. Returns the positions
+    actually scored (invalid cases dropped) and their component matrix.
+    """
+    valid = snapshot.columns.valid[positions]
+    keep = positions[valid]
+    try:
+        components, _ = matcher.score_columns(user_data, snapshot.columns.take(keep), scenario[valid])
+    except Exception as e:
+        ERRORS.inc(where='score')
+        logger.error(f"Error scoring cases: {str(e)}")
+        return np.empty(0, dtype=np.int64), np.empty((0, len(COMPONENTS)))
+    return keep, components
+
+
+def rank_cases(snapshot: CaseSnapshot, positions: np.ndarray, components: np.ndarray,
+               weights: Dict[str, float], k: int = 3) -> list:
+    """Top k of scored candidates under ``weights`` as (score, case, case_data, breakdown), best first"""
+    totals = weighted_totals(components, weights)
+    ranked = []
+    for p in top_k(totals, k):
+        case = snapshot.cases[positions[p]]
+        ranked.append((float(totals[p]), case, case.as_dict(), component_breakdown(components, p)))
+    return ranked
+
+
+def format_recommendations(matcher: CaseMatcher, user_data: dict, ranked: list) -> List[dict]:
+    results = []
+    for score, case, case_data, breakdown in ranked:
+        try:
+            budget_range = [float(x) for x in case_data['budget_range']] if isinstance(case_data['budget_range'], list) else [0.0, 0.0]
+
+            results.append({
+                "score": round(float(score), 2),
+                "case_name": case.case_name,
+                "application_scenarios": case.application_scenarios,
+                "technology_stack": case_data['technology_stack'],
+                "city_size": case.city_size,
+                "budget_range": budget_range,
+                "match_reasons": matcher._get_match_reasons(user_data, case_data),
+                "match_breakdown": breakdown
+            })
+
+        except Exception as e:
+            ERRORS.inc(where='format')
+            logger.error(f"Error formatting result for case {case.id}: {str(e)}")
+            continue
+    return results
+
 # @app.post("/analyze")
 # def analyze(data: Submission, db: Session = Depends(get_db)):
 #     # Store submission
@@ -328,139 +720,708 @@ class CaseMatcher:
 #         "recommendations": results,
 #         "system_recommendation": recommend_solution(user_data)
 #     }
-@app.post("/analyze")
-def analyze(data: Submission, db: Session = Depends(get_db)):
-    # 保存提交记录
-    submission = CaseSubmission(
-        application_scenarios=data.applicationScenarios,
-        technical_requirements=data.technicalRequirements,
-        technology_stack=data.technologyStack,
-        city_size=data.citySize,
-        budget_range=data.budgetRange
-    )
-    db.add(submission)
-    db.commit()
-    db.refresh(submission)
-
-    # 加载所有案例
-    all_cases = db.query(BlockchainCase).all()
+def score_submission(matcher: CaseMatcher, user_data: dict, snapshot: CaseSnapshot,
+                     query: Optional[Future] = None, scenario: Optional[np.ndarray] = None,
+                     preselected: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Scenario prefilter, pre-selection and component scoring; returns (positions, components).
+
+    ``scenario`` are the precomputed scenario scores over the snapshot, if the caller has them;
+    ``preselected`` are the case ids passing the SQL hard filters (see preselect_ids).
+    """
+    # Step 1: 应用场景预筛选（用户文本编码一次，与预计算的案例向量矩阵相乘）
+    # 案例数超过 ANN_MIN_CASES 时改用 IVF 近似索引，只扫描最近的几个簇
+    SCENARIO_THRESHOLD = 0.6  # 可根据实际调整
+    scenario_text = user_data['application_scenarios']
+    if scenario is None and ann_active():
+        passed, passed_scores = ann_candidates(matcher, snapshot, scenario_text, SCENARIO_THRESHOLD, query)
+    else:
+        if scenario is None:
+            scenario = scenario_scores(matcher, snapshot, scenario_text, query)
+        passed = np.flatnonzero(scenario >= SCENARIO_THRESHOLD)
+        passed_scores = scenario[passed]
+
+    # 案例来自预解析快照；启用 PRESELECT_FILTERS 时只保留通过索引化 SQL 硬过滤的 id
+    if preselected is not None:
+        hit = np.isin(passed, snapshot.positions_of(preselected))
+        passed, passed_scores = passed[hit], passed_scores[hit]
+    CANDIDATE_CASES.observe(len(passed))
+
+    # Step 2: 对通过预筛选的案例进行全维度向量化打分
+    with stage('score'):
+        return score_candidates(matcher, user_data, snapshot, passed, passed_scores)
+
+
+async def preselect_ids(db: AsyncSession, user_data: dict) -> Optional[np.ndarray]:
+    """Ids of cases passing the indexed SQL hard filters; None when PRESELECT_FILTERS is off"""
+    where, params = preselect_clause(user_data)
+    if not where:
+        return None
+    with stage('preselect'):
+        result = await db.execute(text(f"SELECT id FROM blockchain_cases WHERE {where}"), params)
+        return np.fromiter(result.scalars(), dtype=np.int64)
+
+
+def rank_submission(matcher: CaseMatcher, user_data: dict, snapshot: CaseSnapshot,
+                    query: Optional[Future] = None, submission_id: Optional[int] = None,
+                    preselected: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, list]:
+    """Scenario prefilter, full scoring and the top 3 as rank_cases entries.
+
+    Returns the scored positions and component matrix along with the ranking.
+    With ``submission_id`` the component matrix is kept in the rerank cache.
+    """
+    positions, components = score_submission(matcher, user_data, snapshot, query, preselected=preselected)
+    if submission_id is not None:
+        rerank_cache.put(submission_id, user_data, snapshot.version, positions, components)
+
+    # Step 3: argpartition 选出 Top 3
+    with stage('rank'):
+        return positions, components, rank_cases(snapshot, positions, components, matcher.weights)
+
+
+def build_analysis(matcher: CaseMatcher, user_data: dict, ranked: list) -> dict:
+    """Formatted recommendations for ``ranked`` and the rule-based system recommendation for ``user_data``"""
+    with stage('format'):
+        recommendations = format_recommendations(matcher, user_data, ranked)
+    with stage('recommend_solution'):
+        system_recommendation = recommend_solution(user_data)
+    return {
+        "recommendations": recommendations,
+        "system_recommendation": system_recommendation
+    }
+
+
+def run_analysis(matcher: CaseMatcher, user_data: dict, snapshot: CaseSnapshot,
+                 query: Optional[Future] = None, submission_id: Optional[int] = None,
+                 preselected: Optional[np.ndarray] = None) -> dict:
+    """Scenario prefilter, full scoring and formatting of the top 3 recommendations (see rank_submission)"""
+    _, _, ranked = rank_submission(matcher, user_data, snapshot, query, submission_id, preselected)
+    return build_analysis(matcher, user_data, ranked)
+
+
+def current_snapshot() -> CaseSnapshot:
+    # 版本检查和重建可能访问数据库，异步端点在线程池中调用
+    with stage('snapshot'):
+        return snapshots.current()
+
+
+def submission_row(submission_id: int, data: Submission) -> dict:
+    return {
+        "id": submission_id,
+        "application_scenarios": data.applicationScenarios,
+        "technical_requirements": data.technicalRequirements,
+        "technology_stack": data.technologyStack,
+        "city_size": data.citySize,
+        "budget_range": data.budgetRange
+    }
+
+
+def analysis_row(submission_id: int, corpus_version: int, analysis: dict,
+                 weights: Optional[Dict[str, float]] = None) -> dict:
+    return {
+        "submission_id": submission_id,
+        "corpus_version": corpus_version,
+        "weights": json.dumps(weights) if weights else None,
+        "recommendations": json.dumps(analysis['recommendations']),
+        "system_recommendation": json.dumps(analysis['system_recommendation'])
+    }
+
+
+async def save_analysis(db: AsyncSession, submission_id: int, corpus_version: int, analysis: dict,
+                        weights: Optional[Dict[str, float]] = None) -> AnalysisResult:
+    stored = await db.get(AnalysisResult, submission_id)
+    if stored is None:
+        stored = AnalysisResult(submission_id=submission_id,
+                                weights=json.dumps(weights) if weights else None)
+        db.add(stored)
+    stored.corpus_version = corpus_version
+    stored.recommendations = json.dumps(analysis['recommendations'])
+    stored.system_recommendation = json.dumps(analysis['system_recommendation'])
+    return stored
+
+
+def parse_submission(matcher: CaseMatcher, submission) -> dict:
+    """Parse a stored case_submissions row (mapping) back into user data"""
+    return matcher.parse_input(Submission(
+        applicationScenarios=submission['application_scenarios'],
+        technicalRequirements=submission['technical_requirements'],
+        technologyStack=submission['technology_stack'],
+        citySize=submission['city_size'],
+        budgetRange=submission['budget_range']
+    ))
+
+
+async def load_submission(db: AsyncSession, submission_id: int, with_analysis: bool = False):
+    """(submission row, analysis row) as mappings, from the write-behind buffer or the database.
+
+    The submission is None when it does not exist; the analysis is None when
+    not requested or not stored. The last element is True for rows still buffered.
+    """
+    pending = writer.get(submission_id)
+    if pending is not None:
+        return pending.submission, pending.analysis, True
+    submissions, analyses = CaseSubmission.__table__, AnalysisResult.__table__
+    submission = (await db.execute(select(submissions).where(submissions.c.id == submission_id))).mappings().first()
+    stored = None
+    if submission is not None and with_analysis:
+        stored = (await db.execute(
+            select(analyses).where(analyses.c.submission_id == submission_id))).mappings().first()
+    return submission, stored, False
+
+
+async def load_analysis(db: AsyncSession, submission_id: int) -> Optional[Tuple[dict, dict]]:
+    """Analysis stored by /analyze for ``submission_id``; None if there is no such submission.
+
+    Re-runs the analysis (and stores it) only when the case corpus has changed
+    since it was computed, or when nothing was stored yet.
+    """
+    submission, stored, pending = await load_submission(db, submission_id, with_analysis=True)
+    if submission is None:
+        return None
+    weights = json.loads(stored['weights']) if stored is not None and stored['weights'] else None
+    matcher = CaseMatcher(weights=weights)
+    user_data = parse_submission(matcher, submission)
+
+    snapshot = await run_in_threadpool(current_snapshot)
+    cache_result('analysis', stored is not None and stored['corpus_version'] == snapshot.version)
+    if stored is not None and stored['corpus_version'] == snapshot.version:
+        return user_data, {
+            "recommendations": json.loads(stored['recommendations']),
+            "system_recommendation": json.loads(stored['system_recommendation'])
+        }
+
+    preselected = await preselect_ids(db, user_data)
+    analysis = await run_in_threadpool(run_analysis, matcher, user_data, snapshot, None, submission_id, preselected)
+    # 仍在写缓冲中的提交稍后会落库，这里只返回新结果
+    if not pending:
+        await save_analysis(db, submission_id, snapshot.version, analysis, weights)
+        await db.commit()
+    return user_data, analysis
+
 
+def _busy(error: Exception) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"status": "busy", "error": str(error)},
+                        headers={"Retry-After": "1"})
+
+
+async def _commit(submission_ids: List[int]) -> Optional[JSONResponse]:
+    """With WRITE_BEHIND=0, wait for these submissions to be written; 503 if that fails or takes too long"""
+    with stage('commit'):
+        try:
+            await writer.flush(WRITE_FLUSH_TIMEOUT, ids=submission_ids)
+        except asyncio.TimeoutError:
+            # 行仍在写缓冲中，稍后写入或按重试上限丢弃
+            return _busy(TimeoutError(f"Submission not written within {WRITE_FLUSH_TIMEOUT:g}s"))
+        except SubmissionsDropped as e:
+            # 写入重试用尽，这些 id 不会出现在库中，不能当作成功返回
+            return JSONResponse(status_code=503, content={"status": "error", "error": str(e)})
+    return None
+
+
+@app.post("/analyze")
+async def analyze(data: Submission, db: AsyncSession = Depends(get_async_db)):
     # 初始化匹配器
+    matcher = CaseMatcher(weights=data.weights)
+
+    with stage('parse'):
+        user_data = matcher.parse_input(data)
+        try:
+            key = submission_key(user_data, data.weights) if result_cache.enabled else None
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # 格式不对的输入不缓存，照常走分析流程报错
+            key = None
+
+    snapshot = await run_in_threadpool(current_snapshot)
+    cached = result_cache.get(key, snapshot.version) if key is not None else None
+    if key is not None:
+        cache_result('result', cached is not None)
+
+    if cached is not None:
+        submission_id = (await writer.reserve())[0]
+        # 与未命中时一样为新提交保存分量矩阵，滑块调权时 /rerank 无需重新打分
+        positions, components, ranked = cached
+        rerank_cache.put(submission_id, user_data, snapshot.version, positions, components)
+    else:
+        start = time.perf_counter()
+        # 先提交编码请求，与下面的 id 预留和 SQL 预筛选并行
+        try:
+            query = matcher.submit_encode([user_data['application_scenarios']], timeout=0)
+        except EncoderBusy as e:
+            return _busy(e)
+
+        # submission id 从预留的序列区间中分配，不等待插入
+        submission_id = (await writer.reserve())[0]
+        preselected = await preselect_ids(db, user_data)
+        positions, components, ranked = await run_in_threadpool(rank_submission, matcher, user_data, snapshot,
+                                                                query, submission_id, preselected)
+        if key is not None:
+            result_cache.put(key, snapshot.version, (positions, components, ranked), time.perf_counter() - start)
+    # 缓存只保存排名；推荐理由和系统推荐按本次提交计算，量化后相近的提交可能落在阈值两侧
+    analysis = build_analysis(matcher, user_data, ranked)
+
+    # 提交记录和分析结果由写缓冲批量落库；报告和 PDF 直接读取，无需重新打分
+    try:
+        writer.submit(submission_row(submission_id, data),
+                      analysis_row(submission_id, snapshot.version, analysis, data.weights))
+    except WriteBacklogFull as e:
+        return _busy(e)
+    if not WRITE_BEHIND:
+        failed = await _commit([submission_id])
+        if failed is not None:
+            return failed
+
+    return {
+        "submission_id": submission_id,
+        **analysis
+    }
+
+
+async def _rerank_entry(db: AsyncSession, submission_id: int, snapshot: CaseSnapshot) -> Optional[RerankEntry]:
+    """Cached component matrix for ``submission_id``, rescored (read-only) after expiry or a corpus change"""
+    entry = rerank_cache.get(submission_id, snapshot.version)
+    cache_result('rerank', entry is not None)
+    if entry is not None:
+        return entry
+    submission, _, _ = await load_submission(db, submission_id)
+    if submission is None:
+        return None
     matcher = CaseMatcher()
-    if data.weights:
-        matcher.weights = data.weights
+    user_data = parse_submission(matcher, submission)
+    preselected = await preselect_ids(db, user_data)
+    positions, components = await run_in_threadpool(score_submission, matcher, user_data, snapshot,
+                                                    preselected=preselected)
+    return rerank_cache.put(submission_id, user_data, snapshot.version, positions, components)
 
-    user_data = matcher.parse_input(data)
 
-    # Step 1: 应用场景预筛选
-    SCENARIO_THRESHOLD = 0.6  # 可根据实际调整
-    scenario_matches = []
-    for case in all_cases:
-        sim_score = matcher._text_match(user_data['application_scenarios'], case.application_scenarios)
-        if sim_score >= SCENARIO_THRESHOLD:
-            scenario_matches.append((sim_score, case))
-
-    # Step 2: 对通过预筛选的案例进行全维度打分
-    scored_cases = []
-    for scenario_score, case in scenario_matches:
+@app.post("/rerank/{submission_id}")
+async def rerank(submission_id: int, data: RerankRequest, db: AsyncSession = Depends(get_async_db)):
+    """Re-rank an analysed submission under new weights without writing to the database"""
+    snapshot = await run_in_threadpool(current_snapshot)
+    entry = await _rerank_entry(db, submission_id, snapshot)
+    if entry is None:
+        return JSONResponse(status_code=404, content={"error": "Submission not found"})
+
+    matcher = CaseMatcher(weights=data.weights)
+    ranked = rank_cases(snapshot, entry.positions, entry.components, data.weights, data.k)
+    return {
+        "submission_id": submission_id,
+        "weights": data.weights,
+        "recommendations": format_recommendations(matcher, entry.user_data, ranked)
+    }
+
+
+ANALYZE_BATCH_MAX = int(os.environ.get('ANALYZE_BATCH_MAX', 1000))
+
+
+def score_batch(parsed: list, query_vecs: Optional[np.ndarray], preselected: list) -> Tuple[CaseSnapshot, list, dict]:
+    """Score validated batch items against one snapshot.
+
+    Returns the snapshot, (item, user_data, positions, components, analysis) per
+    scored item, and errors by input index.
+    """
+    snapshot = current_snapshot()
+    texts = [user_data['application_scenarios'] for _, _, _, user_data in parsed]
+    # 近似索引模式下逐条查询，避免生成 (案例数 x 批大小) 的完整矩阵
+    scenario = scenario_score_matrix(CaseMatcher(), snapshot, texts, query_vecs) if texts and not ann_active() else None
+
+    scored, errors = [], {}
+    for j, (i, data, matcher, user_data) in enumerate(parsed):
         try:
-            case_data = matcher.parse_case(case)
-            scores = {
-                'scenario': scenario_score,
-                'tech_req': matcher._tech_requirement_match(user_data['technical_requirements'], case_data['technical_requirements']),
-                'tech_stack': matcher._tech_stack_match(user_data['technology_stack'], case_data['technology_stack']),
-                'city_size': 1.0 if user_data['city_size'] == case_data['city_size'] else 0.3,
-                'budget': matcher._budget_match(user_data['budget_range'], case_data['budget_range']),
-            }
-            total_score = sum(scores[k] * matcher.weights[k] for k in scores)
-            scored_cases.append((total_score, case, scores))
+            if scenario is not None:
+                positions, components = score_submission(matcher, user_data, snapshot, scenario=scenario[:, j],
+                                                         preselected=preselected[j])
+            else:
+                query = Future()
+                query.set_result(query_vecs[j:j + 1])
+                positions, components = score_submission(matcher, user_data, snapshot, query,
+                                                         preselected=preselected[j])
+            ranked = rank_cases(snapshot, positions, components, matcher.weights)
+            scored.append((i, data, user_data, positions, components, {
+                "recommendations": format_recommendations(matcher, user_data, ranked),
+                "system_recommendation": recommend_solution(user_data)
+            }))
         except Exception as e:
-            print(f"Error processing case {case.id}: {str(e)}")
+            ERRORS.inc(where='analyze_batch')
+            logger.error(f"Error analysing batch item {i}: {str(e)}")
+            errors[i] = str(e)
+    return snapshot, scored, errors
 
-    # 排序并选出Top 3
-    scored_cases.sort(reverse=True, key=lambda x: x[0])
-    results = []
 
-    for score, case, breakdown in scored_cases[:3]:
+@app.post("/analyze/batch")
+async def analyze_batch(items: List[dict], db: AsyncSession = Depends(get_async_db)):
+    """Analyse many submissions at once, streamed back as NDJSON in input order.
+
+    Every scenario is encoded in one encoder batch and scored against the index
+    in one matrix product; the valid submissions and their analyses go through
+    the write-behind buffer together. An invalid item yields an ``error`` line
+    instead of failing the whole batch.
+    """
+    if len(items) > ANALYZE_BATCH_MAX:
+        return JSONResponse(status_code=413, content={"error": f"At most {ANALYZE_BATCH_MAX} submissions per batch"})
+
+    results: List[dict] = [{} for _ in items]
+    parsed = []  # (index, data, matcher, user_data)
+    for i, item in enumerate(items):
         try:
-            case_data = matcher.parse_case(case)
-            budget_range = [float(x) for x in case_data['budget_range']] if isinstance(case_data['budget_range'], list) else [0.0, 0.0]
+            data = Submission.model_validate(item)
+            matcher = CaseMatcher(weights=data.weights)
+            parsed.append((i, data, matcher, matcher.parse_input(data)))
+        except (ValidationError, ValueError) as e:
+            results[i] = {"error": str(e)}
 
-            results.append({
-                "score": round(float(score), 2),
-                "case_name": case.case_name,
-                "application_scenarios": case.application_scenarios,
-                "technology_stack": case_data['technology_stack'],
-                "city_size": case.city_size,
-                "budget_range": budget_range,
-                "match_reasons": matcher._get_match_reasons(user_data, case_data),
-                "match_breakdown": breakdown
-            })
+    texts = [user_data['application_scenarios'] for _, _, _, user_data in parsed]
+    try:
+        query_vecs = await encoder.encode_async(texts) if texts else None
+    except EncoderBusy as e:
+        return _busy(e)
+    preselected = [await preselect_ids(db, user_data) for _, _, _, user_data in parsed]
+    snapshot, scored, errors = await run_in_threadpool(score_batch, parsed, query_vecs, preselected)
+    for i, error in errors.items():
+        results[i] = {"error": error}
 
-        except Exception as e:
-            print(f"Error formatting result for case {case.id}: {str(e)}")
-            continue
+    ids = await writer.reserve(len(scored)) if scored else []
+    try:
+        for sid, (i, data, user_data, positions, components, analysis) in zip(ids, scored):
+            writer.submit(submission_row(sid, data), analysis_row(sid, snapshot.version, analysis, data.weights))
+            rerank_cache.put(sid, user_data, snapshot.version, positions, components)
+            results[i] = {"submission_id": sid, **analysis}
+    except WriteBacklogFull as e:
+        return _busy(e)
+    if scored and not WRITE_BEHIND:
+        failed = await _commit(ids)
+        if failed is not None:
+            return failed
+
+    def lines():
+        for i, result in enumerate(results):
+            yield json.dumps({"index": i, **result}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def report_context(db: AsyncSession, submission_id: int) -> Optional[dict]:
+    """Template variables of the report for ``submission_id``; None if there is no such submission"""
+    with stage('load_analysis'):
+        loaded = await load_analysis(db, submission_id)
+    if loaded is None:
+        return None
+
+    user_data, analysis = loaded
+    return {"submission": user_data, "recommendation": analysis['system_recommendation'],
+            "cases": analysis['recommendations']}
 
-    return {
-        "submission_id": submission.id,
-        "recommendations": results,
-        "system_recommendation": recommend_solution(user_data)
-    }
+
+async def render_report(db: AsyncSession, submission_id: int) -> Optional[str]:
+    context = await report_context(db, submission_id)
+    if context is None:
+        return None
+
+    def render():
+        # 在线程池线程里计时，请求被剖析时这个线程也会被采样
+        with stage('render_html'):
+            return generate_report_html(**context)
+
+    return await run_in_threadpool(render)
+
+
+def _attached_chunks(chunks):
+    """Sample whichever pool thread produces each chunk of a streamed response into the request's profile"""
+    chunks = iter(chunks)
+    while True:
+        with attach():
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _not_modified(request: Request, tag: str, headers: dict) -> Optional[Response]:
+    # 报告只随提交、语料和模板变化：ETag 相同时不查库也不渲染
+    hit = etag_matches(request.headers.get('if-none-match'), tag)
+    cache_result('http_etag', hit)
+    return Response(status_code=304, headers=headers) if hit else None
 
 
 @app.get("/generate_report/{submission_id}", response_class=HTMLResponse)
-def generate_report(submission_id: int, db: Session = Depends(get_db)):
-    submission = db.query(CaseSubmission).filter(CaseSubmission.id == submission_id).first()
-    if not submission:
-        return HTMLResponse(content="Submission not found", status_code=404)
+async def generate_report(submission_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """The report as HTML, with a strong ETag and gzip/brotli variants cached after the first view"""
+    version = (await run_in_threadpool(current_snapshot)).version
+    revision = template_revision()
+    encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+    tag = etag('report', submission_id, version, revision, encoding)
+    headers = {"ETag": tag, "Cache-Control": REPORT_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    not_modified = _not_modified(request, tag, headers)
+    if not_modified is not None:
+        return not_modified
 
-    cases = db.query(BlockchainCase).all()
-    matcher = CaseMatcher()
-    user_data = matcher.parse_input(Submission(
-        applicationScenarios=submission.application_scenarios,
-        technicalRequirements=submission.technical_requirements,
-        technologyStack=submission.technology_stack,
-        citySize=submission.city_size,
-        budgetRange=submission.budget_range
-    ))
-    scored = [(matcher.calculate_similarity(user_data, c), c) for c in cases]
-    top_cases = sorted(scored, key=lambda x: -x[0])[:3]
-    parsed_cases = [matcher.parse_case(c[1]) | {'case_name': c[1].case_name} for c in top_cases]
+    if encoding != 'identity':
+        headers["Content-Encoding"] = encoding
+    key = (submission_id, version, revision)
+    variants = report_variants.get(key)
+    cache_result('report_html', variants is not None)
+    if variants is not None:
+        return Response(variants[encoding], media_type="text/html; charset=utf-8", headers=headers)
+
+    context = await report_context(db, submission_id)
+    if context is None:
+        return HTMLResponse(content="Submission not found", status_code=404, headers={"Cache-Control": "no-store"})
+    if snapshots.version != version:
+        # 加载期间语料已更新，内容与 ETag 不再对应
+        headers = {"Cache-Control": "no-store", **({"Content-Encoding": encoding} if encoding != 'identity' else {})}
+        store = None
+    else:
+        store = partial(report_variants.put, key) if report_variants.enabled else None
+    # 边渲染边压缩发送，大报告不必先在内存中拼成整页
+    body = compress_stream(stream_report_html(**context), encoding, store)
+    return StreamingResponse(_attached_chunks(body), media_type="text/html; charset=utf-8", headers=headers)
+
+
+async def _export_report(submission_id: int) -> Optional[str]:
+    # 每个并行任务使用自己的数据库会话
+    async with AsyncSessionLocal() as db:
+        return await render_report(db, submission_id)
+
+
+@app.post("/export_reports")
+async def export_reports(request: ExportRequest):
+    """HTML reports of several submissions as one ZIP archive, streamed while it is built.
+
+    Up to EXPORT_CONCURRENCY reports are loaded and rendered ahead of the one
+    being compressed, so memory holds only that many documents. Submissions
+    that do not exist are listed in missing.txt.
+    """
+    ids = request.submission_ids
+
+    async def archive():
+        sink = ZipSink()
+        zf = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+        pending = {}
+        missing = []
+        try:
+            for i, submission_id in enumerate(ids):
+                # 保持 EXPORT_CONCURRENCY 个报告在并行渲染
+                for ahead in ids[i:i + EXPORT_CONCURRENCY]:
+                    if ahead not in pending:
+                        pending[ahead] = asyncio.ensure_future(_export_report(ahead))
+                try:
+                    html = await pending.pop(submission_id)
+                except Exception as e:
+                    ERRORS.inc(where='export')
+                    logger.error(f"Error rendering report {submission_id} for export: {str(e)}")
+                    html = None
+                if html is None:
+                    missing.append(submission_id)
+                    continue
+                with stage('export_zip'):
+                    await run_in_threadpool(write_zip_entry, zf, f"report_{submission_id}.html", html)
+                del html
+                yield sink.take()
+            if missing:
+                zf.writestr('missing.txt', '\n'.join(map(str, missing)) + '\n')
+            zf.close()
+            yield sink.take()
+        finally:
+            # 客户端断开时取消尚未完成的渲染
+            for task in pending.values():
+                task.cancel()
+
+    return StreamingResponse(archive(), media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="reports.zip"'})
+
+async def _pdf_corpus_version(db: AsyncSession, submission_id: int) -> Optional[int]:
+    """Corpus version the PDF for ``submission_id`` is keyed on; None if no such submission"""
+    submission, _, _ = await load_submission(db, submission_id)
+    if submission is None:
+        return None
+    return (await run_in_threadpool(current_snapshot)).version
+
+
+async def _render_report_standalone(submission_id: int) -> str:
+    # 使用独立的数据库会话，请求的会话可能已经关闭
+    async with AsyncSessionLocal() as db:
+        html = await render_report(db, submission_id)
+    if html is None:
+        raise ValueError(f"Submission {submission_id} not found")
+    return html
+
+
+def _submit_pdf(submission_id: int, corpus_version: int, revision: str):
+    # PDF 线程池中的任务把数据库读取交回事件循环执行
+    loop = asyncio.get_running_loop()
+    try:
+        return pdf_pool.submit(submission_id, corpus_version, lambda: asyncio.run_coroutine_threadsafe(
+            _render_report_standalone(submission_id), loop).result(), revision)
+    except PdfQueueFull as e:
+        return JSONResponse(status_code=503, content={"status": "busy", "error": str(e)},
+                            headers={"Retry-After": "5"})
 
-    html_content = generate_report_html(
-        submission=user_data,
-        recommendation=recommend_solution(user_data),
-        cases=parsed_cases
-    )
-    return HTMLResponse(content=html_content)
 
 @app.get("/download_pdf/{submission_id}")
-def download_pdf(submission_id: int, db: Session = Depends(get_db)):
-    submission = db.query(CaseSubmission).filter(CaseSubmission.id == submission_id).first()
-    if not submission:
-        return HTMLResponse(content="Submission not found", status_code=404)
+async def download_pdf(submission_id: int, request: Request, wait: float = PDF_WAIT_SECONDS,
+                       db: AsyncSession = Depends(get_async_db)):
+    """Serve the cached PDF, rendering it on the worker pool if needed.
 
-    # get the result
-    cases = db.query(BlockchainCase).all()
-    matcher = CaseMatcher()
-    user_data = matcher.parse_input(Submission(
-        applicationScenarios=submission.application_scenarios,
-        technicalRequirements=submission.technical_requirements,
-        technologyStack=submission.technology_stack,
-        citySize=submission.city_size,
-        budgetRange=submission.budget_range
-    ))
-    scored = [(matcher.calculate_similarity(user_data, c), c) for c in cases]
-    top_cases = sorted(scored, key=lambda x: -x[0])[:3]
-    parsed_cases = [matcher.parse_case(c[1]) | {'case_name': c[1].case_name} for c in top_cases]
-
-    html = generate_report_html(
-        submission=user_data,
-        recommendation=recommend_solution(user_data),
-        cases=parsed_cases
-    )
-
-    # save the pdf file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmpfile:
-        pdfkit.from_string(html, tmpfile.name)
-        return FileResponse(tmpfile.name, filename=f"report_{submission_id}.pdf", media_type='application/pdf')
\ No newline at end of file
+    Waits up to ``wait`` seconds for the render; after that returns 202 and the
+    job status, to be polled on /pdf_status/{submission_id}.
+    """
+    # PDF 缓存按 (提交, 语料版本, 模板修订) 保存，ETag 与之对应
+    revision = template_revision()
+    tag = etag('pdf', submission_id, (await run_in_threadpool(current_snapshot)).version, revision)
+    headers = {"ETag": tag, "Cache-Control": REPORT_CACHE_CONTROL}
+    not_modified = _not_modified(request, tag, headers)
+    if not_modified is not None:
+        return not_modified
+
+    version = await _pdf_corpus_version(db, submission_id)
+    if version is None:
+        return HTMLResponse(content="Submission not found", status_code=404, headers={"Cache-Control": "no-store"})
+
+    job = _submit_pdf(submission_id, version, revision)
+    if isinstance(job, JSONResponse):
+        return job
+    if not job.done and wait > 0:
+        with stage('pdf_wait'):
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    if job.status == 'done':
+        if etag('pdf', submission_id, version, revision) != tag:
+            headers = {"Cache-Control": "no-store"}
+        return FileResponse(job.path, filename=f"report_{submission_id}.pdf", media_type='application/pdf',
+                            headers=headers)
+    if job.status == 'failed':
+        return JSONResponse(status_code=500, content=job.as_dict())
+    return JSONResponse(status_code=202, content=job.as_dict())
+
+
+@app.get("/pdf_status/{submission_id}")
+async def pdf_status(submission_id: int, db: AsyncSession = Depends(get_async_db)):
+    version = await _pdf_corpus_version(db, submission_id)
+    if version is None:
+        return JSONResponse(status_code=404, content={"status": "not_found"})
+    job = pdf_pool.status(submission_id, version, template_revision())
+    if job is None:
+        return {"submission_id": submission_id, "corpus_version": version, "status": "missing",
+                "queue_depth": pdf_pool.queue_depth()}
+    return {**job.as_dict(), "queue_depth": pdf_pool.queue_depth()}
+
+
+# ------------ Bulk Ingestion ------------
+# 设置后才开放 /admin 接口，请求头 X-Admin-Token 须与之相同
+# 本进程启动的导入任务，按文件名
+ingest_jobs: Dict[str, Ingestion] = {}
+
+
+def _ingest_path(name: str) -> Optional[str]:
+    # 只允许 INGEST_DIR 下的文件名
+    if not name or os.path.basename(name) != name or name.startswith('.'):
+        return None
+    return os.path.join(INGEST_DIR, name)
+
+
+def _ingest_encode(texts: List[str]) -> np.ndarray:
+    # 按编码服务的批大小分块提交，在线请求可以插在两块之间
+    return np.concatenate([encoder.submit(texts[i:i + ENCODER_MAX_BATCH], cached=False).result()
+                           for i in range(0, len(texts), ENCODER_MAX_BATCH)])
+
+
+async def _store_upload(request: Request, path: str):
+    """Stream the request body to ``path`` without holding it in memory"""
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        async for chunk in request.stream():
+            await run_in_threadpool(f.write, chunk)
+    os.replace(tmp_path, path)
+
+
+def _run_ingest(job: Ingestion):
+    try:
+        job.run()
+    except Exception as e:
+        ERRORS.inc(where='ingest')
+        logger.error(f"Ingestion of {job.source} failed: {str(e)}")
+    finally:
+        # 本进程立即换用新快照，其余 worker 由通知或轮询发现
+        snapshots.notify()
+
+
+@app.post("/admin/ingest/{name}")
+async def start_ingest(name: str, request: Request, format: Optional[str] = None, restart: bool = False,
+                       x_admin_token: Optional[str] = Header(None)):
+    """Load INGEST_DIR/{name} (CSV or JSONL) into blockchain_cases in the background.
+
+    A request body is first streamed to that file. Posting again without a
+    body resumes an interrupted run from its checkpoint; ``restart`` loads the
+    file from the beginning. Returns 202 with the job status, to be polled on
+    GET /admin/ingest/{name}.
+    """
+    denied = _check_admin(x_admin_token)
+    if denied is not None:
+        return denied
+    path = _ingest_path(name)
+    if path is None:
+        return JSONResponse(status_code=400, content={"error": f"Invalid file name: {name}"})
+    if format not in (None, 'csv', 'jsonl'):
+        return JSONResponse(status_code=400, content={"error": "format must be csv or jsonl"})
+    running = ingest_jobs.get(name)
+    if running is not None and running.state in ('pending', 'running'):
+        return JSONResponse(status_code=409, content=running.status())
+
+    if request.headers.get('content-length', '0') != '0' or 'transfer-encoding' in request.headers:
+        with stage('ingest_upload'):
+            await _store_upload(request, path)
+    if not os.path.exists(path):
+        return JSONResponse(status_code=404, content={"error": f"{name} not found in the ingest directory"})
+    try:
+        job = Ingestion(engine, BlockchainCase.__table__, scenario_index, _ingest_encode, path,
+                        fmt=format, restart=restart)
+    except IngestError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    ingest_jobs[name] = job
+    threading.Thread(target=_run_ingest, args=(job,), name=f"ingest-{name}", daemon=True).start()
+    return JSONResponse(status_code=202, content=job.status())
+
+
+@app.get("/admin/ingest/{name}")
+async def ingest_status(name: str, x_admin_token: Optional[str] = Header(None),
+                        db: AsyncSession = Depends(get_async_db)):
+    """Status of the ingestion of {name}: the live job in this worker, else its stored checkpoint"""
+    denied = _check_admin(x_admin_token)
+    if denied is not None:
+        return denied
+    job = ingest_jobs.get(name)
+    if job is not None:
+        return job.status()
+    path = _ingest_path(name)
+    row = None
+    if path is not None:
+        row = (await db.execute(select(ingest_checkpoints).where(
+            ingest_checkpoints.c.source == os.path.abspath(path)))).mappings().first()
+    if row is None:
+        return JSONResponse(status_code=404, content={"status": "not_found"})
+    return {**row, "state": "checkpoint", "updated_at": str(row['updated_at'])}
+
+
+# ------------ Profiling ------------
+@app.get("/admin/profiles")
+def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Request profiles kept by this worker, newest first"""
+    denied = _check_admin(x_admin_token)
+    if denied is not None:
+        return denied
+    return {"profiles": PROFILER.list(), **PROFILER.stats}
+
+
+@app.get("/admin/profiles/{profile_id}")
+def download_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """One profile as folded stacks (flamegraph.pl, speedscope)"""
+    denied = _check_admin(x_admin_token)
+    if denied is not None:
+        return denied
+    profile = PROFILER.get(profile_id)
+    if profile is None:
+        return JSONResponse(status_code=404, content={"status": "not_found"})
+    return PlainTextResponse(profile.folded(), headers={
+        "Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'})
@@ -0,0 +1,252 @@
+"""Minimal Prometheus-style metrics and per-request stage timing.
+
+Counters, gauges and histograms render in the Prometheus text format on
+/metrics. ``stage(name)`` times a block into the ``stage_seconds`` histogram
+and, inside a request, into that request's Server-Timing header. With
+METRICS_ENABLED=0 every recording call returns immediately.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .config import env_flag
+from .profiler import attach
+
+METRICS_ENABLED = env_flag('METRICS_ENABLED')
+SERVER_TIMING = env_flag('SERVER_TIMING')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# 当前请求的 (stage, seconds) 列表，由 ServerTimingMiddleware 设置
+_request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('request_stages', default=None)
+
+
+def _labels_key(labelnames: Sequence[str], labels: Dict[str, object]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _labels_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels_key(self.labelnames, labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(Metric):
+    """Set explicitly, or computed at scrape time from ``function`` (no cost on the request path)"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def render(self) -> List[str]:
+        value = self._value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float('nan')
+        if value is None:
+            return []
+        return self.header() + [f"{self.name} {_number(value) if not math.isnan(value) else 'NaN'}"]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _labels_key(self.labelnames, labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {row[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_number(row[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {row[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram('smartcity_stage_seconds', 'Time spent per processing stage', ('stage',))
+HTTP_REQUESTS = REGISTRY.counter('smartcity_http_requests_total', 'HTTP requests', ('method', 'route', 'status'))
+HTTP_SECONDS = REGISTRY.histogram('smartcity_http_request_seconds', 'HTTP request latency', ('method', 'route'))
+CACHE_REQUESTS = REGISTRY.counter('smartcity_cache_requests_total', 'Cache lookups by cache and result',
+                                  ('cache', 'result'))
+ERRORS = REGISTRY.counter('smartcity_errors_total', 'Handled errors by location', ('where',))
+
+
+def cache_result(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as processing stage ``name``.
+
+    Inside a profiled request the calling thread is also sampled into its profile.
+    """
+    if not METRICS_ENABLED:
+        with attach():
+            yield
+        return
+    start = time.perf_counter()
+    try:
+        with attach():
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, elapsed))
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ', '.join(parts)
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: request counters/latency and a Server-Timing header with the request's stages"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stages: List[Tuple[str, float]] = []
+        token = _request_stages.set(stages)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                if SERVER_TIMING:
+                    headers = list(message.get('headers', []))
+                    headers.append((b'server-timing',
+                                    server_timing(stages, time.perf_counter() - start).encode('latin-1')))
+                    message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stages.reset(token)
+            route = scope.get('route')
+            # 用路由模板而不是实际路径作为标签，避免 submission id 造成标签爆炸
+            route = getattr(route, 'path', None) or 'unmatched'
+            HTTP_REQUESTS.inc(method=scope['method'], route=route, status=status[0])
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=scope['method'], route=route)
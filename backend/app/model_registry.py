@@ -0,0 +1,102 @@
+import logging
+import os
+import resource
+import threading
+import time
+from typing import Optional
+
+from .encoders import TextEncoder, TEXT_ENCODER, create_encoder
+
+logger = logging.getLogger(__name__)
+
+
+def resident_memory_bytes() -> int:
+    """Current RSS of this process (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_usage(pid='self') -> dict:
+    """RSS, PSS (shared pages split between the processes mapping them) and private bytes.
+
+    PSS is what a worker really costs when pages are shared; summed over the
+    workers it gives their total footprint. Empty where smaps_rollup is unavailable.
+    """
+    fields = {'Rss': 'rss_bytes', 'Pss': 'pss_bytes', 'Shared_Clean': 'shared_clean_bytes',
+              'Shared_Dirty': 'shared_dirty_bytes', 'Private_Clean': 'private_clean_bytes',
+              'Private_Dirty': 'private_dirty_bytes'}
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in fields:
+                    usage[fields[key]] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return {}
+    if usage:
+        usage['private_bytes'] = usage.get('private_clean_bytes', 0) + usage.get('private_dirty_bytes', 0)
+    return usage
+
+
+class ModelRegistry:
+    """Process-wide holder of the configured text encoder.
+
+    The encoder is loaded at most once per process; concurrent callers block on
+    the first load instead of loading their own copy.
+    """
+
+    def __init__(self, encoder: Optional[TextEncoder] = None, backend: str = TEXT_ENCODER):
+        self.backend = backend
+        self.encoder = encoder if encoder is not None else create_encoder(backend)
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.load_rss_bytes: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self.encoder.name
+
+    def get(self) -> TextEncoder:
+        if self._loaded:
+            return self.encoder
+        with self._lock:
+            if not self._loaded:
+                rss_before = resident_memory_bytes()
+                start = time.perf_counter()
+                self.encoder.load()
+                self.load_seconds = time.perf_counter() - start
+                self.load_rss_bytes = resident_memory_bytes() - rss_before
+                self._loaded = True
+                self.error = None
+        return self.encoder
+
+    def warm_up(self):
+        """Load the encoder and run one encode so lazy initialisation is paid up front"""
+        try:
+            self.get().encode(["warm up"])
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Encoder warm-up failed for {self.name}: {str(e)}")
+
+    def is_ready(self) -> bool:
+        return self._loaded
+
+    def status(self) -> dict:
+        return {
+            'backend': self.backend,
+            'encoder': self.name,
+            'load_seconds': self.load_seconds,
+            'load_rss_bytes': self.load_rss_bytes,
+            'resident_memory_bytes': resident_memory_bytes(),
+            'memory': {'pid': os.getpid(), **memory_usage()},
+            'error': self.error,
+        }
+
+
+registry = ModelRegistry()
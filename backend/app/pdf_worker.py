@@ -0,0 +1,217 @@
+import contextvars
+import glob
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+import pdfkit
+
+from .metrics import ERRORS, cache_result, stage
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = os.environ.get(
+    'PDF_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'pdf_cache')
+)
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', 2))
+PDF_MAX_QUEUE = int(os.environ.get('PDF_MAX_QUEUE', 64))
+# 失败的任务保留这么多秒供状态查询，期间的请求直接得到失败结果，之后再次提交会重新渲染
+PDF_FAILED_TTL = float(os.environ.get('PDF_FAILED_TTL', 30))
+
+
+class PdfQueueFull(Exception):
+    pass
+
+
+class PdfCache:
+    """Size-capped directory of rendered PDFs keyed by (submission id, corpus version, template revision).
+
+    A file's mtime is its last use: hits touch it and eviction removes the
+    oldest files first until the directory fits in ``max_bytes``.
+    """
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, submission_id: int, corpus_version: int, revision: str = '') -> str:
+        suffix = f"_{revision}" if revision else ''
+        return os.path.join(self.directory, f"report_{submission_id}_v{corpus_version}{suffix}.pdf")
+
+    def get(self, submission_id: int, corpus_version: int, revision: str = '') -> Optional[str]:
+        path = self.path_for(submission_id, corpus_version, revision)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, submission_id: int, corpus_version: int, html: str, revision: str = '') -> str:
+        path = self.path_for(submission_id, corpus_version, revision)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            pdfkit.from_string(html, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # 同一提交的旧版本（语料或模板）报告不会再被请求
+        for stale in glob.glob(os.path.join(self.directory, f"report_{submission_id}_v*.pdf")):
+            if stale != path:
+                _remove(stale)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[str] = None):
+        with self._lock:
+            entries = []
+            for path in glob.glob(os.path.join(self.directory, "report_*.pdf")):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path != keep:
+                    _remove(path)
+                    total -= size
+
+
+class PdfJob:
+    __slots__ = ('submission_id', 'corpus_version', 'revision', 'status', 'path', 'error', 'future', 'queued_at',
+                 'finished_at')
+
+    def __init__(self, submission_id: int, corpus_version: int, revision: str = ''):
+        self.submission_id = submission_id
+        self.corpus_version = corpus_version
+        self.revision = revision
+        self.status = 'queued'
+        self.path: Optional[str] = None
+        self.error: Optional[str] = None
+        self.future: Optional[Future] = None
+        self.queued_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def key(self) -> Tuple[int, int, str]:
+        return self.submission_id, self.corpus_version, self.revision
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def as_dict(self) -> dict:
+        return {
+            'submission_id': self.submission_id,
+            'corpus_version': self.corpus_version,
+            'status': self.status,
+            'error': self.error,
+        }
+
+
+class PdfRenderPool:
+    """Bounded pool of wkhtmltopdf renders in front of a PdfCache.
+
+    Requests for a (submission, corpus version, template revision) that is
+    already queued or rendering share the existing job instead of starting
+    another render. A failed job answers for ``failed_ttl`` seconds and is
+    then dropped, so the next request renders again.
+    """
+
+    def __init__(self, cache: PdfCache, workers: int = PDF_WORKERS, max_queue: int = PDF_MAX_QUEUE,
+                 failed_ttl: float = PDF_FAILED_TTL):
+        self.cache = cache
+        self.max_queue = max_queue
+        self.failed_ttl = failed_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-render')
+        self._jobs: Dict[Tuple[int, int, str], PdfJob] = {}
+        self._lock = threading.Lock()
+
+    def _expire_failed(self):
+        # 调用方持有 self._lock
+        cutoff = time.time() - self.failed_ttl
+        for key in [k for k, job in self._jobs.items() if job.status == 'failed' and job.finished_at < cutoff]:
+            del self._jobs[key]
+
+    def submit(self, submission_id: int, corpus_version: int, render_html: Callable[[], str],
+               revision: str = '') -> PdfJob:
+        key = (submission_id, corpus_version, revision)
+        cached = self.cache.get(*key)
+        cache_result('pdf', cached is not None)
+        if cached is not None:
+            job = PdfJob(*key)
+            job.status, job.path = 'done', cached
+            return job
+
+        with self._lock:
+            self._expire_failed()
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            pending = self.queue_depth()
+            if pending >= self.max_queue:
+                raise PdfQueueFull(f"{pending} PDF jobs pending")
+            job = PdfJob(*key)
+            self._jobs[key] = job
+            # 在提交请求的上下文中渲染：请求被剖析时渲染线程也会被采样
+            job.future = self._executor.submit(contextvars.copy_context().run, self._run, job, render_html)
+        return job
+
+    def status(self, submission_id: int, corpus_version: int, revision: str = '') -> Optional[PdfJob]:
+        key = (submission_id, corpus_version, revision)
+        with self._lock:
+            self._expire_failed()
+            job = self._jobs.get(key)
+        if job is not None:
+            return job
+        cached = self.cache.get(*key)
+        if cached is None:
+            return None
+        job = PdfJob(*key)
+        job.status, job.path = 'done', cached
+        return job
+
+    def queue_depth(self) -> int:
+        return sum(1 for job in list(self._jobs.values()) if not job.done)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: PdfJob, render_html: Callable[[], str]):
+        try:
+            job.status = 'rendering'
+            with stage('pdf_render_html'):
+                html = render_html()
+            with stage('pdf_render'):
+                job.path = self.cache.put(job.submission_id, job.corpus_version, html, job.revision)
+            job.finished_at = time.time()
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            # 先记时间再改状态，_expire_failed 看到的失败任务总有 finished_at
+            job.finished_at = time.time()
+            job.status = 'failed'
+            ERRORS.inc(where='pdf_render')
+            logger.error(f"PDF render failed for submission {job.submission_id}: {str(e)}")
+        # 成功的任务之后由缓存回答；失败的任务保留 failed_ttl 秒供状态查询，过期后由 _expire_failed 移除
+        if job.status == 'done':
+            with self._lock:
+                self._jobs.pop(job.key, None)
+        return job
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
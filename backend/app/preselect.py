@@ -0,0 +1,116 @@
+import os
+from typing import Dict, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from .scoring import SECURITY_LEVELS
+
+# 可选的 SQL 硬过滤：逗号分隔，可选 city,budget,security,tps,latency；为空则不启用
+PRESELECT_FILTERS = frozenset(f.strip() for f in os.environ.get('PRESELECT_FILTERS', '').split(',') if f.strip())
+PRESELECT_TPS_WINDOW = float(os.environ.get('PRESELECT_TPS_WINDOW', 1500))  # 3 sigma of the tps gaussian
+PRESELECT_LATENCY_WINDOW = float(os.environ.get('PRESELECT_LATENCY_WINDOW', 300))  # 3 sigma of the latency gaussian
+PRESELECT_SECURITY_DIFF = int(os.environ.get('PRESELECT_SECURITY_DIFF', 1))
+
+# JSON 列中的硬约束字段展开为生成列，便于建 btree 索引
+_SECURITY_CASE = "CASE {} WHEN 'low' THEN 0 WHEN 'medium' THEN 1 WHEN 'high' THEN 2 END"
+# 生成列在写入时计算：字段缺失、不是数字或 JSON 结构不对时取 NULL（不通过过滤），而不是让插入失败
+_POSTGRES_NUMBER = ("CASE WHEN json_typeof({column}) = '{kind}' THEN "
+                    "CASE WHEN ({column}->>{key}) ~ '^-?[0-9]+([.][0-9]+)?([eE][-+]?[0-9]+)?$' "
+                    "THEN ({column}->>{key})::double precision END END")
+_POSTGRES_TEXT = "CASE WHEN json_typeof({column}) = 'object' THEN {column}->>{key} END"
+# SQLite 读取虚拟列时才计算，json_extract 遇到格式错误的 JSON 会让整条查询报错
+_SQLITE_NUMBER = ("CASE WHEN json_valid({column}) THEN CASE WHEN json_type({column}, '{path}') IN ('integer', 'real') "
+                  "THEN json_extract({column}, '{path}') END END")
+_SQLITE_TEXT = "CASE WHEN json_valid({column}) THEN json_extract({column}, '{path}') END"
+
+_POSTGRES_COLUMNS = {
+    'req_tps': "DOUBLE PRECISION GENERATED ALWAYS AS ("
+               + _POSTGRES_NUMBER.format(column='technical_requirements', kind='object', key="'tps'") + ") STORED",
+    'req_latency': "DOUBLE PRECISION GENERATED ALWAYS AS ("
+                   + _POSTGRES_NUMBER.format(column='technical_requirements', kind='object', key="'latency'")
+                   + ") STORED",
+    'req_security': "SMALLINT GENERATED ALWAYS AS ("
+                    + _SECURITY_CASE.format(_POSTGRES_TEXT.format(column='technical_requirements',
+                                                                  key="'security_level'")) + ") STORED",
+    'budget_min': "DOUBLE PRECISION GENERATED ALWAYS AS ("
+                  + _POSTGRES_NUMBER.format(column='budget_range', kind='array', key='0') + ") STORED",
+    'budget_max': "DOUBLE PRECISION GENERATED ALWAYS AS ("
+                  + _POSTGRES_NUMBER.format(column='budget_range', kind='array', key='1') + ") STORED",
+}
+
+_SQLITE_COLUMNS = {
+    'req_tps': "REAL GENERATED ALWAYS AS ("
+               + _SQLITE_NUMBER.format(column='technical_requirements', path='$.tps') + ") VIRTUAL",
+    'req_latency': "REAL GENERATED ALWAYS AS ("
+                   + _SQLITE_NUMBER.format(column='technical_requirements', path='$.latency') + ") VIRTUAL",
+    'req_security': "INTEGER GENERATED ALWAYS AS ("
+                    + _SECURITY_CASE.format(_SQLITE_TEXT.format(column='technical_requirements',
+                                                                path='$.security_level')) + ") VIRTUAL",
+    'budget_min': "REAL GENERATED ALWAYS AS ("
+                  + _SQLITE_NUMBER.format(column='budget_range', path='$[0]') + ") VIRTUAL",
+    'budget_max': "REAL GENERATED ALWAYS AS ("
+                  + _SQLITE_NUMBER.format(column='budget_range', path='$[1]') + ") VIRTUAL",
+}
+
+_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_blockchain_cases_city_size ON blockchain_cases (city_size)",
+    "CREATE INDEX IF NOT EXISTS ix_blockchain_cases_budget ON blockchain_cases (budget_min, budget_max)",
+    "CREATE INDEX IF NOT EXISTS ix_blockchain_cases_security ON blockchain_cases (req_security)",
+    "CREATE INDEX IF NOT EXISTS ix_blockchain_cases_tps ON blockchain_cases (req_tps)",
+    "CREATE INDEX IF NOT EXISTS ix_blockchain_cases_latency ON blockchain_cases (req_latency)",
+]
+
+# 早期版本建过、但没有查询使用的技术栈列和它的 GIN 索引
+_POSTGRES_DROPPED = [
+    "DROP INDEX IF EXISTS ix_blockchain_cases_stack_tags",
+    "ALTER TABLE blockchain_cases DROP COLUMN IF EXISTS stack_tags",
+]
+
+
+def install_preselect_schema(engine: Engine):
+    """Add the generated filter columns and their indexes to blockchain_cases (idempotent)"""
+    postgres = engine.dialect.name == 'postgresql'
+    columns = _POSTGRES_COLUMNS if postgres else _SQLITE_COLUMNS
+    existing = {c['name'] for c in inspect(engine).get_columns('blockchain_cases')}
+    with engine.begin() as conn:
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_xact_lock(4242002)"))
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE blockchain_cases ADD COLUMN {name} {ddl}"))
+        if postgres and 'stack_tags' in existing:
+            for stmt in _POSTGRES_DROPPED:
+                conn.execute(text(stmt))
+        for stmt in _INDEXES:
+            conn.execute(text(stmt))
+
+
+def preselect_clause(user: dict, filters=PRESELECT_FILTERS) -> Tuple[str, Dict[str, object]]:
+    """Turn the user's hard constraints into an indexed WHERE clause over blockchain_cases.
+
+    Returns ("", {}) when no filter is enabled or none applies to ``user``.
+    """
+    clauses, params = [], {}
+    req = user.get('technical_requirements') or {}
+    if 'city' in filters and user.get('city_size'):
+        clauses.append("city_size = :ps_city")
+        params['ps_city'] = user['city_size']
+    if 'budget' in filters:
+        try:
+            budget_min, budget_max = (float(x) for x in user['budget_range'])
+        except (KeyError, TypeError, ValueError):
+            budget_min = budget_max = None
+        if budget_min is not None:
+            clauses.append("budget_min <= :ps_budget_max AND budget_max >= :ps_budget_min")
+            params['ps_budget_min'], params['ps_budget_max'] = budget_min, budget_max
+    if 'security' in filters and req.get('security_level') in SECURITY_LEVELS:
+        level = SECURITY_LEVELS[req['security_level']]
+        clauses.append("req_security BETWEEN :ps_sec_lo AND :ps_sec_hi")
+        params['ps_sec_lo'], params['ps_sec_hi'] = level - PRESELECT_SECURITY_DIFF, level + PRESELECT_SECURITY_DIFF
+    for name, column, window in (('tps', 'req_tps', PRESELECT_TPS_WINDOW),
+                                 ('latency', 'req_latency', PRESELECT_LATENCY_WINDOW)):
+        if name in filters and isinstance(req.get(name), (int, float)):
+            clauses.append(f"{column} BETWEEN :ps_{name}_lo AND :ps_{name}_hi")
+            params[f'ps_{name}_lo'], params[f'ps_{name}_hi'] = req[name] - window, req[name] + window
+    return ' AND '.join(clauses), params
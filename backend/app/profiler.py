@@ -0,0 +1,310 @@
+"""Opt-in stack-sampling profiles of single requests.
+
+A request is profiled when it carries ``X-Profile: 1`` together with a
+valid admin token (``X-Admin-Token``), or, with PROFILE_SLOW_MS set, when it
+is picked at PROFILE_SAMPLE_RATE and then turns out slower than the
+threshold. A token bucket caps profiles per minute: requested profiles are
+charged when they start, sampled ones only when they turn out slow and are
+kept, so fast requests picked for sampling do not use up the budget.
+
+One sampler thread wakes every PROFILE_INTERVAL_MS while a profile is
+running and reads the stacks of the threads attached to it: the event loop
+thread while the request's own task runs on it, and any thread inside a
+``metrics.stage`` block of that request (thread pool work carries the
+request context). Pure-Python hot loops hold the GIL, so the effective rate
+is also bounded by sys.getswitchinterval(). Finished profiles go to a ring
+of the last PROFILE_KEEP, per worker process, rendered in the folded format
+read by flamegraph.pl and speedscope.
+"""
+import asyncio
+import gc
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import env_flag
+
+PROFILE_ENABLED = env_flag('PROFILE_ENABLED')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+# 大于 0 时按 PROFILE_SAMPLE_RATE 抽样请求，只保留耗时超过阈值的
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.1))
+PROFILE_MAX_PER_MINUTE = int(os.environ.get('PROFILE_MAX_PER_MINUTE', 30))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+PROFILE_MAX_DEPTH = 128
+# 不采样的路径：探针、指标和剖析结果本身
+PROFILE_SKIP_PREFIXES = ('/metrics', '/ready', '/admin/profiles')
+
+_request_profile: ContextVar[Optional['Profile']] = ContextVar('request_profile', default=None)
+
+
+def _frame_name(code) -> str:
+    path = code.co_filename.replace('\\', '/').rsplit('/', 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+def fold(frame, thread_name: str) -> str:
+    """Stack of ``frame`` as one folded line prefix: root first, frames separated by ';'"""
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names)).replace('\n', ' ')
+
+
+class Profile:
+    """Sampled stacks of one request"""
+
+    def __init__(self, profile_id: str, method: str, path: str, trigger: str, gc_seconds: float):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.status: Optional[int] = None
+        self.started = time.time()
+        self.duration: Optional[float] = None
+        self.samples: Counter = Counter()
+        self._start = time.perf_counter()
+        self._gc_start = gc_seconds
+        self.gc_seconds = 0.0
+
+    def finish(self, status: int, gc_seconds: float):
+        self.duration = time.perf_counter() - self._start
+        self.status = status
+        # GC 计时是进程级的，并发请求触发的回收也算在内
+        self.gc_seconds = gc_seconds - self._gc_start
+
+    def folded(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(dict(self.samples).items()))
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "pid": os.getpid(), "method": self.method, "path": self.path,
+                "trigger": self.trigger, "status": self.status, "started": self.started,
+                "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+                "gc_ms": round(self.gc_seconds * 1000, 2), "samples": sum(self.samples.values()),
+                "interval_ms": PROFILE_INTERVAL_MS}
+
+
+class Profiler:
+    """Sampler thread, rate limit and ring of finished profiles"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000, keep: int = PROFILE_KEEP,
+                 max_per_minute: int = PROFILE_MAX_PER_MINUTE):
+        self.interval = interval
+        self.max_per_minute = max_per_minute
+        self.profiles: deque = deque(maxlen=keep)
+        # 线程 id -> [(profile, loop, task)]；task 不为 None 时只在该任务运行时采样
+        self._attached: Dict[int, List[Tuple[Profile, object, object]]] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stop: Optional[threading.Event] = None
+        self._tokens = float(max_per_minute)
+        self._refilled = time.monotonic()
+        self._next_id = 0
+        self._gc_seconds = 0.0
+        self._gc_start: Optional[float] = None
+        self.stats = {'started': 0, 'kept': 0, 'discarded': 0, 'rate_limited': 0, 'samples': 0}
+
+    def _acquire(self) -> bool:
+        with self._cond:
+            now = time.monotonic()
+            self._tokens = min(self.max_per_minute, self._tokens + (now - self._refilled) * self.max_per_minute / 60)
+            self._refilled = now
+            if self._tokens < 1:
+                self.stats['rate_limited'] += 1
+                return False
+            self._tokens -= 1
+            return True
+
+    def start(self, method: str, path: str, trigger: str) -> Optional[Profile]:
+        """A new running profile, or None when a requested profile is over the rate limit"""
+        # 抽样的请求此时还不知道慢不慢，到 finish() 决定保留时才扣令牌
+        if trigger == 'header' and not self._acquire():
+            return None
+        with self._cond:
+            self._next_id += 1
+            self.stats['started'] += 1
+            if self._thread is None:
+                self._start_sampler()
+            return Profile(f"{os.getpid()}-{self._next_id}", method, path, trigger, self._gc_seconds)
+
+    def _start_sampler(self):
+        # 第一次剖析时启动采样线程并注册 GC 计时回调，两者各只有一份，由 close() 撤销
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="profile-sampler", daemon=True)
+        self._thread.start()
+        gc.callbacks.append(self._on_gc)
+
+    def close(self):
+        """Stop the sampler thread and unregister the GC callback; a later profile starts them again"""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._stop.set()
+            self._cond.notify_all()
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        thread.join(timeout=1)
+
+    def finish(self, profile: Profile, status: int, slow_ms: float = PROFILE_SLOW_MS):
+        """Stop ``profile``; keep it if it was asked for, or took at least ``slow_ms`` within the rate limit"""
+        profile.finish(status, self._gc_seconds)
+        keep = profile.trigger == 'header' or (profile.duration * 1000 >= slow_ms and self._acquire())
+        with self._cond:
+            if keep:
+                self.profiles.append(profile)
+                self.stats['kept'] += 1
+            else:
+                self.stats['discarded'] += 1
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._cond:
+            return next((p for p in self.profiles if p.id == profile_id), None)
+
+    def list(self) -> List[dict]:
+        with self._cond:
+            return [p.as_dict() for p in reversed(self.profiles)]
+
+    @contextmanager
+    def attached(self, profile: Profile, task=None):
+        """Sample the calling thread into ``profile`` while the block runs"""
+        thread_id = threading.get_ident()
+        entry = (profile, asyncio.get_running_loop() if task is not None else None, task)
+        with self._cond:
+            self._attached.setdefault(thread_id, []).append(entry)
+            self._cond.notify()
+        try:
+            yield
+        finally:
+            with self._cond:
+                entries = self._attached[thread_id]
+                entries.remove(entry)
+                if not entries:
+                    del self._attached[thread_id]
+
+    def _on_gc(self, phase: str, info: dict):
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            self._gc_seconds += time.perf_counter() - self._gc_start
+            self._gc_start = None
+
+    def _run(self, stop: threading.Event):
+        while not stop.is_set():
+            with self._cond:
+                while not self._attached and not stop.is_set():
+                    self._cond.wait()
+                if stop.is_set():
+                    return
+                attached = [(tid, list(entries)) for tid, entries in self._attached.items()]
+            frames = sys._current_frames()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, entries in attached:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack, seen = None, set()
+                for profile, loop, task in entries:
+                    if profile.id in seen or profile.duration is not None or \
+                            (task is not None and _running_task(loop) is not task):
+                        continue
+                    if stack is None:
+                        stack = fold(frame, names.get(thread_id, f"thread-{thread_id}"))
+                    seen.add(profile.id)
+                    profile.samples[stack] += 1
+                    self.stats['samples'] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def _running_task(loop):
+    # 从采样线程读取事件循环当前运行的任务，循环空闲时为 None
+    try:
+        return asyncio.current_task(loop)
+    except RuntimeError:
+        return None
+
+
+PROFILER = Profiler()
+
+
+@contextmanager
+def attach():
+    """Sample the calling thread into the current request's profile, if it is being profiled"""
+    profile = _request_profile.get()
+    if profile is None:
+        yield
+        return
+    # 在事件循环线程上只采样本请求的任务，不采其他请求
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    with PROFILER.attached(profile, task):
+        yield
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: decides which requests to profile and keeps the finished profiles.
+
+    A profiled request answers with an ``X-Profile-Id`` header naming its profile.
+    ``authorize`` checks the ``X-Admin-Token`` of requests asking for a profile;
+    without it the header is ignored, so anonymous clients cannot use up the
+    rate limit or make the server sample their requests.
+    """
+
+    def __init__(self, app, profiler: Profiler = PROFILER,
+                 authorize: Optional[Callable[[Optional[str]], bool]] = None):
+        self.app = app
+        self.profiler = profiler
+        self.authorize = authorize
+
+    def _requested(self, scope) -> bool:
+        wanted, token = False, None
+        for name, value in scope.get('headers', ()):
+            if name == b'x-profile':
+                wanted = value.lower() in (b'1', b'true', b'yes', b'on')
+            elif name == b'x-admin-token':
+                token = value.decode('latin-1')
+        return wanted and self.authorize is not None and self.authorize(token)
+
+    def _trigger(self, scope) -> Optional[str]:
+        if scope['path'].startswith(PROFILE_SKIP_PREFIXES):
+            return None
+        if self._requested(scope):
+            return 'header'
+        if PROFILE_SLOW_MS > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return 'slow'
+        return None
+
+    async def __call__(self, scope, receive, send):
+        trigger = self._trigger(scope) if scope['type'] == 'http' and PROFILE_ENABLED else None
+        profile = self.profiler.start(scope['method'], scope['path'], trigger) if trigger else None
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_id(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                headers = list(message.get('headers', [])) + [(b'x-profile-id', profile.id.encode('latin-1'))]
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        token = _request_profile.set(profile)
+        try:
+            with self.profiler.attached(profile, task=asyncio.current_task()):
+                await self.app(scope, receive, send_with_id)
+        finally:
+            _request_profile.reset(token)
+            self.profiler.finish(profile, status[0])
@@ -1,8 +1,42 @@
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 import os
+import time
+import zipfile
+from typing import Iterable, Iterator, List, Union
+
+from .config import env_flag
 
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
-env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+# 编译后的模板字节码缓存目录，worker 和重启之间共用；为空则不缓存
+TEMPLATE_CACHE_DIR = os.environ.get(
+    'TEMPLATE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'template_cache')
+)
+# 每次取模板时检查文件是否修改过；生产环境模板不变时可以关闭
+TEMPLATE_AUTO_RELOAD = env_flag('TEMPLATE_AUTO_RELOAD')
+# 流式渲染时合并的片段大小
+STREAM_CHUNK_SIZE = int(os.environ.get('REPORT_STREAM_CHUNK', 64 * 1024))
+
+
+def _bytecode_cache():
+    if not TEMPLATE_CACHE_DIR:
+        return None
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    except OSError:
+        # 只读文件系统上照常每个进程编译一次
+        return None
+    return FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+
+# 编译结果留在 env 的模板缓存中，get_template 只在 auto_reload 时检查文件修改时间
+env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), bytecode_cache=_bytecode_cache(),
+                  auto_reload=TEMPLATE_AUTO_RELOAD)
+
+
+def template_revision() -> str:
+    """Changes whenever the report template file does (part of the report ETag)"""
+    return format(os.stat(os.path.join(TEMPLATE_DIR, "report_template.html")).st_mtime_ns, 'x')
 
 
 def generate_report_html(submission: dict, recommendation: dict, cases: list) -> str:
@@ -15,6 +49,58 @@ def generate_report_html(submission: dict, recommendation: dict, cases: list) ->
     )
     return html_content
 
-def save_html_report(html_str: str, output_path: str):
+
+def stream_report_html(submission: dict, recommendation: dict, cases: list,
+                       chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """The report rendered incrementally with ``generate()``, in chunks of about ``chunk_size`` characters"""
+    template = env.get_template("report_template.html")
+    buffer, size = [], 0
+    for part in template.generate(submission=submission, recommendation=recommendation, cases=cases):
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def save_html_report(html: Union[str, Iterable[str]], output_path: str):
+    """Write a rendered report, either a string or the chunks of ``stream_report_html``"""
     with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html_str)
+        if isinstance(html, str):
+            f.write(html)
+        else:
+            f.writelines(html)
+
+
+class ZipSink:
+    """Write-only, unseekable target for ``zipfile.ZipFile``.
+
+    zipfile then writes each entry's sizes in a data descriptor after its data,
+    so the archive can be sent while it is being built: ``take`` returns what
+    was written since the last call.
+    """
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+def write_zip_entry(archive: zipfile.ZipFile, name: str, html: Union[str, Iterable[str]]):
+    """Add a report to ``archive``, compressing it as it is written"""
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    with archive.open(info, 'w') as entry:
+        for chunk in ([html] if isinstance(html, str) else html):
+            entry.write(chunk.encode('utf-8'))
@@ -0,0 +1,61 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+RERANK_TTL_SECONDS = float(os.environ.get('RERANK_TTL_SECONDS', 900))
+RERANK_MAX_ENTRIES = int(os.environ.get('RERANK_MAX_ENTRIES', 1024))
+
+
+class RerankEntry:
+    __slots__ = ('user_data', 'corpus_version', 'positions', 'components', 'expires')
+
+    def __init__(self, user_data: dict, corpus_version: int, positions: np.ndarray,
+                 components: np.ndarray, expires: float):
+        self.user_data = user_data
+        self.corpus_version = corpus_version
+        self.positions = positions  # snapshot positions of the scored candidates
+        self.components = components  # len(positions) x len(COMPONENTS)
+        self.expires = expires
+
+
+class RerankCache:
+    """Per-submission component matrices, so new weights can be applied without rescoring.
+
+    Entries expire ``ttl`` seconds after they were stored and are only valid for
+    the corpus version they were computed against. At most ``max_entries`` are
+    kept; the least recently used one is dropped first.
+    """
+
+    def __init__(self, ttl: float = RERANK_TTL_SECONDS, max_entries: int = RERANK_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[int, RerankEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, submission_id: int, user_data: dict, corpus_version: int,
+            positions: np.ndarray, components: np.ndarray) -> RerankEntry:
+        entry = RerankEntry(user_data, corpus_version, positions, components, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[submission_id] = entry
+            self._entries.move_to_end(submission_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, submission_id: int, corpus_version: int) -> Optional[RerankEntry]:
+        with self._lock:
+            entry = self._entries.get(submission_id)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic() or entry.corpus_version != corpus_version:
+                del self._entries[submission_id]
+                return None
+            self._entries.move_to_end(submission_id)
+            return entry
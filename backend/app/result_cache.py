@@ -0,0 +1,118 @@
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .embedding_cache import normalize_text
+from .tech_vocab import stack_keys
+
+# 0 关闭缓存
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 2048))
+# 数值特征保留的有效数字位数；0 表示不量化，只合并完全相同的提交
+RESULT_CACHE_DIGITS = int(os.environ.get('RESULT_CACHE_DIGITS', 2))
+
+
+def quantize(value, digits: int = RESULT_CACHE_DIGITS):
+    """``value`` rounded to ``digits`` significant digits; non-numbers are returned unchanged.
+
+    Strings are not folded here: the key must not merge submissions that the
+    analysis itself would treat differently (Submission normalises its input).
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    if digits <= 0 or value == 0 or not math.isfinite(value):
+        return float(value)
+    return float(round(value, digits - 1 - math.floor(math.log10(abs(value)))))
+
+
+def submission_key(user_data: dict, weights: Optional[Dict[str, float]],
+                   digits: int = RESULT_CACHE_DIGITS) -> str:
+    """Canonical form of a parsed submission: submissions with the same key get the same ranking"""
+    tech_req = user_data['technical_requirements']
+    return json.dumps([
+        normalize_text(user_data['application_scenarios']),
+        sorted((str(k), quantize(v, digits)) for k, v in tech_req.items()),
+        sorted(stack_keys(user_data['technology_stack'])),
+        user_data['city_size'],
+        [quantize(v, digits) for v in user_data['budget_range']],
+        sorted((k, float(v)) for k, v in weights.items()) if weights else None,
+    ], ensure_ascii=False)
+
+
+class ResultCache:
+    """Rankings of recent submissions, served to later submissions with the same canonical key.
+
+    Numeric features are quantized (see ``quantize``), so a hit returns the
+    cases and scores ranked for the first of several near-identical
+    submissions. Only the ranking and the component matrix it came from are
+    kept (the API stores ``(positions, components, ranked)``, so a hit can
+    seed the rerank cache for the new submission): anything derived from the
+    exact input (match reasons, the rule-based system recommendation) is
+    computed again for each submission. Entries are only valid for the corpus version they were
+    computed against; the whole cache is dropped when the version changes.
+    At most ``max_entries`` are kept; the least recently used one is dropped first.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # key -> (cached result, seconds it took to compute)
+        self._entries: 'OrderedDict[str, Tuple[Any, float]]' = OrderedDict()
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _current(self, corpus_version: int) -> bool:
+        # 语料版本只增不减：新版本清空缓存，旧版本（还在用旧快照的请求）既不读也不写
+        if self._version is None or corpus_version > self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = corpus_version
+        return corpus_version == self._version
+
+    def get(self, key: str, corpus_version: int) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key) if self._current(corpus_version) else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[1]
+            return entry[0]
+
+    def put(self, key: str, corpus_version: int, result: Any, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            if not self._current(corpus_version):
+                return
+            self._entries[key] = (result, seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'corpus_version': self._version,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions, 'invalidations': self.invalidations,
+                'saved_seconds': round(self.saved_seconds, 3),
+                'digits': RESULT_CACHE_DIGITS}
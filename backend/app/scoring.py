@@ -0,0 +1,156 @@
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .tech_vocab import TechVocabulary, popcount
+
+COMPONENTS = ('scenario', 'tech_req', 'tech_stack', 'city_size', 'budget')
+SECURITY_LEVELS = {'low': 0, 'medium': 1, 'high': 2}
+
+
+class CaseColumns:
+    """Columnar store of parsed cases: one array per numeric field, row-aligned.
+
+    ``valid`` marks rows whose technical requirements and budget could be read;
+    the scalar matcher raises on the others, so they must not be scored.
+    Technology stacks are packed bitsets over ``vocab`` ids (``tech_bits``) with
+    the number of distinct technologies per row (``tech_counts``).
+    """
+
+    __slots__ = ('tps', 'latency', 'security', 'budget_min', 'budget_max',
+                 'city_size', 'tech_bits', 'tech_counts', 'vocab', 'valid')
+
+    def __init__(self, tps, latency, security, budget_min, budget_max, city_size, tech_bits, tech_counts,
+                 vocab: TechVocabulary, valid):
+        self.tps = tps
+        self.latency = latency
+        self.security = security
+        self.budget_min = budget_min
+        self.budget_max = budget_max
+        self.city_size = city_size
+        self.tech_bits = tech_bits
+        self.tech_counts = tech_counts
+        self.vocab = vocab
+        self.valid = valid
+
+    def __len__(self):
+        return len(self.tps)
+
+    @classmethod
+    def from_parsed(cls, cases: Sequence[dict], vocab: Optional[TechVocabulary] = None) -> 'CaseColumns':
+        """Columns of parse_case dicts; stack names missing from ``vocab`` are interned into it"""
+        n = len(cases)
+        tps = np.zeros(n)
+        latency = np.zeros(n)
+        security = np.zeros(n, dtype=np.int8)
+        budget_min = np.zeros(n)
+        budget_max = np.zeros(n)
+        valid = np.ones(n, dtype=bool)
+        for i, case in enumerate(cases):
+            try:
+                req = case['technical_requirements']
+                tps[i] = req['tps']
+                latency[i] = req['latency']
+                security[i] = SECURITY_LEVELS[req['security_level']]
+                budget_min[i], budget_max[i] = case['budget_range']
+            except (KeyError, TypeError, ValueError):
+                valid[i] = False
+        city_size = np.array([str(case['city_size']) for case in cases], dtype=object)
+        vocab = vocab if vocab is not None else TechVocabulary()
+        tech_bits, tech_counts = vocab.pack(case['technology_stack'] for case in cases)
+        return cls(tps, latency, security, budget_min, budget_max, city_size, tech_bits, tech_counts, vocab, valid)
+
+    def take(self, positions: np.ndarray) -> 'CaseColumns':
+        return CaseColumns(self.tps[positions], self.latency[positions], self.security[positions],
+                           self.budget_min[positions], self.budget_max[positions],
+                           self.city_size[positions], self.tech_bits[positions], self.tech_counts[positions],
+                           self.vocab, self.valid[positions])
+
+
+def gaussian_similarity(x, y: np.ndarray, sigma: float) -> np.ndarray:
+    return np.exp(- ((x - y) ** 2) / (2 * sigma ** 2))
+
+
+def tech_requirement_scores(user_req: dict, cols: CaseColumns) -> np.ndarray:
+    tps_score = gaussian_similarity(user_req['tps'], cols.tps, sigma=500)
+    latency_score = gaussian_similarity(user_req['latency'], cols.latency, sigma=100)
+    sec_diff = np.abs(SECURITY_LEVELS[user_req['security_level']] - cols.security.astype(np.int64))
+    sec_score = 1 - sec_diff / 2
+    return 0.4 * tps_score + 0.3 * latency_score + 0.3 * sec_score
+
+
+def tech_stack_scores(user_stack: list, cols: CaseColumns) -> np.ndarray:
+    """Jaccard index over canonical technology names, as a popcount of AND-ed bitsets"""
+    query, user_count = cols.vocab.query(user_stack, cols.tech_bits.shape[1])
+    # 只有用户技术栈所在的字需要参与运算
+    words = np.flatnonzero(query)
+    inter = popcount(cols.tech_bits[:, words] & query[words]) if len(words) else np.zeros(len(cols), dtype=np.int64)
+    union = user_count + cols.tech_counts.astype(np.int64) - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def city_size_scores(user_city: str, cols: CaseColumns) -> np.ndarray:
+    return np.where(cols.city_size == user_city, 1.0, 0.3)
+
+
+def budget_scores(user_budget: list, cols: CaseColumns) -> np.ndarray:
+    user_min, user_max = user_budget
+    overlap = np.maximum(0, np.minimum(user_max, cols.budget_max) - np.maximum(user_min, cols.budget_min))
+
+    range_sum = (user_max - user_min) + (cols.budget_max - cols.budget_min)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        range_score = np.where(range_sum > 0, overlap / (range_sum - overlap), 0.0)
+
+    user_center = (user_min + user_max) / 2
+    case_center = (cols.budget_min + cols.budget_max) / 2
+    center_score = 1 - np.abs(user_center - case_center) / np.maximum(np.maximum(user_center, case_center), 1)
+
+    return 0.7 * range_score + 0.3 * center_score
+
+
+def score_cases(user: dict, cols: CaseColumns, scenario_scores: np.ndarray,
+                weights: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Score every row of ``cols`` in one pass.
+
+    Returns the (n_cases, 5) component matrix, columns ordered as COMPONENTS, and
+    the weighted totals. Totals are accumulated column by column in COMPONENTS
+    order, matching the scalar ``sum(scores[k] * weights[k] ...)`` bit for bit.
+    """
+    components = np.column_stack([
+        np.asarray(scenario_scores, dtype=np.float64),
+        tech_requirement_scores(user['technical_requirements'], cols),
+        tech_stack_scores(user['technology_stack'], cols),
+        city_size_scores(user['city_size'], cols),
+        budget_scores(user['budget_range'], cols),
+    ]) if len(cols) else np.empty((0, len(COMPONENTS)))
+    return components, weighted_totals(components, weights)
+
+
+def weighted_totals(components: np.ndarray, weights: Dict[str, float]) -> np.ndarray:
+    totals = np.zeros(len(components))
+    for j, key in enumerate(COMPONENTS):
+        totals += components[:, j] * weights[key]
+    return totals
+
+
+def top_k(totals: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest totals, best first.
+
+    Uses argpartition instead of a full sort; ties are broken by position, the
+    same order a stable descending sort gives.
+    """
+    n = len(totals)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if n > k:
+        kth = totals[np.argpartition(-totals, k - 1)[:k]].min()
+        candidates = np.flatnonzero(totals >= kth)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -totals[candidates]))
+    return candidates[order][:k]
+
+
+def component_breakdown(components: np.ndarray, pos: int) -> Dict[str, float]:
+    return dict(zip(COMPONENTS, components[pos].tolist()))
@@ -0,0 +1,112 @@
+"""Read-only arrays shared between worker processes through memory-mapped .npy files.
+
+A publication is a directory of .npy files plus meta.json. A small pointer
+file names the current one and is swapped with os.replace, so readers see
+either the old or the new publication, never a mix. Loaded with
+mmap_mode='r', every worker maps the same page-cache pages instead of
+holding a private copy. Directories that are replaced stay readable by
+workers that still map them (unlinked files live on until unmapped).
+"""
+import ctypes
+import ctypes.util
+import fcntl
+import gc
+import json
+import logging
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .config import env_flag
+
+logger = logging.getLogger(__name__)
+
+# 关闭后照常读入进程私有内存（对比内存占用时使用）
+SHARED_ARRAYS = env_flag('SHARED_ARRAYS')
+# 每个名称保留的旧版本目录数，供仍在映射旧版本的 worker 过渡
+SHARED_KEEP_VERSIONS = int(os.environ.get('SHARED_KEEP_VERSIONS', 2))
+
+
+def _pointer(directory: str, name: str) -> str:
+    return os.path.join(directory, f"{name}.current")
+
+
+def publish(directory: str, name: str, arrays: Dict[str, np.ndarray], meta: dict) -> str:
+    """Write ``arrays`` and ``meta`` as a new publication of ``name`` and make it current"""
+    os.makedirs(directory, exist_ok=True)
+    target = f"{name}-{uuid.uuid4().hex[:12]}"
+    path = os.path.join(directory, target)
+    os.makedirs(path)
+    for key, array in arrays.items():
+        np.save(os.path.join(path, f"{key}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({**meta, 'arrays': sorted(arrays)}, f)
+
+    tmp_pointer = f"{_pointer(directory, name)}.{os.getpid()}.tmp"
+    with open(tmp_pointer, 'w') as f:
+        f.write(target)
+    os.replace(tmp_pointer, _pointer(directory, name))
+    _prune(directory, name, target)
+    return path
+
+
+def load(directory: str, name: str) -> Optional[Tuple[Dict[str, np.ndarray], dict]]:
+    """(arrays, meta) of the current publication of ``name``; None when there is none"""
+    try:
+        with open(_pointer(directory, name)) as f:
+            path = os.path.join(directory, f.read().strip())
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if SHARED_ARRAYS else None
+        arrays = {key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+                  for key in meta.pop('arrays')}
+    except FileNotFoundError:
+        return None
+    return arrays, meta
+
+
+def current_meta(directory: str, name: str) -> Optional[dict]:
+    """meta.json of the current publication, without mapping its arrays"""
+    try:
+        with open(_pointer(directory, name)) as f:
+            path = os.path.join(directory, f.read().strip())
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def leader_lock(directory: str, name: str):
+    """Exclusive lock across processes: one worker builds a publication, the others wait and reuse it"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{name}.lock"), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def release_memory():
+    """Hand memory freed after building a publication back to the OS (glibc keeps it otherwise)"""
+    gc.collect()
+    try:
+        ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _prune(directory: str, name: str, current: str):
+    # 按修改时间保留最近的几个版本
+    prefix = f"{name}-"
+    old = [d for d in os.listdir(directory)
+           if d.startswith(prefix) and d != current and os.path.isdir(os.path.join(directory, d))
+           and len(d) == len(prefix) + 12]
+    old.sort(key=lambda d: os.path.getmtime(os.path.join(directory, d)), reverse=True)
+    for d in old[max(0, SHARED_KEEP_VERSIONS - 1):]:
+        shutil.rmtree(os.path.join(directory, d), ignore_errors=True)
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Iterable, List, Optional
+
+from sqlalchemy import Table, func, insert, select, text
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .config import env_flag
+from .metrics import ERRORS, REGISTRY, SIZE_BUCKETS, stage
+
+logger = logging.getLogger(__name__)
+
+# 关闭后 /analyze 在返回前等待本次写入落库（仍然走批量写入）
+WRITE_BEHIND = env_flag('WRITE_BEHIND')
+WRITE_BEHIND_INTERVAL_MS = float(os.environ.get('WRITE_BEHIND_INTERVAL_MS', 5))
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', 500))
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 10000))
+# 一批连续写入失败这么多次后丢弃该批（默认间隔下退避合计约 5 秒），不让后面的提交无限等待；
+# 等待这些行的 flush() 会收到 SubmissionsDropped
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get('WRITE_BEHIND_MAX_RETRIES', 10))
+# WRITE_BEHIND=0 时请求等待落库的最长秒数，超时返回 503
+WRITE_FLUSH_TIMEOUT = float(os.environ.get('WRITE_FLUSH_TIMEOUT', 10))
+# 每次从序列预留的 submission id 数量
+SUBMISSION_ID_BLOCK = int(os.environ.get('SUBMISSION_ID_BLOCK', 100))
+
+WRITE_BATCH_ROWS = REGISTRY.histogram('smartcity_write_behind_batch_rows', 'Submissions written per flush',
+                                      buckets=SIZE_BUCKETS)
+
+
+class WriteBacklogFull(Exception):
+    pass
+
+
+class SubmissionsDropped(Exception):
+    """Raised by ``flush(ids=...)`` when some of the awaited submissions were given up on"""
+
+    def __init__(self, submission_ids: List[int]):
+        super().__init__(f"Submissions {', '.join(map(str, submission_ids))} could not be written")
+        self.submission_ids = submission_ids
+
+
+class PendingSubmission:
+    """A submission and its analysis that were accepted but are not committed yet"""
+    __slots__ = ('submission', 'analysis')
+
+    def __init__(self, submission: dict, analysis: dict):
+        self.submission = submission  # case_submissions row, including the reserved id
+        self.analysis = analysis  # analysis_results row
+
+
+class SubmissionWriter:
+    """Write-behind buffer for case_submissions and analysis_results rows.
+
+    Ids are handed out from blocks reserved on the case_submissions sequence,
+    so /analyze can return a stable submission_id before anything is written.
+    A background task collects rows for ``interval_ms`` and inserts them with
+    one executemany per table in a single transaction. Until then readers find
+    them through ``get()``. Rows are lost if the process dies within that
+    window; with WRITE_BEHIND=0 callers ``flush()`` before responding. A batch
+    that still fails after ``max_retries`` attempts is dropped and logged.
+
+    On SQLite there is no sequence: ids continue from MAX(id), which is only
+    safe with a single writer process.
+    """
+
+    def __init__(self, engine: AsyncEngine, submissions: Table, analyses: Table,
+                 interval_ms: float = WRITE_BEHIND_INTERVAL_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING, id_block: int = SUBMISSION_ID_BLOCK,
+                 max_retries: int = WRITE_BEHIND_MAX_RETRIES):
+        self.engine = engine
+        self.submissions = submissions
+        self.analyses = analyses
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.id_block = id_block
+        self.max_retries = max_retries
+        self._pending: Dict[int, PendingSubmission] = {}
+        self._queue: Deque[int] = deque()
+        # 最近被丢弃的 id（有上限），供 flush(ids=...) 判断
+        self._dropped_ids: Dict[int, None] = {}
+        self._ids: Deque[int] = deque()
+        self._next_local_id: Optional[int] = None
+        # 同步原语在首次使用时绑定事件循环，start() 前也可以预留 id
+        self._id_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._written = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Start the flush task on the running event loop"""
+        if self._task is None:
+            # 重新创建，绑定到当前事件循环（应用可能在新的循环上重启）
+            self._id_lock, self._wake, self._written = asyncio.Lock(), asyncio.Event(), asyncio.Condition()
+            self._task = asyncio.get_running_loop().create_task(self._run(), name='submission-writer')
+
+    async def close(self, timeout: float = 10):
+        """Write whatever is buffered, then stop the background task"""
+        if self._task is None:
+            return
+        try:
+            await self.flush(timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Submission writer closed with {len(self._pending)} submissions unwritten")
+        self._task.cancel()
+        self._task = None
+
+    def get(self, submission_id: int) -> Optional[PendingSubmission]:
+        """The buffered rows for ``submission_id``, or None once written (or if unknown)"""
+        return self._pending.get(submission_id)
+
+    async def reserve(self, n: int = 1) -> List[int]:
+        """``n`` fresh submission ids; a database round trip only once per id block"""
+        if len(self._ids) < n:
+            async with self._id_lock:
+                if len(self._ids) < n:
+                    with stage('reserve_ids'):
+                        self._ids.extend(await self._fetch_ids(max(self.id_block, n - len(self._ids))))
+        return [self._ids.popleft() for _ in range(n)]
+
+    async def _fetch_ids(self, n: int) -> List[int]:
+        async with self.engine.connect() as conn:
+            if self.engine.dialect.name == 'postgresql':
+                result = await conn.execute(
+                    text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+                    {'table': self.submissions.name, 'n': n})
+                return sorted(result.scalars())
+            if self._next_local_id is None:
+                self._next_local_id = (await conn.scalar(select(func.max(self.submissions.c.id))) or 0) + 1
+        start, self._next_local_id = self._next_local_id, self._next_local_id + n
+        return list(range(start, start + n))
+
+    def submit(self, submission: dict, analysis: dict):
+        """Buffer the rows of one reserved submission id; the write happens in the background"""
+        if len(self._pending) >= self.max_pending:
+            raise WriteBacklogFull(f"{len(self._pending)} submissions waiting to be written")
+        submission_id = submission['id']
+        self._pending[submission_id] = PendingSubmission(submission, analysis)
+        self._queue.append(submission_id)
+        self.submitted += 1
+        self._wake.set()
+
+    async def flush(self, timeout: Optional[float] = None, ids: Optional[Iterable[int]] = None):
+        """Wait until everything submitted so far, or just the submissions ``ids``, has been written.
+
+        With ``ids``, raises SubmissionsDropped if any of them was dropped instead.
+        """
+        target = self.submitted
+        ids = list(ids) if ids is not None else None
+        self._wake.set()
+
+        def finished() -> bool:
+            if ids is None:
+                return self.written + self.dropped >= target
+            return not any(i in self._pending for i in ids)
+
+        async def written():
+            async with self._written:
+                await self._written.wait_for(finished)
+
+        await asyncio.wait_for(written(), timeout)
+        dropped = [i for i in ids or () if i in self._dropped_ids]
+        if dropped:
+            raise SubmissionsDropped(dropped)
+
+    async def _run(self):
+        failures = 0
+        while True:
+            await self._wake.wait()
+            # 攒批：等待一个间隔，让并发请求的写入合并为一次事务
+            await asyncio.sleep(self.interval)
+            self._wake.clear()
+            while self._queue:
+                try:
+                    await self._flush_batch()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    ERRORS.inc(where='write_behind')
+                    if failures >= self.max_retries:
+                        count = min(self.max_batch, len(self._queue))
+                        logger.error(f"Dropping {count} submissions after {failures} failed attempts: {str(e)}")
+                        await self._done(count, dropped=True)
+                        failures = 0
+                        continue
+                    logger.error(f"Error writing submissions (attempt {failures}): {str(e)}")
+                    await asyncio.sleep(min(5.0, self.interval * 2 ** failures))
+
+    async def _flush_batch(self):
+        batch = [self._pending[i] for i in islice(self._queue, self.max_batch)]
+        try:
+            await self._write(batch)
+        except (DataError, IntegrityError) as e:
+            # 个别行无法写入：逐行重试，丢弃坏行，不阻塞其余提交
+            logger.error(f"Error writing submission batch, retrying row by row: {str(e)}")
+            for p in batch:
+                try:
+                    await self._write([p])
+                except (DataError, IntegrityError) as e:
+                    ERRORS.inc(where='write_behind')
+                    logger.error(f"Dropping submission {p.submission['id']}: {str(e)}")
+                    await self._done(1, dropped=True)
+                else:
+                    await self._done(1)
+            return
+        await self._done(len(batch))
+
+    async def _write(self, batch: List[PendingSubmission]):
+        with stage('write_behind'):
+            async with self.engine.begin() as conn:
+                await conn.execute(insert(self.submissions), [p.submission for p in batch])
+                await conn.execute(insert(self.analyses), [p.analysis for p in batch])
+        WRITE_BATCH_ROWS.observe(len(batch))
+        self.flushes += 1
+
+    async def _done(self, count: int, dropped: bool = False):
+        # 按提交顺序出队
+        for _ in range(count):
+            submission_id = self._queue.popleft()
+            self._pending.pop(submission_id, None)
+            if dropped:
+                self._dropped_ids[submission_id] = None
+        while len(self._dropped_ids) > self.max_pending:
+            del self._dropped_ids[next(iter(self._dropped_ids))]
+        async with self._written:
+            if dropped:
+                self.dropped += count
+            else:
+                self.written += count
+            self._written.notify_all()
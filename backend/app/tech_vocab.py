@@ -0,0 +1,221 @@
+"""Interned technology vocabulary and bitset Jaccard for tech-stack similarity.
+
+Stack entries are canonicalised (Unicode NFKC, case folding, whitespace,
+aliases such as VeChain -> VeChainThor) and interned to dense integer ids.
+A case's stack is a row of packed uint64 words, so the Jaccard index of a
+user stack against every case is one AND plus a popcount per word that the
+user stack touches.
+
+The vocabulary is persisted to TECH_VOCAB_PATH and only ever grows, so ids
+stay stable across snapshot rebuilds and ingestion runs. Snapshots carry the
+vocabulary they were packed with, so every worker decodes the same ids.
+"""
+import json
+import os
+import unicodedata
+from functools import lru_cache
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from . import shared_arrays
+
+TECH_VOCAB_PATH = os.environ.get(
+    'TECH_VOCAB_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'tech_vocab.json')
+)
+# 额外的别名表（JSON 对象：别名 -> 规范名称），与内置别名合并
+TECH_ALIASES_FILE = os.environ.get('TECH_ALIASES_FILE')
+
+# 内置别名：同一技术的不同写法
+DEFAULT_ALIASES = {
+    'VeChain': 'VeChainThor',
+    'EOS': 'EOSIO',
+    'R3 Corda': 'Corda',
+    'IOTA Tangle': 'IOTA',
+    'Fabric': 'Hyperledger Fabric',
+    'Besu': 'Hyperledger Besu',
+    'Indy': 'Hyperledger Indy',
+    'Sawtooth': 'Hyperledger Sawtooth',
+    'Hedera': 'Hedera Hashgraph',
+    'Energy Web': 'Energy Web Chain',
+    'XRP': 'XRP Ledger',
+    'Ripple': 'XRP Ledger',
+    'ETH': 'Ethereum',
+    'Smart Contract': 'Smart Contracts',
+    'NFTs': 'NFT',
+    'ZK-SNARK': 'ZK-SNARKs',
+    'zkSNARKs': 'ZK-SNARKs',
+    'ZKP': 'Zero-Knowledge Proofs',
+    'Zero Knowledge Proofs': 'Zero-Knowledge Proofs',
+    'Internet of Things': 'IoT',
+    'InterPlanetary File System': 'IPFS',
+    'Postgres': 'PostgreSQL',
+    'Mongo': 'MongoDB',
+    'K8s': 'Kubernetes',
+    'Apache Kafka': 'Kafka',
+    'Amazon S3': 'AWS S3',
+    'Web 3': 'Web3',
+    'Web3.0': 'Web3',
+}
+
+
+def fold(name: str) -> str:
+    """Case- and width-insensitive form of a name, whitespace collapsed"""
+    return ' '.join(unicodedata.normalize('NFKC', str(name)).casefold().split())
+
+
+def _load_aliases() -> Dict[str, str]:
+    aliases = dict(DEFAULT_ALIASES)
+    if TECH_ALIASES_FILE:
+        with open(TECH_ALIASES_FILE, encoding='utf-8') as f:
+            aliases.update(json.load(f))
+    return {fold(alias): canonical for alias, canonical in aliases.items()}
+
+
+ALIASES = _load_aliases()
+
+
+@lru_cache(maxsize=65536)
+def canonical_key(name: str) -> str:
+    """Interning key of a stack entry; '' for blank entries"""
+    key = fold(name)
+    target = ALIASES.get(key)
+    return fold(target) if target is not None else key
+
+
+def stack_keys(stack: Iterable[str]) -> List[str]:
+    """Distinct non-blank keys of a stack, in first-seen order"""
+    return list(dict.fromkeys(k for k in map(canonical_key, stack) if k))
+
+
+def jaccard(user_stack: Iterable[str], case_stack: Iterable[str]) -> float:
+    """Jaccard index of two stacks over canonical names"""
+    user, case = set(stack_keys(user_stack)), set(stack_keys(case_stack))
+    union = len(user | case)
+    return len(user & case) / union if union else 0
+
+
+def common_technologies(user_stack: Iterable[str], case_stack: Iterable[str]) -> List[str]:
+    """Entries of ``case_stack`` (its own spelling and order) that ``user_stack`` also names"""
+    user = set(stack_keys(user_stack))
+    common = {}
+    for name in case_stack:
+        key = canonical_key(name)
+        if key in user:
+            common.setdefault(key, name)
+    return list(common.values())
+
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """Set bits per row of a (n, words) uint64 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    # numpy 2.0 之前没有 bitwise_count：按字节查表
+    words = np.ascontiguousarray(words)
+    return _POPCOUNT8[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+class TechVocabulary:
+    """Canonical technology names interned to dense integer ids (append-only)"""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def words(self) -> int:
+        """uint64 words per packed stack"""
+        return max(1, (len(self.names) + 63) // 64)
+
+    def add(self, name: str) -> Optional[int]:
+        """Id of ``name``, interning it if new; None for a blank name"""
+        key = canonical_key(name)
+        if not key:
+            return None
+        i = self._ids.get(key)
+        if i is None:
+            i = self._ids[key] = len(self.names)
+            # 别名记为其规范名称
+            self.names.append(ALIASES.get(fold(name), ' '.join(str(name).split())))
+        return i
+
+    def get(self, name: str) -> Optional[int]:
+        return self._ids.get(canonical_key(name))
+
+    def canonical(self, name: str) -> str:
+        """Registered spelling of ``name``, or the name itself (trimmed) if unknown"""
+        i = self.get(name)
+        return self.names[i] if i is not None else ALIASES.get(fold(name), ' '.join(str(name).split()))
+
+    def pack(self, stacks: Iterable[Iterable[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """(n, words) uint64 bitsets and distinct-technology counts of ``stacks``, interning new names"""
+        rows = [{i for i in map(self.add, stack) if i is not None} for stack in stacks]
+        counts = np.fromiter(map(len, rows), dtype=np.int32, count=len(rows))
+        ids = np.fromiter(chain.from_iterable(rows), dtype=np.uint64, count=int(counts.sum()))
+        bits = np.zeros((len(rows), self.words), dtype=np.uint64)
+        np.bitwise_or.at(bits, (np.repeat(np.arange(len(rows)), counts), (ids >> np.uint64(6)).astype(np.intp)),
+                         np.left_shift(np.uint64(1), ids & np.uint64(63)))
+        return bits, counts
+
+    def query(self, stack: Iterable[str], words: int) -> Tuple[np.ndarray, int]:
+        """Packed bitset of the known names in ``stack`` and its distinct-name count (unknown ones included)"""
+        keys = stack_keys(stack)
+        bits = np.zeros(words, dtype=np.uint64)
+        for key in keys:
+            i = self._ids.get(key)
+            if i is not None and i < words * 64:
+                bits[i >> 6] |= np.uint64(1 << (i & 63))
+        return bits, len(keys)
+
+    def to_dict(self) -> dict:
+        return {'names': self.names}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TechVocabulary':
+        vocab = cls()
+        for name in data.get('names', []):
+            key = canonical_key(name)
+            # 别名表变化后合并的名称保留原 id 位置，不重新编号
+            vocab._ids.setdefault(key, len(vocab.names))
+            vocab.names.append(name)
+        return vocab
+
+    @classmethod
+    def load(cls, path: str = TECH_VOCAB_PATH) -> 'TechVocabulary':
+        try:
+            with open(path, encoding='utf-8') as f:
+                return cls.from_dict(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path: str = TECH_VOCAB_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def grow(cls, names: Iterable[str], path: str = TECH_VOCAB_PATH) -> 'TechVocabulary':
+        """The persisted vocabulary with ``names`` added, saved back if it grew.
+
+        Runs under a file lock, so concurrent processes never hand out the same id twice.
+        """
+        with shared_arrays.leader_lock(os.path.dirname(path) or '.', os.path.basename(path)):
+            vocab = cls.load(path)
+            size = len(vocab)
+            for name in names:
+                vocab.add(name)
+            if len(vocab) > size:
+                vocab.save(path)
+        return vocab
@@ -0,0 +1,109 @@
+"""Recall/latency benchmark of the IVF scenario index against the exact scan.
+
+Run from backend/:  python -m benchmarks.ann_benchmark --cases 200000 --nprobe 1 2 4 8 16 32
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.ann_index import IVFIndex
+from app.embedding_index import _normalise
+
+
+def synthetic_embeddings(n: int, dim: int, clusters: int, spread: float, seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around ``clusters`` random topics, like scenario texts sharing themes"""
+    rng = np.random.default_rng(seed)
+    centers = _normalise(rng.standard_normal((clusters, dim)).astype(np.float32))
+    topic = rng.integers(0, clusters, size=n)
+    noise = rng.standard_normal((n, dim)).astype(np.float32) * spread
+    return _normalise(centers[topic] + noise)
+
+
+def percentiles(samples_ms) -> dict:
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {'p50_ms': round(float(p50), 4), 'p95_ms': round(float(p95), 4), 'p99_ms': round(float(p99), 4)}
+
+
+def exact_search(matrix: np.ndarray, query: np.ndarray, threshold: float, k: int):
+    scores = matrix @ query
+    hit = np.flatnonzero(scores >= threshold)
+    top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+    return hit, top
+
+
+def run(args) -> dict:
+    data = synthetic_embeddings(args.cases + args.queries, args.dim, args.clusters, args.spread, args.seed)
+    matrix, queries = data[:args.cases], data[args.cases:]
+    ids = np.arange(args.cases, dtype=np.int64)
+    hashes = np.array([''] * args.cases, dtype='U40')
+
+    index = IVFIndex('benchmark', directory=args.out_dir, nlist=args.nlist)
+    start = time.perf_counter()
+    index.train(ids, hashes, matrix)
+    build_s = time.perf_counter() - start
+
+    exact_ms, truth = [], []
+    for q in queries:
+        start = time.perf_counter()
+        truth.append(exact_search(matrix, q, args.threshold, args.k))
+        exact_ms.append((time.perf_counter() - start) * 1000)
+    report = {
+        'cases': args.cases, 'dim': args.dim, 'queries': args.queries, 'threshold': args.threshold, 'k': args.k,
+        'nlist': len(index.list_sizes()), 'build_seconds': round(build_s, 3),
+        'mean_threshold_hits': float(np.mean([len(h) for h, _ in truth])),
+        'exact': percentiles(exact_ms),
+        'ivf': [],
+    }
+
+    for nprobe in args.nprobe:
+        ms, threshold_recall, topk_recall = [], [], []
+        for q, (hit, top) in zip(queries, truth):
+            start = time.perf_counter()
+            found, _ = index.search(q, threshold=args.threshold, nprobe=nprobe)
+            ms.append((time.perf_counter() - start) * 1000)
+            if len(hit):
+                threshold_recall.append(np.isin(hit, found).mean())
+            found_k, _ = index.search(q, k=args.k, nprobe=nprobe)
+            topk_recall.append(np.isin(top, found_k).mean())
+        report['ivf'].append({
+            'nprobe': nprobe, **percentiles(ms),
+            'threshold_recall': round(float(np.mean(threshold_recall)), 4) if threshold_recall else None,
+            f'recall_at_{args.k}': round(float(np.mean(topk_recall)), 4),
+            'speedup_p50': round(float(np.percentile(exact_ms, 50) / max(np.percentile(ms, 50), 1e-9)), 2),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--clusters', type=int, default=5000, help='synthetic topics')
+    parser.add_argument('--spread', type=float, default=0.045, help='per-dimension noise around a topic')
+    parser.add_argument('--nlist', type=int, default=0, help='IVF lists (0: sqrt(cases))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--threshold', type=float, default=0.5, help='the app uses 0.6 on real embeddings')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out-dir', default='/tmp', help='only used if the index is saved')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    report = run(args)
+    print(f"{report['cases']} cases x {report['dim']} dims, nlist={report['nlist']}, "
+          f"build {report['build_seconds']}s, {report['mean_threshold_hits']:.1f} threshold hits/query")
+    print(f"exact scan      p50 {report['exact']['p50_ms']:.3f} ms  p95 {report['exact']['p95_ms']:.3f} ms")
+    for row in report['ivf']:
+        print(f"nprobe={row['nprobe']:<4}     p50 {row['p50_ms']:.3f} ms  p95 {row['p95_ms']:.3f} ms  "
+              f"threshold recall {row['threshold_recall']}  recall@{args.k} {row[f'recall_at_{args.k}']}  "
+              f"x{row['speedup_p50']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
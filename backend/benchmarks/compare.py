@@ -0,0 +1,75 @@
+"""Compare two benchmark suite result files and flag regressions.
+
+Run from backend/:  python -m benchmarks.compare baseline.json current.json --tolerance 0.15
+Exits with status 1 when any metric regressed by more than the tolerance.
+"""
+import argparse
+import json
+import sys
+from typing import List
+
+# 越小越好的指标；吞吐量单独处理
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.15,
+            metrics=LATENCY_METRICS, min_ms: float = 0.05) -> List[dict]:
+    """Per-benchmark changes between two suite results.
+
+    A latency regresses when it grows by more than ``tolerance`` (relative) and
+    by more than ``min_ms``; throughput and peak RSS regress when they move
+    the wrong way by more than ``tolerance``.
+    """
+    rows = []
+    old_timings, new_timings = baseline.get('timings', {}), current.get('timings', {})
+    for name in sorted(set(old_timings) & set(new_timings)):
+        old, new = old_timings[name], new_timings[name]
+        for metric in metrics:
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+            change = _change(old[metric], new[metric])
+            rows.append({'benchmark': name, 'metric': metric, 'baseline': old[metric], 'current': new[metric],
+                         'change': change,
+                         'regression': change > tolerance and new[metric] - old[metric] > min_ms})
+        if old.get('throughput_per_s') and new.get('throughput_per_s'):
+            change = _change(old['throughput_per_s'], new['throughput_per_s'])
+            rows.append({'benchmark': name, 'metric': 'throughput_per_s', 'baseline': old['throughput_per_s'],
+                         'current': new['throughput_per_s'], 'change': change, 'regression': change < -tolerance})
+    if baseline.get('peak_rss_bytes') and current.get('peak_rss_bytes'):
+        change = _change(baseline['peak_rss_bytes'], current['peak_rss_bytes'])
+        rows.append({'benchmark': 'process', 'metric': 'peak_rss_bytes', 'baseline': baseline['peak_rss_bytes'],
+                     'current': current['peak_rss_bytes'], 'change': change, 'regression': change > tolerance})
+    return rows
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def print_rows(rows: List[dict]):
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else ''
+        print(f"{row['benchmark']:<36} {row['metric']:<18} {row['baseline']:>14.4f} -> {row['current']:>14.4f}"
+              f"  {row['change']:+7.1%}  {flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get('meta', {}).get('cases') != current.get('meta', {}).get('cases'):
+        print("Warning: the two runs used different corpus sizes")
+    rows = compare(baseline, current, args.tolerance)
+    print_rows(rows)
+    sys.exit(1 if any(r['regression'] for r in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Seeded synthetic blockchain_cases corpus, scaled up from the init.sql seed rows.
+
+Run from backend/:
+    python -m benchmarks.corpus_generator --cases 100k --database-url sqlite:////tmp/bench.db
+    python -m benchmarks.corpus_generator --cases 1m --jsonl /tmp/cases-1m.jsonl
+"""
+import argparse
+import json
+import os
+import random
+from typing import Iterator, List
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from app.corpus import read_seed_cases
+
+SEED_SQL = os.path.join(os.path.dirname(__file__), '..', '..', 'database', 'init.sql')
+SECURITY_LEVELS = ['low', 'medium', 'high']
+CITY_SIZES = ['small', 'medium', 'large']
+_NAME_SUFFIXES = ['Pilot', 'Platform', 'Network', 'Programme', 'Consortium', 'Phase II', 'Rollout', 'Sandbox']
+
+_INSERT = text(
+    "INSERT INTO blockchain_cases (case_name, application_scenarios, technical_requirements, "
+    "technology_stack, city_size, budget_range) VALUES "
+    "(:case_name, :application_scenarios, :technical_requirements, :technology_stack, :city_size, :budget_range)"
+)
+
+
+def parse_size(value: str) -> int:
+    """'1k', '100k', '1m' or a plain integer"""
+    value = value.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+def generate_cases(n: int, seed: int = 0, sql_path: str = SEED_SQL) -> Iterator[dict]:
+    """Yield ``n`` cases perturbed from the seed rows; the same seed gives the same corpus.
+
+    Each case starts from a random seed row: tps/latency/budget are scaled by
+    log-normal noise, the security level, city size and stack occasionally
+    drift, and some scenarios are combined with a second one.
+    """
+    rng = random.Random(seed)
+    seeds = read_seed_cases(sql_path)
+    scenarios = sorted({c['application_scenarios'] for c in seeds})
+    vocabulary = sorted({t for c in seeds for t in c['technology_stack']})
+
+    for i in range(n):
+        base = rng.choice(seeds)
+        req = base['technical_requirements']
+
+        scenario = base['application_scenarios']
+        if rng.random() < 0.2:
+            scenario = f"{scenario}, {rng.choice(scenarios)}"
+
+        security = SECURITY_LEVELS.index(req.get('security_level', 'medium'))
+        if rng.random() < 0.15:
+            security = min(2, max(0, security + rng.choice((-1, 1))))
+
+        stack = list(base['technology_stack'])
+        if stack and rng.random() < 0.3:
+            stack[rng.randrange(len(stack))] = rng.choice(vocabulary)
+        if rng.random() < 0.3:
+            stack.append(rng.choice(vocabulary))
+        stack = list(dict.fromkeys(stack))
+
+        city = base['city_size'] if rng.random() < 0.85 else rng.choice(CITY_SIZES)
+
+        scale = rng.lognormvariate(0, 0.4)
+        budget_min = round(base['budget_range'][0] * scale, -3)
+        budget_max = max(budget_min + 1000, round(base['budget_range'][1] * scale * rng.uniform(0.9, 1.1), -3))
+
+        yield {
+            'case_name': f"{base['case_name']} {rng.choice(_NAME_SUFFIXES)} #{i + 1}",
+            'application_scenarios': scenario,
+            'technical_requirements': {
+                'tps': max(1, round(req.get('tps', 1000) * rng.lognormvariate(0, 0.35))),
+                'latency': max(1, round(req.get('latency', 200) * rng.lognormvariate(0, 0.35))),
+                'security_level': SECURITY_LEVELS[security],
+            },
+            'technology_stack': stack,
+            'city_size': city,
+            'budget_range': [budget_min, budget_max],
+        }
+
+
+def _as_row(case: dict) -> dict:
+    return {**case,
+            'technical_requirements': json.dumps(case['technical_requirements']),
+            'technology_stack': json.dumps(case['technology_stack']),
+            'budget_range': json.dumps(case['budget_range'])}
+
+
+def populate(engine: Engine, n: int, seed: int = 0, chunk: int = 10000, sql_path: str = SEED_SQL) -> int:
+    """Insert ``n`` generated cases into blockchain_cases in executemany chunks; returns n"""
+    batch: List[dict] = []
+    with engine.begin() as conn:
+        for case in generate_cases(n, seed, sql_path):
+            batch.append(_as_row(case))
+            if len(batch) >= chunk:
+                conn.execute(_INSERT, batch)
+                batch = []
+        if batch:
+            conn.execute(_INSERT, batch)
+    return n
+
+
+def write_jsonl(path: str, n: int, seed: int = 0, sql_path: str = SEED_SQL) -> int:
+    with open(path, 'w', encoding='utf-8') as f:
+        for case in generate_cases(n, seed, sql_path):
+            f.write(json.dumps(case) + '\n')
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default='1k', help="number of cases, e.g. 1k, 100k, 1m")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sql', default=SEED_SQL, help='init.sql with the seed cases')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--database-url', help='insert into blockchain_cases of this database (table must exist)')
+    target.add_argument('--jsonl', help='write one JSON case per line to this file')
+    args = parser.parse_args()
+
+    n = parse_size(args.cases)
+    if args.jsonl:
+        write_jsonl(args.jsonl, n, args.seed, args.sql)
+    else:
+        populate(create_engine(args.database_url), n, args.seed, sql_path=args.sql)
+    print(f"Generated {n} cases (seed {args.seed})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""End-to-end benchmark suite over a synthetic corpus.
+
+Run from backend/:
+    python -m benchmarks.suite --cases 100k --out benchmarks/results/100k.json
+    python -m benchmarks.suite --cases 100k --baseline benchmarks/results/100k.json
+
+Builds a corpus with benchmarks.corpus_generator in a local SQLite database (or
+the --database-url stand-in), starts the app in-process and times the scoring
+components, /analyze, /generate_report and /download_pdf. Results are written
+as JSON; with --baseline they are compared and the exit status is 1 on a
+regression.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+
+from .compare import compare, print_rows
+from .corpus_generator import SEED_SQL, generate_cases, parse_size, populate
+
+
+# 应用在本地写入的状态：索引、快照、技术词表和各类缓存；基准运行时全部放进 workdir
+STATE_PATHS = {
+    'EMBEDDING_INDEX_DIR': 'embedding_index',
+    'SNAPSHOT_DIR': 'case_snapshot',
+    'PDF_CACHE_DIR': 'pdf_cache',
+    'TECH_VOCAB_PATH': 'tech_vocab.json',
+    'EMBED_CACHE_PATH': 'embedding_cache.npz',
+    'TEMPLATE_CACHE_DIR': 'template_cache',
+    'INGEST_DIR': 'ingest',
+}
+
+
+def isolated_env(workdir: str) -> dict:
+    """Environment that points every file the app writes at ``workdir`` instead of backend/data"""
+    return {name: os.path.join(workdir, path) for name, path in STATE_PATHS.items()}
+
+
+def summarize(samples_s: List[float], wall_s: float = None) -> dict:
+    """Latency percentiles in ms; throughput is per wall-clock second (sequential sum if not given)"""
+    ms = np.asarray(samples_s) * 1000
+    if not len(ms):
+        return {'n': 0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    wall_s = wall_s if wall_s is not None else float(np.sum(samples_s))
+    return {'n': len(ms), 'mean_ms': round(float(ms.mean()), 4), 'p50_ms': round(float(p50), 4),
+            'p95_ms': round(float(p95), 4), 'p99_ms': round(float(p99), 4),
+            'throughput_per_s': round(len(ms) / wall_s, 2) if wall_s else None}
+
+
+def timed(fn: Callable, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def request_payloads(n: int, seed: int) -> List[dict]:
+    """/analyze payloads drawn from the same generator as the corpus, with a different seed"""
+    payloads = []
+    for case in generate_cases(n, seed + 1):
+        payloads.append({
+            'applicationScenarios': case['application_scenarios'],
+            'technicalRequirements': json.dumps(case['technical_requirements']),
+            'technologyStack': ', '.join(case['technology_stack']),
+            'citySize': case['city_size'],
+            'budgetRange': json.dumps(case['budget_range']),
+        })
+    return payloads
+
+
+def bench_components(main, payloads: List[dict], repeat: int) -> dict:
+    """Vectorised scorers over the whole snapshot, plus the scalar CaseMatcher methods per case"""
+    from app import scoring
+
+    matcher = main.CaseMatcher()
+    users = [matcher.parse_input(main.Submission(**p)) for p in payloads[:repeat]]
+    snapshot = main.snapshots.current()
+    cols = snapshot.columns
+    scenario = np.random.default_rng(0).random(len(snapshot))
+    results = {}
+
+    def per_user(name, fn):
+        it = iter(users * 2)
+        results[name] = summarize(timed(lambda: fn(next(it)), repeat))
+
+    per_user('scoring.tech_requirement_scores', lambda u: scoring.tech_requirement_scores(u['technical_requirements'], cols))
+    per_user('scoring.tech_stack_scores', lambda u: scoring.tech_stack_scores(u['technology_stack'], cols))
+    per_user('scoring.city_size_scores', lambda u: scoring.city_size_scores(u['city_size'], cols))
+    per_user('scoring.budget_scores', lambda u: scoring.budget_scores(u['budget_range'], cols))
+    per_user('scoring.score_cases', lambda u: scoring.score_cases(u, cols, scenario, matcher.weights))
+    totals = scoring.score_cases(users[0], cols, scenario, matcher.weights)[1]
+    results['scoring.top_k'] = summarize(timed(lambda: scoring.top_k(totals, 3), repeat))
+
+    # 标量方法按单个案例计时
+    sample = [snapshot.cases[i].as_dict() for i in
+              random.Random(0).sample(range(len(snapshot)), min(len(snapshot), repeat))]
+    with main.SessionLocal() as db:
+        rows = db.query(main.BlockchainCase).limit(repeat).all()
+    it = iter(rows * 2)
+    results['CaseMatcher.parse_case'] = summarize(timed(lambda: matcher.parse_case(next(it)), len(rows)))
+    for name, fn in (('_tech_requirement_match', lambda u, c: matcher._tech_requirement_match(
+                          u['technical_requirements'], c['technical_requirements'])),
+                     ('_tech_stack_match', lambda u, c: matcher._tech_stack_match(u['technology_stack'],
+                                                                                  c['technology_stack'])),
+                     ('_budget_match', lambda u, c: matcher._budget_match(u['budget_range'], c['budget_range'])),
+                     ('_get_match_reasons', lambda u, c: matcher._get_match_reasons(u, c))):
+        pairs = iter(list(zip(users * (len(sample) // len(users) + 1), sample)) * 2)
+        results[f'CaseMatcher.{name}'] = summarize(timed(lambda: fn(*next(pairs)), len(sample)))
+    return results
+
+
+def bench_endpoints(client, payloads: List[dict], concurrency: int, pdf: bool, pdf_requests: int) -> dict:
+    results = {}
+    sids = []
+
+    def analyze(payload):
+        response = client.post('/analyze', json=payload)
+        response.raise_for_status()
+        return response.json()['submission_id']
+
+    samples = []
+    for payload in payloads:
+        start = time.perf_counter()
+        sids.append(analyze(payload))
+        samples.append(time.perf_counter() - start)
+    results['POST /analyze'] = summarize(samples)
+
+    def timed_call(fn, arg):
+        start = time.perf_counter()
+        fn(arg)
+        return time.perf_counter() - start
+
+    if concurrency > 1:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(lambda p: timed_call(analyze, p), payloads))
+        results[f'POST /analyze x{concurrency}'] = summarize(samples, time.perf_counter() - start)
+
+    def report(sid):
+        client.get(f'/generate_report/{sid}').raise_for_status()
+
+    results['GET /generate_report'] = summarize([timed_call(report, sid) for sid in sids])
+
+    if pdf:
+        def download(sid):
+            response = client.get(f'/download_pdf/{sid}')
+            if response.status_code != 200:
+                raise RuntimeError(f"/download_pdf/{sid} returned {response.status_code}: {response.text[:200]}")
+
+        targets = sids[:pdf_requests]
+        results['GET /download_pdf (render)'] = summarize([timed_call(download, sid) for sid in targets])
+        results['GET /download_pdf (cached)'] = summarize([timed_call(download, sid) for sid in targets])
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        return ''
+
+
+def run(args) -> dict:
+    n = parse_size(args.cases)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='smartcity-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, f'bench-{n}-{args.seed}.db')}"
+    # 必须在导入 app.main 之前设置
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('TEXT_ENCODER', 'hashed')
+    os.environ.setdefault('HASHED_DIM', '384')
+    for name, value in isolated_env(workdir).items():
+        os.environ.setdefault(name, value)
+    # 重复的 /analyze 负载否则大多命中结果缓存，测不到分析流程本身
+    os.environ.setdefault('RESULT_CACHE_MAX_ENTRIES', '0')
+
+    from fastapi.testclient import TestClient
+    from app import main
+
+    with main.engine.connect() as conn:
+        existing = conn.exec_driver_sql("SELECT COUNT(*) FROM blockchain_cases").scalar()
+    start = time.perf_counter()
+    if existing != n:
+        if existing:
+            with main.engine.begin() as conn:
+                conn.exec_driver_sql("DELETE FROM blockchain_cases")
+        populate(main.engine, n, args.seed, sql_path=args.sql)
+    populate_s = time.perf_counter() - start
+
+    payloads = request_payloads(args.requests, args.seed)
+    report = {
+        'meta': {'cases': n, 'seed': args.seed, 'requests': args.requests, 'concurrency': args.concurrency,
+                 'database': main.engine.dialect.name, 'encoder': main.registry.name,
+                 'git_revision': git_revision(), 'python': platform.python_version(), 'numpy': np.__version__,
+                 'machine': platform.machine(), 'cpus': os.cpu_count(), 'started_at': time.time()},
+        'setup': {'populate_seconds': round(populate_s, 3)},
+        'timings': {},
+    }
+
+    with TestClient(main.app) as client:
+        start = time.perf_counter()
+        while client.get('/ready').status_code != 200:
+            if time.perf_counter() - start > args.ready_timeout:
+                raise RuntimeError(f"App not ready after {args.ready_timeout}s: {client.get('/ready').json()}")
+            time.sleep(0.1)
+        report['setup']['warm_up_seconds'] = round(time.perf_counter() - start, 3)
+        report['setup']['ready'] = client.get('/ready').json()
+
+        report['timings'].update(bench_components(main, payloads, args.repeat))
+        pdf = args.pdf if args.pdf is not None else shutil.which('wkhtmltopdf') is not None
+        report['timings'].update(bench_endpoints(client, payloads, args.concurrency, pdf, args.pdf_requests))
+        if not pdf:
+            report['setup']['skipped'] = ['GET /download_pdf: wkhtmltopdf not found (use --pdf to force)']
+
+    report['peak_rss_bytes'] = peak_rss_bytes()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default='1k', help='corpus size, e.g. 1k, 100k, 1m')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sql', default=SEED_SQL, help='init.sql with the seed cases')
+    parser.add_argument('--database-url', help='stand-in database (default: SQLite file in --workdir)')
+    parser.add_argument('--workdir', help='database, index and PDF cache location (default: temp dir)')
+    parser.add_argument('--requests', type=int, default=100, help='/analyze requests per pass')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads for the concurrent /analyze pass')
+    parser.add_argument('--repeat', type=int, default=200, help='iterations per component benchmark')
+    parser.add_argument('--pdf', action=argparse.BooleanOptionalAction, default=None,
+                        help='benchmark /download_pdf (default: if wkhtmltopdf is installed)')
+    parser.add_argument('--pdf-requests', type=int, default=20)
+    parser.add_argument('--ready-timeout', type=float, default=1800)
+    parser.add_argument('--out', help='write the JSON results here')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    report = run(args)
+    for name, stats in report['timings'].items():
+        if stats.get('n'):
+            print(f"{name:<36} n={stats['n']:<5} p50 {stats['p50_ms']:>10.4f} ms  p95 {stats['p95_ms']:>10.4f} ms  "
+                  f"p99 {stats['p99_ms']:>10.4f} ms  {stats['throughput_per_s']:>10} /s")
+    print(f"peak RSS {report['peak_rss_bytes'] / 2 ** 20:.1f} MiB, setup {report['setup']}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(json.load(f), report, args.tolerance)
+        print_rows(rows)
+        if any(r['regression'] for r in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Per-worker memory of a multi-worker deployment, with and without shared memory.
+
+Run from backend/:
+    python -m benchmarks.worker_memory --cases 100k --workers 4
+
+Builds a synthetic corpus (SQLite unless --database-url is given), then starts
+gunicorn twice with the same worker count:
+
+* ``private`` - no preload, SHARED_ARRAYS=0: every worker loads the encoder and
+  builds its own case snapshot and index, as before shared memory
+* ``shared``  - gunicorn.conf.py (encoder preloaded in the master) with the
+  snapshot and embeddings mapped from app.shared_arrays
+
+After all workers report ready and have served /rerank requests, RSS, PSS and
+private memory of the master and of each worker are read from
+/proc/<pid>/smaps_rollup (Linux only).
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List
+
+from .corpus_generator import parse_size, populate
+from .suite import isolated_env
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child_pids(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # 第 4 个字段为父进程号（进程名可能含空格，从右括号之后解析）
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return sorted(children)
+
+
+def request(url: str, body: dict = None, timeout: float = 30):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def prepare_database(database_url: str, n: int, seed: int, submissions: int, workdir: str) -> List[int]:
+    """Populate blockchain_cases and insert ``submissions`` case_submissions rows for /rerank"""
+    os.environ['DATABASE_URL'] = database_url
+    # 导入 app.main 也会创建目录（模板缓存等），同样放进 workdir
+    for name, value in isolated_env(os.path.join(workdir, 'prepare')).items():
+        os.environ.setdefault(name, value)
+    from app.main import engine
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        existing = conn.exec_driver_sql("SELECT COUNT(*) FROM blockchain_cases").scalar()
+    if existing != n:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM blockchain_cases")
+        populate(engine, n, seed)
+    with engine.begin() as conn:
+        ids = list(conn.execute(text("SELECT id FROM case_submissions ORDER BY id LIMIT :n"), {'n': submissions}).scalars())
+        for _ in range(submissions - len(ids)):
+            conn.execute(text(
+                "INSERT INTO case_submissions (application_scenarios, technical_requirements, technology_stack, "
+                "city_size, budget_range) VALUES ('Smart Traffic', :req, 'Hyperledger Fabric, IPFS', 'large', :budget)"),
+                {'req': json.dumps({'tps': 2000, 'latency': 100, 'security_level': 'high'}),
+                 'budget': json.dumps([1000000, 5000000])})
+        ids = list(conn.execute(text("SELECT id FROM case_submissions ORDER BY id LIMIT :n"), {'n': submissions}).scalars())
+    engine.dispose()
+    return ids
+
+
+def run_mode(mode: str, args, database_url: str, submission_ids: List[int], workdir: str) -> dict:
+    port = args.port
+    env = {**os.environ, 'DATABASE_URL': database_url, 'WEB_CONCURRENCY': str(args.workers),
+           'BIND': f'127.0.0.1:{port}', 'LOG_LEVEL': 'WARNING', **isolated_env(os.path.join(workdir, mode)),
+           'SHARED_ARRAYS': '1' if mode == 'shared' else '0'}
+    env.setdefault('TEXT_ENCODER', 'hashed')
+    env.setdefault('HASHED_DIM', '384')
+    shutil.rmtree(os.path.join(workdir, mode), ignore_errors=True)
+    if mode == 'shared':
+        cmd = ['gunicorn', '-c', 'gunicorn.conf.py', 'app.main:app']
+    else:
+        cmd = ['gunicorn', '-w', str(args.workers), '-k', 'uvicorn_worker.UvicornWorker',
+               '-b', f'127.0.0.1:{port}', '--timeout', '600', 'app.main:app']
+    master = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        start = time.perf_counter()
+        ready: Dict[int, float] = {}
+        while len(ready) < args.workers:
+            if master.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {master.returncode}")
+            if time.perf_counter() - start > args.ready_timeout:
+                raise RuntimeError(f"{len(ready)}/{args.workers} workers ready after {args.ready_timeout}s")
+            try:
+                status, body = request(f'{base}/ready', timeout=5)
+            except OSError:
+                status, body = None, None
+            if status == 200:
+                ready.setdefault(body['memory']['pid'], time.perf_counter() - start)
+            else:
+                time.sleep(0.2)
+
+        weights = {'scenario': 0.3, 'tech_req': 0.25, 'tech_stack': 0.2, 'city_size': 0.15, 'budget': 0.1}
+        for i in range(args.requests):
+            request(f'{base}/rerank/{submission_ids[i % len(submission_ids)]}', {'weights': weights})
+
+        from app.model_registry import memory_usage
+        workers = child_pids(master.pid)
+        report = {'master': memory_usage(master.pid),
+                  'workers': {pid: memory_usage(pid) for pid in workers},
+                  'ready_seconds': round(max(ready.values()), 2)}
+        report['total_pss_bytes'] = report['master'].get('pss_bytes', 0) + sum(
+            w.get('pss_bytes', 0) for w in report['workers'].values())
+        return report
+    finally:
+        master.send_signal(signal.SIGTERM)
+        try:
+            master.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            master.kill()
+
+
+def print_report(mode: str, report: dict):
+    mib = 2 ** 20
+    print(f"[{mode}] all workers ready after {report['ready_seconds']} s")
+    rows = [('master', report['master'])] + [(f'worker {pid}', m) for pid, m in report['workers'].items()]
+    for name, m in rows:
+        print(f"  {name:<14} RSS {m.get('rss_bytes', 0) / mib:8.1f} MiB  PSS {m.get('pss_bytes', 0) / mib:8.1f} MiB  "
+              f"private {m.get('private_bytes', 0) / mib:8.1f} MiB")
+    print(f"  total PSS {report['total_pss_bytes'] / mib:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default='100k', help='corpus size, e.g. 1k, 100k, 1m')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='/rerank requests before measuring')
+    parser.add_argument('--database-url', help='stand-in database (default: SQLite file in --workdir)')
+    parser.add_argument('--workdir', help='database, snapshot and index location (default: temp dir)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--modes', default='private,shared')
+    parser.add_argument('--ready-timeout', type=float, default=1800)
+    parser.add_argument('--out', help='write the JSON results here')
+    args = parser.parse_args()
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        sys.exit("smaps_rollup is not available: per-process PSS needs Linux")
+    n = parse_size(args.cases)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='smartcity-memory-')
+    os.makedirs(workdir, exist_ok=True)
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, f'bench-{n}-{args.seed}.db')}"
+    submission_ids = prepare_database(database_url, n, args.seed, submissions=10, workdir=workdir)
+
+    results = {'meta': {'cases': n, 'workers': args.workers, 'encoder': os.environ.get('TEXT_ENCODER', 'hashed')}}
+    for mode in args.modes.split(','):
+        results[mode] = run_mode(mode, args, database_url, submission_ids, workdir)
+        print_report(mode, results[mode])
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Gunicorn settings for running several uvicorn workers that share memory.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master (preload_app) and the encoder weights
+are loaded there before the workers fork, so every worker shares the weight
+pages copy-on-write instead of loading its own copy. The first forward pass
+still happens in each worker: torch's thread pools must not be started before
+fork. Case snapshots and embedding indexes are shared through the memory-mapped
+files in app.shared_arrays.
+"""
+import gc
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'uvicorn_worker.UvicornWorker'
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    from app.main import registry
+    # 只加载权重，不做前向计算
+    registry.get()
+    server.log.info(f"Encoder {registry.name} loaded in master: {registry.status()['memory']}")
+    # 继承的对象移出 GC 跟踪，避免回收扫描写入共享页面
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app.main import engine, async_engine
+    # 连接池中的连接不能跨进程共享
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
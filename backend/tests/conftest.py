@@ -0,0 +1,68 @@
+"""Shared fixtures: the app in-process against a throwaway SQLite database with the seed cases.
+
+Run from backend/:
+    pip install -r requirements-dev.txt
+    python -m pytest
+"""
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from app.corpus import read_seed_cases
+from benchmarks.corpus_generator import SEED_SQL
+from benchmarks.suite import isolated_env
+
+WORKDIR = tempfile.mkdtemp(prefix='smartcity-tests-')
+# 必须在导入 app.main 之前设置：库、索引和缓存都放在临时目录，不碰 backend/data
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'tests.db')}"
+os.environ['TEXT_ENCODER'] = 'hashed'
+os.environ['HASHED_DIM'] = '384'
+os.environ.update(isolated_env(WORKDIR))
+
+
+@pytest.fixture(scope='session')
+def seed_cases():
+    return read_seed_cases(SEED_SQL)
+
+
+@pytest.fixture(scope='session')
+def main(seed_cases):
+    """app.main with blockchain_cases holding the seed corpus"""
+    from sqlalchemy import insert
+    from app import main
+
+    rows = [{**case,
+             'technical_requirements': json.dumps(case['technical_requirements']),
+             'technology_stack': json.dumps(case['technology_stack']),
+             'budget_range': json.dumps(case['budget_range'])} for case in seed_cases]
+    with main.engine.begin() as conn:
+        conn.execute(insert(main.BlockchainCase.__table__), rows)
+    return main
+
+
+@pytest.fixture(scope='session')
+def client(main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        start = time.perf_counter()
+        while client.get('/ready').status_code != 200:
+            if time.perf_counter() - start > 60:
+                raise RuntimeError(f"App not ready: {client.get('/ready').json()}")
+            time.sleep(0.05)
+        yield client
+
+
+@pytest.fixture
+def submission():
+    """A valid /analyze body"""
+    return {
+        'applicationScenarios': 'Healthcare',
+        'technicalRequirements': json.dumps({'tps': 800, 'latency': 300, 'security_level': 'medium'}),
+        'technologyStack': 'Ethereum, Hyperledger Fabric',
+        'citySize': 'medium',
+        'budgetRange': '[3000000, 5000000]',
+    }
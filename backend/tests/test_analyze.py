@@ -0,0 +1,50 @@
+import json
+
+from app.scoring import COMPONENTS
+
+
+def test_analyze(client, submission):
+    response = client.post('/analyze', json=submission)
+    assert response.status_code == 200
+    body = response.json()
+    assert body['submission_id']
+    assert 0 < len(body['recommendations']) <= 3
+    assert set(body['recommendations'][0]['match_breakdown']) == set(COMPONENTS)
+
+
+def test_partial_weights_are_rejected(client, submission):
+    response = client.post('/analyze', json={**submission, 'weights': {'scenario': 0.5}})
+    assert response.status_code == 422
+    assert 'exactly' in response.text
+
+
+def test_full_weights(client, submission):
+    weights = {'scenario': 0.6, 'tech_req': 0.1, 'tech_stack': 0.1, 'city_size': 0.1, 'budget': 0.1}
+    response = client.post('/analyze', json={**submission, 'weights': weights})
+    assert response.status_code == 200
+    assert response.json()['recommendations']
+
+
+def test_batch_reports_partial_weights_per_item(client, submission):
+    response = client.post('/analyze/batch', json=[submission, {**submission, 'weights': {'budget': 1.0}}])
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert 'recommendations' in lines[0]
+    assert 'exactly' in lines[1]['error']
+
+
+def test_result_cache_hit_seeds_rerank_cache(main, client, submission):
+    first = client.post('/analyze', json=submission).json()
+    hits = main.result_cache.hits
+    second = client.post('/analyze', json=submission).json()
+    assert main.result_cache.hits == hits + 1
+    assert second['submission_id'] != first['submission_id']
+
+    version = main.current_snapshot().version
+    entry = main.rerank_cache.get(second['submission_id'], version)
+    assert entry is not None
+    weights = {'scenario': 0.2, 'tech_req': 0.2, 'tech_stack': 0.2, 'city_size': 0.2, 'budget': 0.2}
+    response = client.post(f"/rerank/{second['submission_id']}", json={'weights': weights})
+    assert response.status_code == 200
+    # 命中的分量矩阵与首次提交的一致，没有重新打分
+    assert main.rerank_cache.get(second['submission_id'], version) is entry
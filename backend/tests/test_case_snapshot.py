@@ -0,0 +1,33 @@
+import json
+
+from app.case_snapshot import CaseRecords, ParsedCase
+
+
+def parsed_cases(seed_cases):
+    return [ParsedCase(i + 1, case['case_name'], case) for i, case in enumerate(seed_cases)]
+
+
+def test_records_round_trip(seed_cases):
+    cases = parsed_cases(seed_cases)
+    records = CaseRecords.encode(cases)
+    assert len(records) == len(cases)
+    for case, record in zip(cases, records):
+        assert (record.id, record.case_name) == (case.id, case.case_name)
+        assert record.as_dict() == case.as_dict()
+    assert records[-1].id == cases[-1].id
+
+
+def test_records_decode_once(seed_cases, monkeypatch):
+    encoded = CaseRecords.encode(parsed_cases(seed_cases))
+    records = CaseRecords(encoded.ids, encoded.offsets, encoded.blob, memo=2)
+    calls = []
+    loads = json.loads
+    monkeypatch.setattr(json, 'loads', lambda data: calls.append(data) or loads(data))
+
+    assert records[0] is records[0]
+    assert len(calls) == 1
+    records[1], records[2]
+    # 超出 memo 时淘汰最早解码的位置
+    assert records[2] is records[2] and len(calls) == 3
+    records[0]
+    assert len(calls) == 4
@@ -0,0 +1,18 @@
+import pytest
+
+from app.config import env_flag
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('0', False), ('false', False), ('No', False), (' OFF ', False),
+    ('1', True), ('true', True), ('yes', True), ('', True),
+])
+def test_env_flag(monkeypatch, value, expected):
+    monkeypatch.setenv('SMARTCITY_TEST_FLAG', value)
+    assert env_flag('SMARTCITY_TEST_FLAG') is expected
+
+
+def test_env_flag_default(monkeypatch):
+    monkeypatch.delenv('SMARTCITY_TEST_FLAG', raising=False)
+    assert env_flag('SMARTCITY_TEST_FLAG') is True
+    assert env_flag('SMARTCITY_TEST_FLAG', default=False) is False
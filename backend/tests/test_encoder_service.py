@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from app.embedding_cache import EmbeddingCache
+from app.encoder_service import BatchingEncoder
+
+
+@pytest.fixture
+def seen():
+    return []
+
+
+@pytest.fixture
+def encode(seen):
+    def encode(texts):
+        seen.extend(texts)
+        return np.array([[float(len(t)), 1.0] for t in texts])
+    return encode
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_texts_normalised_on_every_path(encode, seen, tmp_path, cached):
+    encoder = BatchingEncoder(encode, cache=EmbeddingCache('test-model', path=str(tmp_path / 'cache.npz')))
+    try:
+        vectors = encoder.submit(['  Smart   parking ', 'Smart parking'], cached=cached).result(timeout=5)
+    finally:
+        encoder.shutdown()
+    assert set(seen) == {'Smart parking'}
+    np.testing.assert_array_equal(vectors[0], vectors[1])
+
+
+def test_texts_normalised_without_cache(encode, seen):
+    encoder = BatchingEncoder(encode)
+    try:
+        encoder.submit(['\tEnergy  trading\n']).result(timeout=5)
+    finally:
+        encoder.shutdown()
+    assert seen == ['Energy trading']
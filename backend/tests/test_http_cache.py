@@ -0,0 +1,40 @@
+from app.http_cache import etag, etag_matches, negotiate_encoding
+
+
+def test_etag_per_coding():
+    identity = etag('report', 7, 3, 'abc')
+    assert identity == '"report-7-3-abc"'
+    assert etag('report', 7, 3, 'abc', 'gzip') == '"report-7-3-abc-gzip"'
+    assert etag('report', 7, 3, 'abc', 'br') == '"report-7-3-abc-br"'
+    assert etag('pdf', 7, 3) == '"pdf-7-3"'
+
+
+def test_etag_matches_ignores_coding():
+    tag = etag('report', 7, 3, 'abc', 'br')
+    assert etag_matches('"report-7-3-abc-gzip"', tag)
+    assert etag_matches('W/"report-7-3-abc", "other"', tag)
+    assert not etag_matches('"report-7-4-abc-br"', tag)
+    assert not etag_matches(None, tag)
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding('gzip;q=0.5, identity') == 'gzip'
+    assert negotiate_encoding('gzip;q=0') == 'identity'
+    assert negotiate_encoding(None) == 'identity'
+
+
+def test_report_variants_have_distinct_tags(client, submission):
+    sid = client.post('/analyze', json=submission).json()['submission_id']
+    plain = client.get(f'/generate_report/{sid}', headers={'Accept-Encoding': 'identity'})
+    packed = client.get(f'/generate_report/{sid}', headers={'Accept-Encoding': 'gzip'})
+    assert plain.status_code == packed.status_code == 200
+    assert packed.headers['etag'] == plain.headers['etag'][:-1] + '-gzip"'
+    assert packed.headers['content-encoding'] == 'gzip'
+    # httpx 已自动解压
+    assert packed.content == plain.content
+
+    # 用 gzip 版本的标签重新验证未压缩的版本
+    revalidated = client.get(f'/generate_report/{sid}', headers={
+        'Accept-Encoding': 'identity', 'If-None-Match': packed.headers['etag']})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['etag'] == plain.headers['etag']
@@ -0,0 +1,54 @@
+import os
+
+from app import pdf_worker
+from app.pdf_worker import PdfCache, PdfRenderPool
+
+
+def _write_pdf(html, path):
+    with open(path, 'w') as f:
+        f.write(html)
+
+
+def _fail(html, path):
+    raise OSError('wkhtmltopdf exited with 1')
+
+
+def test_failed_job_expires_and_rerenders(tmp_path, monkeypatch):
+    pool = PdfRenderPool(PdfCache(str(tmp_path)), workers=1, failed_ttl=0.05)
+    monkeypatch.setattr(pdf_worker.pdfkit, 'from_string', _fail)
+    job = pool.submit(1, 1, lambda: '<p>x</p>')
+    job.future.result()
+    assert job.status == 'failed'
+    # TTL 内仍返回同一个失败任务
+    assert pool.submit(1, 1, lambda: '<p>x</p>') is job
+    assert pool.status(1, 1) is job
+
+    job.finished_at -= 1
+    assert pool.status(1, 1) is None
+    assert pool._jobs == {}
+
+    monkeypatch.setattr(pdf_worker.pdfkit, 'from_string', _write_pdf)
+    retry = pool.submit(1, 1, lambda: '<p>x</p>')
+    retry.future.result()
+    assert retry.status == 'done'
+    assert pool._jobs == {}
+    pool.shutdown()
+
+
+def test_template_revision_is_part_of_the_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_worker.pdfkit, 'from_string', _write_pdf)
+    cache = PdfCache(str(tmp_path))
+    pool = PdfRenderPool(cache, workers=1)
+    old = pool.submit(3, 2, lambda: 'old', revision='a1')
+    old.future.result()
+    assert pool.status(3, 2, 'a1').path == old.path
+
+    assert pool.status(3, 2, 'b2') is None
+    new = pool.submit(3, 2, lambda: 'new', revision='b2')
+    new.future.result()
+    assert new.path != old.path
+    with open(new.path) as f:
+        assert f.read() == 'new'
+    # 旧模板的 PDF 不会再被请求
+    assert not os.path.exists(old.path)
+    pool.shutdown()
@@ -0,0 +1,38 @@
+from sqlalchemy import create_engine, text
+
+from app.preselect import install_preselect_schema, preselect_clause
+
+ROWS = [
+    ('{"tps": 1000, "latency": 200, "security_level": "high"}', '[100000, 500000]'),
+    ('{"tps": "fast", "latency": 200.5, "security_level": "extreme"}', '[100000]'),
+    ('not json', '{"min": 1}'),
+    ('[1, 2]', '"free"'),
+]
+
+
+def test_generated_columns_tolerate_malformed_json(main, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'preselect.db'}")
+    main.BlockchainCase.__table__.create(engine)
+    install_preselect_schema(engine)
+    install_preselect_schema(engine)
+    with engine.begin() as conn:
+        for tech_req, budget in ROWS:
+            conn.execute(text(
+                "INSERT INTO blockchain_cases (case_name, application_scenarios, technical_requirements, "
+                "technology_stack, city_size, budget_range) VALUES ('c', 's', :req, '[]', 'small', :budget)"),
+                {'req': tech_req, 'budget': budget})
+        rows = conn.execute(text("SELECT req_tps, req_latency, req_security, budget_min, budget_max "
+                                 "FROM blockchain_cases ORDER BY id")).all()
+    assert [tuple(r) for r in rows] == [
+        (1000, 200, 2, 100000, 500000),
+        (None, 200.5, None, 100000, None),
+        (None, None, None, None, None),
+        (None, None, None, None, None),
+    ]
+
+    user = {'city_size': 'small', 'budget_range': [0, 200000],
+            'technical_requirements': {'tps': 900, 'latency': 100, 'security_level': 'high'}}
+    where, params = preselect_clause(user, filters={'city', 'budget', 'security', 'tps', 'latency'})
+    with engine.connect() as conn:
+        ids = conn.execute(text(f"SELECT id FROM blockchain_cases WHERE {where}"), params).scalars().all()
+    assert ids == [1]
@@ -0,0 +1,52 @@
+import gc
+
+from app.profiler import Profiler
+
+
+def test_profile_header_needs_admin_token(main, client, submission, monkeypatch):
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'secret')
+    anonymous = client.post('/analyze', json=submission, headers={'X-Profile': '1'})
+    assert anonymous.status_code == 200
+    assert 'x-profile-id' not in anonymous.headers
+    wrong = client.post('/analyze', json=submission, headers={'X-Profile': '1', 'X-Admin-Token': 'guess'})
+    assert 'x-profile-id' not in wrong.headers
+
+    admin = client.post('/analyze', json=submission, headers={'X-Profile': '1', 'X-Admin-Token': 'secret'})
+    profile_id = admin.headers['x-profile-id']
+    listed = client.get('/admin/profiles', headers={'X-Admin-Token': 'secret'}).json()
+    assert profile_id in [p['id'] for p in listed['profiles']]
+
+
+def test_gc_callback_registered_once():
+    profiler = Profiler(max_per_minute=10)
+    for _ in range(3):
+        profile = profiler.start('GET', '/', 'header')
+        profiler.finish(profile, 200)
+    assert gc.callbacks.count(profiler._on_gc) == 1
+    profiler.close()
+    assert profiler._on_gc not in gc.callbacks
+    # 关闭后再剖析会重新启动采样线程
+    profiler.finish(profiler.start('GET', '/', 'header'), 200)
+    assert gc.callbacks.count(profiler._on_gc) == 1
+    profiler.close()
+
+
+def test_non_ascii_admin_token(main, client, submission, monkeypatch):
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'secret')
+    token = 'sécret'.encode('utf-8')
+    assert client.get('/admin/profiles', headers={'X-Admin-Token': token}).status_code == 401
+    response = client.post('/analyze', json=submission, headers={'X-Profile': '1', 'X-Admin-Token': token})
+    assert response.status_code == 200
+    assert 'x-profile-id' not in response.headers
+
+
+def test_fast_sampled_requests_do_not_use_the_rate_limit():
+    profiler = Profiler(max_per_minute=1)
+    for _ in range(5):
+        profiler.finish(profiler.start('GET', '/', 'slow'), 200, slow_ms=10 ** 6)
+    assert profiler.stats['discarded'] == 5 and profiler.stats['rate_limited'] == 0
+
+    profiler.finish(profiler.start('GET', '/', 'slow'), 200, slow_ms=0)
+    profiler.finish(profiler.start('GET', '/', 'slow'), 200, slow_ms=0)
+    assert profiler.stats['kept'] == 1 and profiler.stats['rate_limited'] == 1
+    profiler.close()
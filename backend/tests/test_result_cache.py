@@ -0,0 +1,56 @@
+import json
+
+from app.result_cache import ResultCache, quantize, submission_key
+
+
+def test_quantize():
+    assert quantize(804) == quantize(796) == 800.0
+    assert quantize(0) == 0.0
+    assert quantize(1234, digits=0) == 1234.0
+    # 字符串原样参与键，不在这里折叠大小写
+    assert quantize('High') == 'High'
+
+
+def test_key_merges_near_identical_submissions():
+    user = {'application_scenarios': ' Healthcare ', 'city_size': 'medium',
+            'technical_requirements': {'tps': 801, 'latency': 300, 'security_level': 'medium'},
+            'technology_stack': ['Ethereum', 'Hyperledger Fabric'], 'budget_range': [3000000, 5000000]}
+    near = {**user, 'application_scenarios': 'Healthcare',
+            'technical_requirements': {**user['technical_requirements'], 'tps': 799},
+            'technology_stack': ['Hyperledger Fabric', 'Ethereum']}
+    assert submission_key(user, None) == submission_key(near, None)
+    assert submission_key(user, None) != submission_key({**user, 'city_size': 'large'}, None)
+
+
+def test_newer_corpus_version_drops_entries():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 1, ['ranked'], 0.5)
+    assert cache.get('a', 1) == ['ranked']
+    assert cache.get('a', 2) is None
+    cache.put('b', 1, ['stale'], 0.5)
+    assert len(cache) == 0 and cache.invalidations == 1
+
+
+def test_hit_recomputes_system_recommendation(main, client, submission):
+    # 两个预算量化后相同，但落在 recommend_solution 的 500000 阈值两侧
+    below = {**submission, 'citySize': 'large', 'applicationScenarios': 'Smart Parking',
+             'budgetRange': '[100000, 500000]'}
+    above = {**below, 'budgetRange': '[100000, 504000]'}
+    hits = main.result_cache.hits
+    first = client.post('/analyze', json=below).json()
+    second = client.post('/analyze', json=above).json()
+    assert main.result_cache.hits == hits + 1
+    assert first['recommendations'] == second['recommendations']
+    assert first['system_recommendation']['blockchain_type'] == 'Private'
+    assert second['system_recommendation']['blockchain_type'] == 'Public'
+
+
+def test_security_level_is_normalised(client, submission):
+    lower = client.post('/analyze', json=submission).json()
+    requirements = {'tps': 800, 'latency': 300, 'security_level': ' High '}
+    mixed = client.post('/analyze', json={**submission, 'technicalRequirements': json.dumps(requirements)})
+    assert mixed.status_code == 200
+    expected = client.post('/analyze', json={
+        **submission, 'technicalRequirements': json.dumps({**requirements, 'security_level': 'high'})}).json()
+    assert mixed.json()['recommendations'] == expected['recommendations']
+    assert mixed.json()['recommendations'] and lower['recommendations']
@@ -0,0 +1,128 @@
+"""The vectorised scorer (scoring.py) must rank exactly like the scalar CaseMatcher path."""
+import json
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from app.scoring import COMPONENTS, CaseColumns, score_cases, top_k, weighted_totals
+
+USERS = [
+    {'application_scenarios': 'Healthcare',
+     'technical_requirements': {'tps': 800, 'latency': 300, 'security_level': 'medium'},
+     'technology_stack': ['Ethereum', 'Hyperledger Fabric'], 'city_size': 'medium',
+     'budget_range': [3000000, 5000000]},
+    {'application_scenarios': 'Supply chain traceability',
+     'technical_requirements': {'tps': 0, 'latency': 50, 'security_level': 'high'},
+     'technology_stack': ['hyperledger-fabric', 'IPFS', 'Corda'], 'city_size': 'large',
+     'budget_range': [1000000, 1000000]},
+    {'application_scenarios': 'Energy trading',
+     'technical_requirements': {'tps': 5000, 'latency': 1000, 'security_level': 'low'},
+     'technology_stack': [], 'city_size': 'small', 'budget_range': [0, 200000]},
+]
+
+WEIGHTS = [None, {'scenario': 0.1, 'tech_req': 0.4, 'tech_stack': 0.1, 'city_size': 0.1, 'budget': 0.3}]
+
+
+def as_case(main, case_id: int, case: dict):
+    return main.BlockchainCase(
+        id=case_id, case_name=case['case_name'], application_scenarios=case['application_scenarios'],
+        technical_requirements=json.dumps(case['technical_requirements']),
+        technology_stack=json.dumps(case['technology_stack']), city_size=case['city_size'],
+        budget_range=json.dumps(case['budget_range']))
+
+
+@pytest.fixture(scope='module')
+def corpus(main, seed_cases):
+    """Seed cases plus edge cases: zero tps, a zero-width budget, and an exact duplicate (a tie)"""
+    extra = [
+        {**seed_cases[0], 'case_name': 'Zero tps',
+         'technical_requirements': {**seed_cases[0]['technical_requirements'], 'tps': 0}},
+        {**seed_cases[1], 'case_name': 'Fixed budget', 'budget_range': [1000000, 1000000]},
+        dict(seed_cases[2]),
+    ]
+    return [as_case(main, i + 1, case) for i, case in enumerate(seed_cases + extra)]
+
+
+def scenario_of(text: str) -> float:
+    # 场景得分在两条路径上由同一函数给出，这里只比较其余维度和加权
+    return (sum(map(ord, text)) % 97) / 97
+
+
+def scalar_components(matcher, user: dict, parsed: dict) -> list:
+    return [
+        scenario_of(parsed['application_scenarios']),
+        matcher._tech_requirement_match(user['technical_requirements'], parsed['technical_requirements']),
+        matcher._tech_stack_match(user['technology_stack'], parsed['technology_stack']),
+        1.0 if user['city_size'] == parsed['city_size'] else 0.3,
+        matcher._budget_match(user['budget_range'], parsed['budget_range']),
+    ]
+
+
+@pytest.mark.parametrize('weights', WEIGHTS)
+@pytest.mark.parametrize('user', USERS)
+def test_vectorised_matches_scalar(main, corpus, monkeypatch, user, weights):
+    matcher = main.CaseMatcher(weights)
+    monkeypatch.setattr(matcher, '_text_match', lambda text1, text2: scenario_of(text2))
+    parsed = [matcher.parse_case(case) for case in corpus]
+    cols = CaseColumns.from_parsed(parsed)
+    assert cols.valid.all()
+
+    scenario = np.array([scenario_of(p['application_scenarios']) for p in parsed])
+    components, totals = score_cases(user, cols, scenario, matcher.weights)
+
+    expected = np.array([scalar_components(matcher, user, p) for p in parsed])
+    assert_allclose(components, expected, rtol=1e-12, atol=1e-15)
+    scalar_totals = [matcher.calculate_similarity(user, case) for case in corpus]
+    assert_allclose(totals, scalar_totals, rtol=1e-12, atol=1e-15)
+    assert_allclose(weighted_totals(components, matcher.weights), totals, rtol=0, atol=0)
+
+    # 与原实现的稳定降序排序一致，得分相同时先出现的案例在前
+    for k in (1, 3, len(corpus)):
+        order = sorted(range(len(corpus)), key=lambda i: scalar_totals[i], reverse=True)[:k]
+        assert top_k(totals, k).tolist() == order
+
+
+def test_ties_keep_corpus_order():
+    totals = np.array([0.5, 0.9, 0.5, 0.9, 0.1, 0.9])
+    assert top_k(totals, 2).tolist() == [1, 3]
+    assert top_k(totals, 4).tolist() == [1, 3, 5, 0]
+    assert top_k(totals, 10).tolist() == [1, 3, 5, 0, 2, 4]
+    assert top_k(totals, 0).tolist() == []
+
+
+@pytest.mark.parametrize('case', [
+    {'technical_requirements': {'tps': 100, 'latency': 100, 'security_level': 'extreme'}},
+    {'technical_requirements': {'tps': 100, 'latency': 100}},
+    {'budget_range': []},
+    {'budget_range': [100000]},
+], ids=['unknown security level', 'missing security level', 'empty budget', 'short budget'])
+def test_unscorable_cases_are_invalid(main, seed_cases, case):
+    """Rows the scalar matcher raises on are marked invalid and never scored"""
+    matcher = main.CaseMatcher()
+    broken = as_case(main, 1, {**seed_cases[0], **case})
+    parsed = matcher.parse_case(broken)
+    with pytest.raises((KeyError, ValueError)):
+        scalar_components(matcher, USERS[0], parsed)
+
+    cols = CaseColumns.from_parsed([matcher.parse_case(as_case(main, 2, seed_cases[1])), parsed])
+    assert cols.valid.tolist() == [True, False]
+
+
+def test_missing_budget_is_invalid(main, seed_cases, monkeypatch):
+    matcher = main.CaseMatcher()
+    monkeypatch.setattr(matcher, '_text_match', lambda text1, text2: scenario_of(text2))
+    broken = as_case(main, 1, seed_cases[0])
+    broken.budget_range = None
+    # parse_case 解析失败时退回空的技术要求
+    with pytest.raises(KeyError):
+        matcher.calculate_similarity(USERS[0], broken)
+    assert not CaseColumns.from_parsed([matcher.parse_case(broken)]).valid[0]
+
+
+def test_components_follow_component_order(main, corpus):
+    matcher = main.CaseMatcher()
+    parsed = [matcher.parse_case(case) for case in corpus]
+    components, _ = score_cases(USERS[0], CaseColumns.from_parsed(parsed), np.zeros(len(parsed)), matcher.weights)
+    assert components.shape == (len(corpus), len(COMPONENTS))
+    assert (components[:, COMPONENTS.index('city_size')] >= 0.3).all()
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.submission_writer import SubmissionWriter, SubmissionsDropped
+
+
+def rows(submission_id: int):
+    return ({'id': submission_id, 'application_scenarios': 'Healthcare'},
+            {'submission_id': submission_id, 'corpus_version': 0, 'recommendations': '[]',
+             'system_recommendation': '{}'})
+
+
+@pytest.fixture
+def new_writer(main):
+    def make(**kwargs):
+        engine = create_async_engine(main.async_database_url(main.DATABASE_URL))
+        return SubmissionWriter(engine, main.CaseSubmission.__table__, main.AnalysisResult.__table__,
+                                interval_ms=1, **kwargs)
+    return make
+
+
+def test_reserve_before_start(new_writer):
+    async def run():
+        writer = new_writer(id_block=5)
+        first = await writer.reserve(2)
+        second = await writer.reserve(1)
+        await writer.engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert second[0] == first[1] + 1
+
+
+def test_failing_batch_is_dropped_after_max_retries(new_writer):
+    async def run():
+        writer = new_writer(max_retries=3)
+        attempts = []
+
+        async def fail(batch):
+            attempts.append(len(batch))
+            raise RuntimeError('database unavailable')
+
+        writer._write = fail
+        writer.start()
+        writer.submit(*rows(10 ** 6))
+        with pytest.raises(SubmissionsDropped) as dropped:
+            await writer.flush(timeout=5, ids=[10 ** 6])
+        assert dropped.value.submission_ids == [10 ** 6]
+        # 不指定 id 时只等待，不报告丢弃
+        await writer.flush(timeout=5)
+        await writer.close()
+        await writer.engine.dispose()
+        return writer, attempts
+
+    writer, attempts = asyncio.run(run())
+    assert attempts == [1, 1, 1]
+    assert (writer.written, writer.dropped, len(writer)) == (0, 1, 0)
+
+
+def test_flush_timeout(new_writer):
+    async def run():
+        writer = new_writer()
+
+        async def hang(batch):
+            await asyncio.sleep(10)
+
+        writer._write = hang
+        writer.start()
+        writer.submit(*rows(10 ** 6 + 1))
+        with pytest.raises(asyncio.TimeoutError):
+            await writer.flush(timeout=0.05)
+        writer._task.cancel()
+        await writer.engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_analyze_answers_503_when_commit_times_out(main, client, submission, monkeypatch):
+    write = main.writer._write
+
+    async def slow(batch):
+        await asyncio.sleep(0.3)
+        await write(batch)
+
+    monkeypatch.setattr(main, 'WRITE_BEHIND', False)
+    monkeypatch.setattr(main, 'WRITE_FLUSH_TIMEOUT', 0.05)
+    monkeypatch.setattr(main.writer, '_write', slow)
+    response = client.post('/analyze', json=submission)
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+
+    monkeypatch.setattr(main, 'WRITE_FLUSH_TIMEOUT', 5)
+    assert client.post('/analyze', json=submission).status_code == 200
+
+
+def test_analyze_fails_when_insert_keeps_failing(main, client, submission, monkeypatch):
+    async def fail(batch):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(main, 'WRITE_BEHIND', False)
+    monkeypatch.setattr(main.writer, 'max_retries', 2)
+    monkeypatch.setattr(main.writer, '_write', fail)
+    response = client.post('/analyze', json=submission)
+    assert response.status_code == 503
+    assert 'could not be written' in response.json()['error']
+
+    batch = client.post('/analyze/batch', json=[submission, submission])
+    assert batch.status_code == 503
@@ -18,6 +18,82 @@ CREATE TABLE IF NOT EXISTS blockchain_cases (
     budget_range JSON NOT NULL   -- [min,max]
 );
 
+-- 硬约束展开为生成列并建索引，供可选的 SQL 预筛选（PRESELECT_FILTERS）使用
+-- 字段缺失、不是数字或 JSON 结构不对时生成 NULL，不让插入失败
+ALTER TABLE blockchain_cases
+    ADD COLUMN IF NOT EXISTS req_tps DOUBLE PRECISION
+        GENERATED ALWAYS AS (CASE WHEN json_typeof(technical_requirements) = 'object' THEN
+            CASE WHEN (technical_requirements->>'tps') ~ '^-?[0-9]+([.][0-9]+)?([eE][-+]?[0-9]+)?$'
+                THEN (technical_requirements->>'tps')::double precision END END) STORED,
+    ADD COLUMN IF NOT EXISTS req_latency DOUBLE PRECISION
+        GENERATED ALWAYS AS (CASE WHEN json_typeof(technical_requirements) = 'object' THEN
+            CASE WHEN (technical_requirements->>'latency') ~ '^-?[0-9]+([.][0-9]+)?([eE][-+]?[0-9]+)?$'
+                THEN (technical_requirements->>'latency')::double precision END END) STORED,
+    ADD COLUMN IF NOT EXISTS req_security SMALLINT
+        GENERATED ALWAYS AS (CASE CASE WHEN json_typeof(technical_requirements) = 'object'
+                THEN technical_requirements->>'security_level' END
+            WHEN 'low' THEN 0 WHEN 'medium' THEN 1 WHEN 'high' THEN 2 END) STORED,
+    ADD COLUMN IF NOT EXISTS budget_min DOUBLE PRECISION
+        GENERATED ALWAYS AS (CASE WHEN json_typeof(budget_range) = 'array' THEN
+            CASE WHEN (budget_range->>0) ~ '^-?[0-9]+([.][0-9]+)?([eE][-+]?[0-9]+)?$'
+                THEN (budget_range->>0)::double precision END END) STORED,
+    ADD COLUMN IF NOT EXISTS budget_max DOUBLE PRECISION
+        GENERATED ALWAYS AS (CASE WHEN json_typeof(budget_range) = 'array' THEN
+            CASE WHEN (budget_range->>1) ~ '^-?[0-9]+([.][0-9]+)?([eE][-+]?[0-9]+)?$'
+                THEN (budget_range->>1)::double precision END END) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_blockchain_cases_city_size ON blockchain_cases (city_size);
+CREATE INDEX IF NOT EXISTS ix_blockchain_cases_budget ON blockchain_cases (budget_min, budget_max);
+CREATE INDEX IF NOT EXISTS ix_blockchain_cases_security ON blockchain_cases (req_security);
+CREATE INDEX IF NOT EXISTS ix_blockchain_cases_tps ON blockchain_cases (req_tps);
+CREATE INDEX IF NOT EXISTS ix_blockchain_cases_latency ON blockchain_cases (req_latency);
+
+-- /analyze 的分析结果，报告和 PDF 直接读取；corpus_version 与当前案例库版本不同时重新计算
+CREATE TABLE IF NOT EXISTS analysis_results (
+    submission_id INTEGER PRIMARY KEY REFERENCES case_submissions(id) ON DELETE CASCADE,
+    corpus_version BIGINT NOT NULL,
+    weights TEXT,                  -- JSON, NULL = default weights
+    recommendations TEXT NOT NULL, -- JSON
+    system_recommendation TEXT NOT NULL, -- JSON
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 案例库版本号：blockchain_cases 每次变更 +1，向量索引等派生数据据此判断是否过期
+CREATE TABLE IF NOT EXISTS corpus_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO corpus_meta (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_corpus_version() RETURNS trigger AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    UPDATE corpus_meta SET version = version + 1 WHERE id = 1 RETURNING version INTO new_version;
+    -- 提交后通知各进程刷新案例快照
+    PERFORM pg_notify('blockchain_cases_changed', new_version::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS blockchain_cases_version ON blockchain_cases;
+CREATE TRIGGER blockchain_cases_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON blockchain_cases
+FOR EACH STATEMENT EXECUTE FUNCTION bump_corpus_version();
+
+-- 批量导入（python -m app.ingest / POST /admin/ingest）的断点：与案例行在同一事务中推进
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+    source TEXT PRIMARY KEY,
+    fingerprint VARCHAR(40) NOT NULL,  -- sha1 of the first 64 KiB
+    byte_offset BIGINT NOT NULL DEFAULT 0,
+    records BIGINT NOT NULL DEFAULT 0,
+    loaded BIGINT NOT NULL DEFAULT 0,
+    rejected BIGINT NOT NULL DEFAULT 0,
+    corpus_version BIGINT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 
 
 INSERT INTO blockchain_cases (case_name, application_scenarios, technical_requirements, technology_stack, city_size, budget_range) VALUES
@@ -1,4 +1,4 @@
-import React, {useState} from 'react';
+import React, {useRef, useState} from 'react';
 import MatchRadar from './components/MatchRadar';
 import WeightSliders from './components/WeightSliders';
 import classNames from 'classnames';
@@ -38,6 +38,60 @@ function App() {
     const [recommendations, setRecommendations] = useState<Recommendation[]>([]);
     const [isLoading, setIsLoading] = useState(false);
     const [error, setError] = useState('');
+    const [submissionId, setSubmissionId] = useState<number | null>(null);
+    const rerankTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
+    const rerankController = useRef<AbortController | null>(null);
+
+    const validateRecommendations = (recs: any[]): Recommendation[] => recs.map((rec: any) => ({
+        ...rec,
+        budget_range: Array.isArray(rec.budget_range)
+            ? rec.budget_range.map(Number)
+            : [0, 0],
+        score: Number(rec.score) || 0
+    }));
+
+    // 取消尚未发出和仍在进行的重排请求，之后到达的旧结果不会覆盖新结果
+    const cancelRerank = () => {
+        if (rerankTimer.current !== null) clearTimeout(rerankTimer.current);
+        rerankTimer.current = null;
+        rerankController.current?.abort();
+        rerankController.current = null;
+    };
+
+    const rerank = async (id: number, newWeights: typeof weights) => {
+        const controller = new AbortController();
+        rerankController.current = controller;
+        try {
+            const response = await fetch(`http://localhost:8000/rerank/${id}`, {
+                method: "POST",
+                headers: {"Content-Type": "application/json"},
+                body: JSON.stringify({weights: newWeights}),
+                signal: controller.signal
+            });
+            // 权重和超过 1 时保留上一次的结果
+            if (!response.ok) return;
+
+            const result = await response.json();
+            if (controller.signal.aborted) return;
+            setRecommendations(validateRecommendations(result.recommendations));
+        } catch (err) {
+            if (!controller.signal.aborted) console.error(err);
+        } finally {
+            if (rerankController.current === controller) rerankController.current = null;
+        }
+    };
+
+    // 分析完成后调整权重只重新排序，不再重新提交分析；拖动滑块时只发送停下后的最后一组权重
+    const handleWeightsChange = (newWeights: typeof weights) => {
+        setWeights(newWeights);
+        if (submissionId === null) return;
+
+        cancelRerank();
+        rerankTimer.current = setTimeout(() => {
+            rerankTimer.current = null;
+            rerank(submissionId, newWeights);
+        }, 150);
+    };
 
     const handleChange = (e: React.ChangeEvent<HTMLInputElement | HTMLTextAreaElement | HTMLSelectElement>) => {
         const {name, value} = e.target;
@@ -82,6 +136,7 @@ function App() {
     };
 
     const handleAnalyze = async () => {
+        cancelRerank();
         setIsLoading(true);
         setError('');
 
@@ -110,17 +165,10 @@ function App() {
 
             const result = await response.json();
 
-            const validatedRecs = result.recommendations.map((rec: any) => ({
-                ...rec,
-                budget_range: Array.isArray(rec.budget_range)
-                    ? rec.budget_range.map(Number)
-                    : [0, 0],
-                score: Number(rec.score) || 0
-            }));
-
-            setRecommendations(validatedRecs);
+            setRecommendations(validateRecommendations(result.recommendations));
 
             const submissionId = result.submission_id;
+            setSubmissionId(submissionId);
             const link = document.createElement('a');
             link.href = `http://localhost:8000/download_pdf/${submissionId}`;
             link.download = `report_${submissionId}.pdf`;
@@ -251,7 +299,7 @@ function App() {
                         {/* 权重调节器 */}
                         <div className="pt-4">
                             <h4 className="text-lg font-medium mb-4">Adjust Match Weights</h4>
-                            <WeightSliders weights={weights} onChange={setWeights}/>
+                            <WeightSliders weights={weights} onChange={handleWeightsChange}/>
                         </div>
 
                         {/* 分析按钮 */}